@@ -0,0 +1,86 @@
+"""
+JSON decode throughput for a large routers page.
+
+Compares the original decoder (dateutil and html.unescape applied to every
+string of every object) with the current decoder using the standard library
+parser and, when installed, a C JSON parser.
+
+    python bench/decode.py [--routers N] [--runs N]
+"""
+
+import argparse
+import html
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakeecm  # noqa
+from ecmcli import api  # noqa
+import syndicate.data  # noqa
+
+
+class LegacyDecoder(syndicate.data.NormalJSONDecoder):
+    """ The decoder used before the fast path was added. """
+
+    def parse_object(self, data):
+        data = super().parse_object(data)
+        for key, value in data.items():
+            if isinstance(value, str):
+                data[key] = html.unescape(value)
+        return data
+
+
+def make_page(routers):
+    fleet = fakeecm.Fleet(routers=routers, alerts=0)
+    for i, x in enumerate(fleet.stores['routers'].values()):
+        if not i % 10:
+            x['desc'] = 'Store &amp; Warehouse #%d' % i
+    data, meta = fleet.listing(['routers'], list(fleet.stores['routers']
+                               .values()), {"limit": str(routers),
+                                            "expand": 'account,group'})
+    return json.dumps({"success": True, "data": data, "meta": meta})
+
+
+def timeit(decode, body, runs):
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        decode(body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip()
+                                     .split('\n')[0])
+    parser.add_argument('--routers', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    body = make_page(args.routers)
+    decoders = [
+        ('legacy', LegacyDecoder().decode),
+        ('stdlib', api.HTMLJSONDecoder().decode)
+    ]
+    if api.fastjson is not None:
+        decoders.append((api.fastjson.__name__,
+                         api.HTMLJSONDecoder(api.fastjson.loads).decode))
+    expected = decoders[0][1](body)
+    mb = len(body) / 2**20
+    print('Page: %d routers, %.1f MB' % (args.routers, mb))
+    print('%-10s %10s %10s %12s %8s' % ('Decoder', 'Time (s)', 'MB/s',
+                                        'Routers/s', 'Speedup'))
+    baseline = None
+    for name, decode in decoders:
+        if decode(body) != expected:
+            raise SystemExit('%s decoder output differs' % name)
+        elapsed = timeit(decode, body, args.runs)
+        baseline = baseline or elapsed
+        print('%-10s %10.3f %10.1f %12.0f %7.1fx' % (name, elapsed,
+              mb / elapsed, args.routers / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,892 @@
+"""
+A local stand-in for the ECM API.
+
+Serves a generated fleet of accounts, groups, routers, users, alerts and
+logs along with the remote (router status, config and terminal) API so
+commands can be run and measured without cradlepointecm.com.  Fleet size
+and per request latency are configurable.  Any username and password are
+accepted.  Responses are gzipped for clients that accept it unless
+--no-gzip is used.
+
+    python bench/fakeecm.py --routers 1000 --latency 0.05 --port 8000
+    ecm --api_site http://127.0.0.1:8000 --api_username x --api_password x
+"""
+
+import argparse
+import collections
+import copy
+import datetime
+import gzip
+import hashlib
+import http.server
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+
+prefix = '/api/v1'
+uri_match = re.compile('^%s/([a-z_]+)/([0-9]+)/$' % prefix)
+iso_space = re.compile('^(\d{4}-\d{2}-\d{2}) ')
+levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+alert_types = ['connection_state', 'wan_service_type', 'config_change',
+               'firmware_upgrade', 'ethernet_wan_connected',
+               'ethernet_wan_disconnected', 'unrecognized_device']
+log_sources = ['wan.manager', 'lan.dhcpd', 'system', 'services.ecm',
+               'wlan.driver', 'firewall']
+vendor_ouis = [0x000393, 0x001b63, 0x003044, 0x0050f2, 0x00e04c, 0x3c5ab4,
+               0x000c29]
+products = ['MBR1400', 'IBR600', 'IBR650', 'CBA850', 'AER2100']
+firmwares = ['5.4.0', '5.4.1', '6.0.0', '6.0.1']
+
+
+def uri(resource, ident):
+    return '%s/%s/%s/' % (prefix, resource, ident)
+
+
+def isotime(dt):
+    return dt.isoformat()
+
+
+class Fleet(object):
+    """ The generated data set and the logic for querying it the way the
+    ECM API does;  Paging, filters (field__op=value), `_or`, `expand`,
+    `fields`, `order_by` and `count`. """
+
+    def __init__(self, routers=100, accounts=10, groups=10, users=10,
+                 alerts=1000, logs=50, clients=5, offline=0.1, seed=0,
+                 log_rate=0):
+        self.rand = random.Random(seed)
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.epoch = time.time()
+        self.now = datetime.datetime.now(datetime.timezone.utc) \
+                                    .replace(microsecond=0)
+        self.clients = clients
+        self.logs_per_router = logs
+        self.log_rate = log_rate
+        self.log_growth = {}
+        self.stores = collections.defaultdict(collections.OrderedDict)
+        self.router_states = {}
+        self.router_logs = {}
+        self.terminals = {}
+        self.next_id = collections.Counter()
+        self.generate(routers, accounts, groups, users, alerts, offline)
+
+    def add(self, resource, obj):
+        self.next_id[resource] += 1
+        ident = str(self.next_id[resource])
+        obj.update(id=ident, resource_uri=uri(resource, ident))
+        self.stores[resource][ident] = obj
+        return obj
+
+    def ago(self, max_seconds):
+        delta = datetime.timedelta(seconds=self.rand.randint(0, max_seconds))
+        return isotime(self.now - delta)
+
+    def generate(self, routers, accounts, groups, users, alerts, offline):
+        rand = self.rand
+        for name in products:
+            self.add('products', {"name": name})
+        for version in firmwares:
+            self.add('firmwares', {"version": version})
+        product_uris = list(self.stores['products'])
+        firmware_uris = list(self.stores['firmwares'])
+        for i in range(max(1, accounts)):
+            parent = None
+            if i:
+                parent = uri('accounts', rand.randint(1, i))
+            account = self.add('accounts', {
+                "name": 'account-%d' % (i + 1),
+                "account": parent,
+                "groups": [],
+                "customer": {
+                    "customer_name": 'Customer %d' % (i + 1),
+                    "contact_name": 'Contact %d' % (i + 1)
+                },
+                "settings_bindings": '%s/settings_bindings/?account=%d' % (
+                                     prefix, i + 1)
+            })
+            for kind, resource in (('routers', 'routers'),
+                                   ('user_profiles', 'profiles'),
+                                   ('subaccounts', 'accounts')):
+                account[kind] = '%s/%s/?account=%s' % (prefix, resource,
+                                                       account['id'])
+        account_ids = list(self.stores['accounts'])
+        for i in range(groups):
+            account = rand.choice(account_ids)
+            group = self.add('groups', {
+                "name": 'group-%d' % (i + 1),
+                "account": uri('accounts', account),
+                "product": uri('products', rand.choice(product_uris)),
+                "target_firmware": uri('firmwares',
+                                       rand.choice(firmware_uris)),
+                "configuration": [{}, []],
+                "settings_bindings": '%s/settings_bindings/?group=%d' % (
+                                     prefix, i + 1),
+                "statistics": collections.Counter()
+            })
+            self.stores['accounts'][account]['groups'].append(
+                group['resource_uri'])
+        group_ids = list(self.stores['groups'])
+        for i in range(routers):
+            group = rand.choice(group_ids) if group_ids and \
+                    rand.random() < 0.8 else None
+            if group:
+                account = self.stores['groups'][group]['account']
+                product = self.stores['groups'][group]['product']
+            else:
+                account = uri('accounts', rand.choice(account_ids))
+                product = uri('products', rand.choice(product_uris))
+            online = rand.random() >= offline
+            router = self.add('routers', {
+                "name": 'router-%d' % (i + 1),
+                "desc": '',
+                "mac": '00:30:44:%02x:%02x:%02x' % (
+                       (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff),
+                "ip_address": '10.%d.%d.%d' % ((i >> 16) & 0xff,
+                                               (i >> 8) & 0xff, i & 0xff),
+                "serial_number": 'WA%010d' % (i + 1),
+                "asset_id": '',
+                "custom1": '',
+                "custom2": '',
+                "locality": '',
+                "quarantined": False,
+                "config_status": 'synched',
+                "state": 'online' if online else 'offline',
+                "state_ts": self.ago(86400 * 7),
+                "create_ts": self.ago(86400 * 365),
+                "account": account,
+                "group": uri('groups', group) if group else None,
+                "product": product,
+                "actual_firmware": uri('firmwares',
+                                       rand.choice(firmware_uris)),
+                "last_known_location": None,
+                "featurebindings": []
+            })
+            manager = self.add('configuration_managers', {
+                "router": router['resource_uri'],
+                "version_number": 1,
+                "synched": True,
+                "suspended": False,
+                "configuration": [{
+                    "system": {"system_id": router['name']}
+                }, []]
+            })
+            router['configuration_manager'] = manager['resource_uri']
+            if group:
+                stats = self.stores['groups'][group]['statistics']
+                stats['device_count'] += 1
+                stats['online_count' if online else 'offline_count'] += 1
+                stats['synched_count'] += 1
+        for group in self.stores['groups'].values():
+            stats = group['statistics']
+            group['statistics'] = dict((x, stats[x]) for x in (
+                'device_count', 'online_count', 'offline_count',
+                'synched_count', 'suspended_count'))
+        for i in range(max(1, users)):
+            account = uri('accounts', account_ids[0] if not i else
+                          rand.choice(account_ids))
+            user = self.add('users', {
+                "username": 'user%d' % (i + 1),
+                "first_name": 'First%d' % (i + 1),
+                "last_name": 'Last%d' % (i + 1),
+                "email": 'user%d@example.com' % (i + 1),
+                "date_joined": self.ago(86400 * 365),
+                "last_login": self.ago(86400 * 30),
+                "authorizations": []
+            })
+            profile = self.add('profiles', {
+                "user": user['resource_uri'],
+                "account": account,
+                "session_length": 1209600
+            })
+            user['profile'] = profile['resource_uri']
+        router_ids = list(self.stores['routers'])
+        for i in range(alerts):
+            router = self.stores['routers'][rand.choice(router_ids)] \
+                     if router_ids else None
+            self.add('alerts', {
+                "alert_type": rand.choice(alert_types),
+                "created_ts": self.ago(86400 * 30),
+                "router": router and router['resource_uri'],
+                "account": router and router['account'],
+                "friendly_info": 'Alert %d' % (i + 1)
+            })
+        alerts = self.stores['alerts']
+        ordered = sorted(alerts.values(), key=lambda x: x['created_ts'])
+        alerts.clear()
+        for i, x in enumerate(ordered, 1):
+            x.update(id=str(i), resource_uri=uri('alerts', i))
+            alerts[x['id']] = x
+
+    def get_router_state(self, ident):
+        """ The status/config/control tree of a router for the remote API,
+        generated the first time it is used. """
+        try:
+            return self.router_states[ident]
+        except KeyError:
+            pass
+        rand = random.Random('%s-%s' % (self.seed, ident))
+        router = self.stores['routers'][ident]
+        clients = []
+        leases = []
+        wlan = []
+        for i in range(self.clients):
+            oui = rand.choice(vendor_ouis)
+            mac = ':'.join('%02x' % x for x in (
+                oui >> 16, (oui >> 8) & 0xff, oui & 0xff,
+                rand.randint(0, 255), rand.randint(0, 255), i & 0xff))
+            ip = '192.168.0.%d' % (100 + i)
+            clients.append({"mac": mac, "ip_address": ip})
+            leases.append({"mac": mac, "ip_address": ip,
+                           "hostname": 'host-%s-%d' % (ident, i)})
+            if rand.random() < 0.5:
+                wlan.append({"mac": mac, "rssi0": -rand.randint(30, 90),
+                             "txrate": rand.choice([54, 130, 300])})
+        state = {
+            "status": {
+                "lan": {"clients": clients},
+                "dhcpd": {"leases": leases},
+                "wlan": {"clients": wlan},
+                "wan": {"stats": {"in": 0, "out": 0, "bps": 0}},
+                "system": {"uptime": rand.randint(60, 86400 * 30)}
+            },
+            "config": {
+                "system": {
+                    "system_id": router['name'],
+                    "connector_gpio": {"output": 0}
+                }
+            },
+            "control": {
+                "system": {"reboot": 0},
+                "gpio": {"LED_ATTENTION": 0}
+            },
+            "rates": (rand.randint(1000, 1000000), rand.randint(1000, 250000))
+        }
+        self.router_states[ident] = state
+        return state
+
+    def update_wan_stats(self, state):
+        """ Advance the cumulative WAN byte counters with time. """
+        elapsed = time.time() - self.epoch
+        rate_in, rate_out = state['rates']
+        stats = state['status']['wan']['stats']
+        stats['in'] = int(rate_in * elapsed)
+        stats['out'] = int(rate_out * elapsed)
+        stats['bps'] = (rate_in + rate_out) * 8
+
+    def get_router_logs(self, ident):
+        try:
+            logs = self.router_logs[ident]
+        except KeyError:
+            pass
+        else:
+            if self.log_rate:
+                self.grow_router_logs(ident, logs)
+            return logs
+        rand = random.Random('%s-logs-%s' % (self.seed, ident))
+        logs = []
+        for i in range(self.logs_per_router):
+            delta = datetime.timedelta(seconds=(self.logs_per_router - i) *
+                                       rand.randint(1, 600))
+            logs.append({
+                "id": str(i + 1),
+                "timestamp": isotime(self.now - delta),
+                "levelname": rand.choice(levels),
+                "source": rand.choice(log_sources),
+                "message": 'Log message %d for router %s' % (i + 1, ident),
+                "exception": None
+            })
+        logs.sort(key=lambda x: x['timestamp'])
+        self.router_logs[ident] = logs
+        return logs
+
+    def grow_router_logs(self, ident, logs):
+        """ Add the entries an online router would have logged since the
+        last request at its share of the `log_rate`.  Some routers are much
+        busier than others and some are silent. """
+        if self.stores['routers'][ident]['state'] != 'online':
+            return
+        now = time.time()
+        try:
+            last, pending, rate, rand = self.log_growth[ident]
+        except KeyError:
+            rand = random.Random('%s-growth-%s' % (self.seed, ident))
+            rate = self.log_rate * rand.choice([0, 0, 0.5, 1, 2, 4])
+            self.log_growth[ident] = [now, 0, rate, rand]
+            return
+        pending += (now - last) * rate
+        self.log_growth[ident][:2] = now, pending % 1
+        ts = isotime(datetime.datetime.now(datetime.timezone.utc)
+                     .replace(microsecond=0))
+        for i in range(int(pending)):
+            n = len(logs) + 1
+            logs.append({
+                "id": str(n),
+                "timestamp": ts,
+                "levelname": rand.choice(levels),
+                "source": rand.choice(log_sources),
+                "message": 'Log message %d for router %s' % (n, ident),
+                "exception": None
+            })
+
+    def resolve(self, value):
+        """ Return the object for a resource URI or None. """
+        if not isinstance(value, str):
+            return None
+        m = uri_match.match(value)
+        if not m:
+            return None
+        return self.stores[m.group(1)].get(m.group(2))
+
+    def lookup(self, obj, dotpath):
+        """ Get the value of a dotted field path, following resource URIs
+        the same way expand would. """
+        for x in dotpath.split('.'):
+            if isinstance(obj, str):
+                obj = self.resolve(obj)
+            if not isinstance(obj, dict):
+                return None
+            obj = obj.get(x)
+        return obj
+
+    def coerce(self, value, query):
+        """ Convert a query string value to compare with a field value. """
+        if isinstance(value, bool):
+            return query.lower() in ('true', '1')
+        elif isinstance(value, int):
+            try:
+                return int(query)
+            except ValueError:
+                return query
+        return iso_space.sub(r'\1T', query)
+
+    def compare_value(self, value):
+        if isinstance(value, str):
+            m = uri_match.match(value)
+            if m:
+                return m.group(2)
+        return value
+
+    def matches(self, obj, key, query):
+        field, op = key, 'exact'
+        if '__' in key:
+            field, op = key.rsplit('__', 1)
+        value = self.compare_value(self.lookup(obj, field))
+        if op == 'in':
+            return value in [self.coerce(value, x) for x in query.split(',')]
+        if value is None:
+            return op == 'exact' and query in ('', 'null', 'None')
+        query = self.coerce(value, query)
+        if op == 'exact':
+            return value == query or str(value) == query
+        elif op in ('gt', 'gte', 'lt', 'lte'):
+            try:
+                if op == 'gt':
+                    return value > query
+                elif op == 'gte':
+                    return value >= query
+                elif op == 'lt':
+                    return value < query
+                else:
+                    return value <= query
+            except TypeError:
+                return False
+        value = str(value)
+        if op.startswith('i'):
+            value = value.lower()
+            query = query.lower()
+            op = op[1:]
+        if op == 'startswith':
+            return value.startswith(query)
+        elif op == 'contains':
+            return query in value
+        elif op == 'endswith':
+            return value.endswith(query)
+        raise ValueError('Unsupported filter: %s' % key)
+
+    def filter(self, objects, filters):
+        for key, value in filters.items():
+            if key == '_or':
+                terms = [x.split('=', 1) for x in value.split('|')]
+                objects = [x for x in objects
+                           if any(self.matches(x, k, v) for k, v in terms)]
+            else:
+                objects = [x for x in objects if self.matches(x, key, value)]
+        return objects
+
+    def expand(self, obj, paths):
+        obj = dict(obj)
+        for path in paths:
+            field, _, rest = path.partition('.')
+            value = obj.get(field)
+            if isinstance(value, list):
+                value = [self.resolve(x) or x for x in value]
+                if rest:
+                    value = [self.expand(x, [rest]) if isinstance(x, dict)
+                             else x for x in value]
+            else:
+                value = self.resolve(value) or value
+                if rest and isinstance(value, dict):
+                    value = self.expand(value, [rest])
+            obj[field] = value
+        return obj
+
+    def render(self, obj, query):
+        if query.get('expand'):
+            obj = self.expand(obj, query['expand'].split(','))
+        if query.get('fields'):
+            fields = set(x.split('.', 1)[0]
+                         for x in query['fields'].split(','))
+            obj = dict((k, v) for k, v in obj.items() if k in fields)
+        return obj
+
+    def listing(self, path, objects, query):
+        """ Filter, sort and page a list of objects. """
+        query = dict(query)
+        limit = int(query.pop('limit', 20))
+        offset = int(query.pop('offset', 0))
+        order_by = query.pop('order_by', None)
+        count = query.pop('count', None)
+        filters = dict((k, v) for k, v in query.items()
+                       if k not in ('expand', 'fields', 'timeout'))
+        objects = self.filter(objects, filters)
+        if count:
+            return [{"%s_count" % count: len(objects)}], None
+        if order_by:
+            reverse = order_by.startswith('-')
+            key = order_by.lstrip('-')
+            objects = sorted(objects, reverse=reverse,
+                             key=lambda x: (x.get(key) is None, x.get(key)))
+        page = objects[offset:offset + limit]
+        nextq = None
+        if offset + limit < len(objects):
+            nextq = dict(query, limit=limit, offset=offset + limit)
+            if order_by:
+                nextq['order_by'] = order_by
+            nextq = '%s/%s/?%s' % (prefix, '/'.join(path),
+                                   urllib.parse.urlencode(nextq))
+        meta = {
+            "limit": limit,
+            "offset": offset,
+            "total_count": len(objects),
+            "next": nextq,
+            "previous": None
+        }
+        return [self.render(x, query) for x in page], meta
+
+    def candidates(self, resource, query):
+        """ The objects that could match the query;  Lookups by id avoid
+        scanning the whole store. """
+        store = self.stores[resource]
+        ids = query.get('id__in', query.get('id'))
+        if ids is None:
+            return list(store.values())
+        return [store[x] for x in ids.split(',') if x in store]
+
+    def remote(self, method, path, query, body):
+        """ The remote API returns a result for each router matching the
+        query filters. """
+        routers = self.candidates('routers', query)
+        query = dict(query)
+        results = []
+        for router in self.filter(routers, dict((k, v) for k, v in
+                                  query.items() if k not in ('limit',
+                                  'offset', 'timeout'))):
+            res = {"id": router['id']}
+            if router['state'] != 'online':
+                res.update(success=False, exception='offline',
+                           reason='Router is not connected',
+                           message='Router is not connected')
+                results.append(res)
+                continue
+            if method == 'put' and path[:2] == ['control', 'csterm'] and \
+               len(path) > 2:
+                res.update(success=True, data=self.csterm(router, path[2:],
+                                                          body))
+                results.append(res)
+                continue
+            state = self.get_router_state(router['id'])
+            self.update_wan_stats(state)
+            offt = state
+            for i, x in enumerate(path):
+                if isinstance(offt, list) and x.isnumeric() and \
+                   int(x) < len(offt):
+                    x = int(x)
+                elif not isinstance(offt, dict) or \
+                     (x not in offt and method == 'get'):
+                    offt = None
+                    break
+                if method == 'put' and i == len(path) - 1:
+                    offt[x] = body
+                elif method == 'put' and x not in offt:
+                    offt[x] = {}
+                offt = offt[x]
+            if offt is None:
+                res.update(success=False, exception='not_found',
+                           reason='Path not found', message='/'.join(path))
+            else:
+                res.update(success=True, data=copy.deepcopy(offt))
+            results.append(res)
+        limit = int(query.get('limit', 20))
+        offset = int(query.get('offset', 0))
+        return results[offset:offset + limit], {
+            "limit": limit,
+            "offset": offset,
+            "total_count": len(results),
+            "next": None,
+            "previous": None
+        }
+
+    def csterm(self, router, path, body):
+        """ A remote terminal session;  PUT to the session with the
+        terminal size and keys or to its `k` child with just keys.  The
+        response is the output since the last request. """
+        key = router['id'], path[0]
+        term = self.terminals.get(key)
+        if term is None:
+            term = self.terminals[key] = FakeTerminal(router['name'])
+        if path[1:] == ['k']:
+            return term.exchange(body or '')
+        body = body or {}
+        return {"w": body.get('w'), "h": body.get('h'),
+                "k": term.exchange(body.get('k') or '')}
+
+    def handle(self, method, path, query, body):
+        """ Return (http_status, data, meta) for an API request. """
+        resource = path[0]
+        with self.lock:
+            if resource == 'remote':
+                if method not in ('get', 'put'):
+                    return 405, None, None
+                data, meta = self.remote(method, path[1:], query, body)
+                return 200, data, meta
+            if resource == 'logs':
+                if len(path) < 2 or path[1] not in self.stores['routers']:
+                    return 404, None, None
+                if method == 'delete':
+                    self.router_logs[path[1]] = []
+                    return 200, None, None
+                return (200,) + self.listing(path,
+                                             self.get_router_logs(path[1]),
+                                             query)
+            if resource == 'system_message':
+                return 200, [], {"limit": 20, "offset": 0, "next": None,
+                                 "total_count": 0, "previous": None}
+            store = self.stores.get(resource)
+            if store is None:
+                return 404, None, None
+            if len(path) == 1:
+                if method == 'get':
+                    return (200,) + self.listing(path, self.candidates(
+                                                 resource, query), query)
+                elif method == 'post':
+                    obj = self.add(resource, dict(body))
+                    return 201, obj, None
+                return 405, None, None
+            obj = store.get(path[1])
+            if obj is None:
+                return 404, None, None
+            if len(path) > 2:
+                # Sub resources such as routers/ID/configuration_manager/.
+                for x in path[2:]:
+                    obj = obj.get(x) if isinstance(obj, dict) else None
+                    obj = self.resolve(obj) or obj
+                if obj is None:
+                    return 404, None, None
+                if method != 'get':
+                    return 405, None, None
+                return 200, obj, None
+            if method == 'get':
+                return 200, self.render(obj, query), None
+            elif method in ('put', 'patch'):
+                obj.update(body)
+                return 200, obj, None
+            elif method == 'delete':
+                del store[path[1]]
+                return 200, None, None
+            return 405, None, None
+
+
+class FakeTerminal(object):
+    """ Just enough of a router shell for the csterm API;  Input is echoed
+    and a few commands are understood:  `echo`, `seq N` and `sleep N`. """
+
+    def __init__(self, name):
+        self.prompt = '[admin@%s: /]$ ' % name
+        self.line = ''
+        self.output = []
+        self.pending = []
+
+    def exchange(self, keys):
+        for ch in keys:
+            if ch in '\r\n':
+                self.output.append('\r\n')
+                self.run(self.line)
+                self.line = ''
+            elif ch in '\x7f\b':
+                if self.line:
+                    self.line = self.line[:-1]
+                    self.output.append('\b \b')
+            elif ch == '\x03':
+                self.line = ''
+                self.output.append('^C\r\n' + self.prompt)
+            else:
+                self.line += ch
+                self.output.append(ch)
+        now = time.time()
+        while self.pending and self.pending[0][0] <= now:
+            self.output.append(self.pending.pop(0)[1])
+        output = ''.join(self.output)
+        self.output.clear()
+        return output
+
+    def run(self, line):
+        args = line.split()
+        try:
+            if not args:
+                output = ''
+            elif args[0] == 'echo':
+                output = ' '.join(args[1:]) + '\r\n'
+            elif args[0] == 'seq':
+                output = ''.join('%d\r\n' % i
+                                 for i in range(1, int(args[1]) + 1))
+            elif args[0] == 'sleep':
+                self.pending.append((time.time() + float(args[1]),
+                                     self.prompt))
+                return
+            else:
+                output = '%s: command not found\r\n' % args[0]
+        except (IndexError, ValueError):
+            output = '%s: invalid argument\r\n' % args[0]
+        self.output.append(output + self.prompt)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeECM/1.0'
+    # Headers and body are separate writes;  Without this each response
+    # stalls on the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        if self.server.ecm.verbose:
+            super().log_message(fmt, *args)
+
+    def do_GET(self):
+        self.handle_api('get')
+
+    def do_POST(self):
+        self.handle_api('post')
+
+    def do_PUT(self):
+        self.handle_api('put')
+
+    def do_PATCH(self):
+        self.handle_api('patch')
+
+    def do_DELETE(self):
+        self.handle_api('delete')
+
+    def read_body(self):
+        length = int(self.headers.get('content-length') or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length).decode())
+
+    def send(self, status, content, session=None):
+        body = json.dumps(content).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if status == 200 and self.headers.get('if-none-match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.server.ecm.gzip and len(body) > self.server.ecm.gzip_min and \
+           'gzip' in (self.headers.get('accept-encoding') or ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('ETag', etag)
+        if session:
+            self.send_header('Set-Cookie', 'sessionid=%s; Path=/' % session)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def session(self):
+        cookies = self.headers.get('cookie') or ''
+        for x in cookies.split(';'):
+            name, _, value = x.strip().partition('=')
+            if name == 'sessionid' and value in self.server.ecm.sessions:
+                return value
+        return None
+
+    def handle_api(self, method):
+        ecm = self.server.ecm
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query,
+                                            keep_blank_values=True))
+        body = self.read_body()
+        if not url.path.startswith(prefix):
+            return self.send(404, {"success": False, "exception": "not_found",
+                                   "message": url.path})
+        path = [x for x in url.path[len(prefix):].split('/') if x]
+        if not path:
+            return self.send(404, {"success": False, "exception": "not_found",
+                                   "message": url.path})
+        ecm.record(path[0])
+        ecm.delay(path[0])
+        session = self.session()
+        if path[0] == 'login':
+            if method == 'post':
+                session = ecm.login()
+                return self.send(200, {"success": True,
+                                       "data": {"success": True}}, session)
+            elif session:
+                return self.send(200, {"success": True, "data": {
+                    "user": {"username": ecm.username},
+                    "account": uri('accounts', 1)
+                }}, session)
+        if not session:
+            return self.send(401, {"success": False,
+                                   "exception": "unauthorized",
+                                   "message": "Login required"})
+        status, data, meta = ecm.fleet.handle(method, path, query, body)
+        if status >= 400:
+            return self.send(status, {"success": False, "exception":
+                                      http.server.BaseHTTPRequestHandler
+                                      .responses[status][0].lower()
+                                      .replace(' ', '_'),
+                                      "message": self.path}, session)
+        self.send(status, {"success": True, "data": data, "meta": meta},
+                  session)
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+class FakeECM(object):
+    """ Run a fake ECM API server in a background thread.  Latency is added
+    to every request (plus a random jitter) and remote API calls take an
+    extra `remote_latency` to model the round trip to the routers. """
+
+    username = 'bench'
+    gzip_min = 1024
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0,
+                 remote_latency=0, gzip=True, verbose=False,
+                 **fleet_options):
+        self.fleet = Fleet(**fleet_options)
+        self.gzip = gzip
+        self.latency = latency
+        self.jitter = jitter
+        self.remote_latency = remote_latency
+        self.verbose = verbose
+        self.sessions = set()
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+        self.server = Server((host, port), Handler)
+        self.server.ecm = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def login(self):
+        session = hashlib.sha1(str(random.random()).encode()).hexdigest()
+        with self.lock:
+            self.sessions.add(session)
+        return session
+
+    def record(self, resource):
+        with self.lock:
+            self.requests[resource] += 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+
+    def delay(self, resource):
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if resource == 'remote':
+            delay += self.remote_latency
+        if delay:
+            time.sleep(delay)
+
+
+def add_fleet_args(parser):
+    parser.add_argument('--routers', type=int, default=1000)
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--alerts', type=int, default=5000)
+    parser.add_argument('--logs', type=int, default=50,
+                        help='Log entries per router')
+    parser.add_argument('--log-rate', type=float, default=0,
+                        help='Average new log entries per second for each '
+                        'router')
+    parser.add_argument('--clients', type=int, default=5,
+                        help='LAN clients per router')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='Maximum random seconds added to the latency')
+    parser.add_argument('--remote-latency', type=float, default=0.1,
+                        help='Extra seconds added to remote API calls')
+    parser.add_argument('--no-gzip', action='store_true',
+                        help='Never compress responses')
+
+
+def fleet_options(args):
+    return dict(routers=args.routers, accounts=args.accounts,
+                groups=args.groups, users=args.users, alerts=args.alerts,
+                logs=args.logs, log_rate=args.log_rate,
+                clients=args.clients, latency=args.latency,
+                jitter=args.jitter, remote_latency=args.remote_latency,
+                gzip=not args.no_gzip)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake ECM API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--verbose', action='store_true')
+    add_fleet_args(parser)
+    args = parser.parse_args()
+    ecm = FakeECM(host=args.host, port=args.port, verbose=args.verbose,
+                  **fleet_options(args))
+    print('Serving fake ECM API at:', ecm.url)
+    try:
+        ecm.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
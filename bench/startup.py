@@ -0,0 +1,75 @@
+"""
+Startup time benchmark for the `ecm` command.
+
+Each scenario is run in a fresh interpreter so import costs are included.
+The "eager" column emulates the old startup which imported pkg_resources and
+every command module before parsing arguments.
+
+    python bench/startup.py [--runs N]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+scenarios = [
+    ('--version', ['--version']),
+    ('command help', ['routers', '--help']),
+    ('subcommand completion', ['completion', '--seed', 'ecm', 'routers', '']),
+    ('command completion', ['completion', '--seed', 'ecm', 'ro']),
+]
+
+lazy_code = '''
+import sys
+sys.argv = ['ecm'] + sys.argv[1:]
+from ecmcli import main
+main.main()
+'''
+
+eager_code = '''
+import importlib, sys
+sys.argv = ['ecm'] + sys.argv[1:]
+import pkg_resources
+from ecmcli import main
+for x in main.command_modules:
+    importlib.import_module('.%s' % x, 'ecmcli.commands')
+main.main()
+'''
+
+
+def timeit(code, argv, runs):
+    times = []
+    env = dict(os.environ, PYTHONPATH=root)
+    if '--seed' in argv:
+        seed = argv[argv.index('--seed') + 1:]
+        env['COMP_CWORD'] = str(len(seed) - 1)
+        env['COMP_LINE'] = ' '.join(seed)
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.call([sys.executable, '-c', code] + argv, env=env,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip()
+                                     .split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    print('%-24s %10s %10s %8s' % ('Scenario', 'Eager (ms)', 'Lazy (ms)',
+                                   'Speedup'))
+    for name, argv in scenarios:
+        eager = timeit(eager_code, argv, args.runs)
+        lazy = timeit(lazy_code, argv, args.runs)
+        print('%-24s %10.0f %10.0f %7.1fx' % (name, eager * 1000,
+                                              lazy * 1000, eager / lazy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark suite for ecmcli commands against the fake ECM server.
+
+Each scenario runs the real `ecm` command in a fresh interpreter with an
+isolated home directory (session file and cache) and reports the median
+wall time, the number of API requests the server received and the peak
+memory of the process.  Results can be saved and later used as a baseline
+so regressions fail the run.
+
+    python bench/suite.py --routers 5000 --save baseline.json
+    python bench/suite.py --routers 5000 --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakeecm  # noqa
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+scenarios = [
+    ('routers show', ['routers', 'show']),
+    ('accounts tree -v', ['accounts', 'tree', '-v']),
+    ('alerts', ['alerts']),
+    ('routers clients', ['routers', 'clients']),
+]
+
+runner = '''
+import json, resource, sys, time
+result_file = sys.argv.pop(1)
+sys.argv[0] = 'ecm'
+start = time.perf_counter()
+status = 0
+try:
+    from ecmcli import main
+    main.main()
+except SystemExit as e:
+    status = e.code if isinstance(e.code, int) else 1
+wall = time.perf_counter() - start
+maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform != 'darwin':
+    maxrss *= 1024
+with open(result_file, 'w') as f:
+    json.dump({"wall": wall, "maxrss": maxrss, "status": status}, f)
+'''
+
+
+def run_scenario(ecm, home, argv, options):
+    """ Run one command and return its result dictionary. """
+    result_file = os.path.join(home, 'result.json')
+    env = dict(os.environ, HOME=home, PYTHONPATH=root)
+    cmd = [sys.executable, '-c', runner, result_file, '--api_site', ecm.url,
+           '--api_username', ecm.username, '--api_password', 'bench']
+    cmd.extend(options)
+    cmd.extend(argv)
+    ecm.reset_counts()
+    proc = subprocess.run(cmd, env=env, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        with open(result_file) as f:
+            result = json.load(f)
+    except (FileNotFoundError, ValueError):
+        result = {"status": proc.returncode or 1}
+    result['requests'] = sum(ecm.requests.values())
+    if result['status']:
+        result['error'] = proc.stderr.decode(errors='replace').strip()
+    return result
+
+
+def run_suite(ecm, runs, options, names=None):
+    home = tempfile.mkdtemp(prefix='ecmcli-bench-')
+    results = {}
+    try:
+        # Log in once so every scenario starts with a saved session.
+        run_scenario(ecm, home, ['groups', 'show'], options)
+        for name, argv in scenarios:
+            if names and name not in names:
+                continue
+            samples = [run_scenario(ecm, home, argv, options)
+                       for i in range(runs)]
+            failed = [x for x in samples if x['status']]
+            if failed:
+                results[name] = {"error": failed[0].get('error', '')}
+                continue
+            results[name] = {
+                "wall": statistics.median(x['wall'] for x in samples),
+                "requests": samples[-1]['requests'],
+                "maxrss": max(x['maxrss'] for x in samples)
+            }
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """ Return a list of regression descriptions. """
+    regressions = []
+    for name, res in sorted(current.items()):
+        base = baseline.get(name)
+        if not base or 'error' in base or 'error' in res:
+            continue
+        if res['wall'] > base['wall'] * (1 + tolerance):
+            regressions.append('%s: wall time %.3fs -> %.3fs' % (
+                               name, base['wall'], res['wall']))
+        if res['requests'] > base['requests']:
+            regressions.append('%s: requests %d -> %d' % (
+                               name, base['requests'], res['requests']))
+        if res['maxrss'] > base['maxrss'] * (1 + tolerance):
+            regressions.append('%s: peak memory %.1fMB -> %.1fMB' % (
+                               name, base['maxrss'] / 2**20,
+                               res['maxrss'] / 2**20))
+    return regressions
+
+
+def report(results, baseline=None):
+    print('%-20s %10s %10s %12s %10s' % ('Scenario', 'Wall (s)', 'Requests',
+                                         'Peak Mem (MB)', 'vs Base'))
+    for name, _ in scenarios:
+        res = results.get(name)
+        if res is None:
+            continue
+        if 'error' in res:
+            print('%-20s FAILED: %s' % (name, res['error'].splitlines()[-1]
+                                         if res['error'] else '?'))
+            continue
+        change = ''
+        base = baseline and baseline.get(name)
+        if base and 'wall' in base:
+            change = '%+.0f%%' % ((res['wall'] / base['wall'] - 1) * 100)
+        print('%-20s %10.3f %10d %12.1f %10s' % (name, res['wall'],
+              res['requests'], res['maxrss'] / 2**20, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip()
+                                     .split('\n')[0])
+    fakeecm.add_fleet_args(parser)
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Runs per scenario (the median is reported)')
+    parser.add_argument('--scenario', action='append',
+                        choices=[x[0] for x in scenarios])
+    parser.add_argument('--cache', action='store_true',
+                        help='Leave the response cache enabled')
+    parser.add_argument('--save', metavar='FILE',
+                        help='Save the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='Compare with results saved by --save')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed fraction of slowdown vs the baseline')
+    args = parser.parse_args()
+    options = [] if args.cache else ['--no-cache']
+    ecm = fakeecm.FakeECM(**fakeecm.fleet_options(args)).start()
+    try:
+        results = run_suite(ecm, args.runs, options, args.scenario)
+    finally:
+        ecm.stop()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if any('error' in x for x in results.values()):
+        raise SystemExit(1)
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print()
+            print('Regressions:')
+            for x in regressions:
+                print('  %s' % x)
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""
+An asyncio client for the ECM API.
+
+This is a variant of api.ECMService for workloads with many concurrent or
+long running requests, such as polling the remote API of thousands of
+routers, where a thread per request is too costly.  It shares the session
+of a regular ECMService;  Logging in, session token updates and terms of
+service handling are delegated to it so both clients stay in sync.
+
+    aio = api.aio
+    async def main():
+        async for router in aio.get_pager('routers'):
+            ...
+    aioapi.run(main())
+
+Requires Python 3.5 or newer.
+"""
+
+import asyncio
+import collections
+import http.cookies
+import syndicate.adapters.base
+import syndicate.client
+import syndicate.data
+import time
+import urllib.parse
+from . import api
+from tornado import httpclient
+
+
+try:
+    get_running_loop = asyncio.get_running_loop
+except AttributeError:  # Python < 3.7
+    get_running_loop = asyncio.get_event_loop
+
+
+class APIError(Exception):
+    """ An API error that the sync client reports by raising SystemExit.
+    SystemExit can not be used inside a coroutine;  asyncio would propagate
+    it out of the event loop instead of storing it on the task. """
+    pass
+
+
+def run(coro):
+    """ Run a coroutine to completion in a new event loop. """
+    if hasattr(asyncio, 'run'):
+        return asyncio.run(coro)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class AsyncPager(object):
+    """ Async iterator over every result of a resource.  When the first page
+    reports the total count the remaining pages are fetched ahead, up to
+    `prefetch` at a time, otherwise the next links are followed. """
+
+    def __init__(self, service, path, kwargs, prefetch):
+        self.service = service
+        self.path = path
+        self.kwargs = kwargs
+        self.prefetch = prefetch
+        self.buffer = collections.deque()
+        self.pages = None
+        self.next_urn = None
+        self.inflight = collections.deque()
+        self.started = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.buffer:
+            page = await self.next_page()
+            if page is None:
+                raise StopAsyncIteration
+            self.buffer.extend(page)
+        return self.buffer.popleft()
+
+    async def next_page(self):
+        if not self.started:
+            self.started = True
+            page = await self.service.get(*self.path, **self.kwargs)
+            meta = page.meta or {}
+            total = meta.get('total_count')
+            if meta.get('next') and total is not None:
+                limit = meta.get('limit') or self.kwargs['limit']
+                offset = meta.get('offset', 0) + limit
+                self.pages = collections.deque(range(offset, total, limit))
+            else:
+                self.next_urn = meta.get('next')
+            return page
+        if self.pages is not None:
+            while self.pages and len(self.inflight) < self.prefetch:
+                kwargs = dict(self.kwargs, offset=self.pages.popleft())
+                self.inflight.append(asyncio.ensure_future(
+                    self.service.get(*self.path, **kwargs)))
+            if not self.inflight:
+                return None
+            return await self.inflight.popleft()
+        if not self.next_urn:
+            return None
+        page = await self.service.get(urn=self.next_urn)
+        self.next_urn = (page.meta or {}).get('next')
+        return page
+
+    async def close(self):
+        """ Cancel any read ahead requests. """
+        for x in self.inflight:
+            x.cancel()
+
+
+class AsyncFanOut(object):
+    """ Async iterator of api.FanOutResult for coroutine `fn` called with
+    each item.  Results are produced in completion order and errors are
+    captured the same way api.fanout does, including SystemExit. """
+
+    def __init__(self, fn, items):
+        self.fn = fn
+        self.items = list(items)
+        self.pending = None
+        self.finished = collections.deque()
+        self.done = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.pending is None:
+            self.pending = dict((asyncio.ensure_future(self.call(x)), x)
+                                for x in self.items)
+        while not self.finished:
+            if not self.pending:
+                raise StopAsyncIteration
+            done, _ = await asyncio.wait(
+                self.pending, return_when=asyncio.FIRST_COMPLETED)
+            for f in done:
+                item = self.pending.pop(f)
+                error = f.exception()
+                if error is not None:
+                    self.cancel()
+                    raise error
+                self.done += 1
+                value, error = f.result()
+                self.finished.append(api.FanOutResult(item, value, error,
+                                     self.done, len(self.items)))
+        return self.finished.popleft()
+
+    async def call(self, item):
+        """ Return the (value, error) of `fn` for an item.  Errors are caught
+        here because a task raising a BaseException such as SystemExit would
+        stop the event loop. """
+        try:
+            return await self.fn(item), None
+        except (api.AuthFailure, KeyboardInterrupt, asyncio.CancelledError):
+            raise
+        except BaseException as e:
+            return None, e
+
+    def cancel(self):
+        for f in self.pending or ():
+            f.cancel()
+
+
+class AsyncECMService(object):
+    """ asyncio client sharing the session of an api.ECMService.  At most
+    `concurrency` requests are in flight at once;  The rest wait on a
+    semaphore, so it is safe to start thousands of them. """
+
+    concurrency = 100
+    connect_timeout = 20
+
+    def __init__(self, api):
+        self.api = api
+        self.loop = None
+        self.client = None
+        self.client_loop = None
+        self.semaphore = None
+        self.auth_lock = None
+
+    def setup(self):
+        """ Create the loop bound state on first use in each event loop.  A
+        client assigned by the caller is left alone. """
+        loop = get_running_loop()
+        if loop is self.loop:
+            return
+        self.loop = loop
+        self.semaphore = asyncio.BoundedSemaphore(self.concurrency)
+        self.auth_lock = asyncio.Lock()
+        if self.client is None or self.client_loop is not None:
+            if self.client is not None:
+                self.client.close()
+            self.client = httpclient.AsyncHTTPClient(
+                force_instance=True, max_clients=self.concurrency)
+            self.client_loop = loop
+
+    def url(self, path, urn=None):
+        """ Build the URL the same way syndicate.Service.do does. """
+        parts = [self.api.uri, self.api.urn if urn is None else urn]
+        parts.extend(path)
+        url = '/'.join(filter(None, (str(x).strip('/') for x in parts)))
+        parts = self.api.urlpartition.split(url, 1)
+        if not parts[0].endswith('/'):
+            parts[0] += '/'
+        return ''.join(parts)
+
+    async def call_sync(self, fn, *args):
+        """ Run a blocking session handler of the sync service in a thread.
+        Only one runs at a time. """
+        loop = get_running_loop()
+        async with self.auth_lock:
+            return await loop.run_in_executor(None, fn, *args)
+
+    async def handle_error(self, error):
+        try:
+            await self.call_sync(self.api.handle_error, error)
+        except SystemExit as e:
+            raise APIError(e.code) from error
+
+    async def do(self, method, path, urn=None, data=None, timeout=None,
+                 **query):
+        self.setup()
+        if self.api.need_login:
+            await self.call_sync(self.api.ensure_login)
+        batches = self.api.remote_batches(path, query)
+        if batches:
+            pages = await asyncio.gather(*[self.do(method, path, urn=urn,
+                                           data=data, timeout=timeout,
+                                           **dict(query, id__in=ids))
+                                           for ids in batches])
+            result = syndicate.data.ListResponse(x for page in pages
+                                                 for x in page)
+            result.meta = None
+            return result
+        if self.api.account is not None:
+            query['account'] = self.api.account
+        async with self.semaphore:
+            for retry in (True, False):
+                session_id = self.api.session_id
+                try:
+                    return await self.request(method, path, urn, data,
+                                              timeout, query)
+                except syndicate.client.ResponseError as e:
+                    if not retry:
+                        raise
+                    if self.api.session_id == session_id:
+                        await self.handle_error(e)
+
+    async def request(self, method, path, urn, data, timeout, query):
+        resource = self.api.request_resource(path, urn)
+        request = {
+            "method": method,
+            "resource": resource,
+            "start": time.perf_counter(),
+            "error": True
+        }
+        self.api.fire_event('start_request', args=(method, path),
+                            kwargs=query, request=request)
+        result = resp = None
+        try:
+            url = self.url(path, urn)
+            if query:
+                url += '?' + urllib.parse.urlencode(query, doseq=True)
+            headers = {
+                "accept": self.api.serializer.mime,
+                "content-type": self.api.serializer.mime,
+                "cookie": 'sessionid=%s' % self.api.session_id
+            }
+            body = None
+            if data is not None:
+                body = self.api.serializer.encode(data)
+            if timeout is None:
+                timeout = self.api.fanout_timeout
+            resp = await self.client.fetch(httpclient.HTTPRequest(
+                url, method=method.upper(), headers=headers, body=body,
+                request_timeout=timeout, connect_timeout=self.connect_timeout,
+                decompress_response=True, allow_nonstandard_methods=True),
+                raise_error=False)
+            if resp.code == 599:
+                raise resp.error
+            self.update_session(resp)
+            content = None
+            if resp.body:
+                content = self.api.serializer.decode(resp.body.decode())
+            result = self.api.ingress_filter(syndicate.adapters.base.Response(
+                http_code=resp.code, headers=resp.headers, content=content,
+                error=None, extra=resp))
+            request['error'] = False
+        finally:
+            size = len(resp.body or b'') if resp is not None else 0
+            request.update({
+                "elapsed": time.perf_counter() - request['start'],
+                "bytes": size,
+                "wire_bytes": int(resp.headers.get('content-length', size))
+                              if resp is not None else 0,
+                "cached": False,
+                "paged": getattr(result, 'meta', None) is not None
+            })
+            self.api.fire_event('finish_request', result=result,
+                                request=request)
+        return result
+
+    def update_session(self, resp):
+        """ Keep the shared session token current. """
+        for header in resp.headers.get_list('set-cookie'):
+            cookie = http.cookies.SimpleCookie(header)
+            if 'sessionid' in cookie:
+                self.api.check_session(cookie['sessionid'].value)
+
+    def get_pager(self, *path, **kwargs):
+        page_arg = kwargs.pop('page_size', None)
+        limit_arg = kwargs.pop('limit', None)
+        kwargs['limit'] = page_arg or limit_arg or self.api.default_page_size
+        return AsyncPager(self, path, kwargs, self.api.prefetch)
+
+    def fanout(self, fn, items):
+        return AsyncFanOut(fn, items)
+
+    async def get(self, *path, **kwargs):
+        return await self.do('get', path, **kwargs)
+
+    async def post(self, *path_and_data, **kwargs):
+        path = list(path_and_data)
+        data = path.pop(-1)
+        return await self.do('post', path, data=data, **kwargs)
+
+    async def put(self, *path_and_data, **kwargs):
+        path = list(path_and_data)
+        data = path.pop(-1)
+        return await self.do('put', path, data=data, **kwargs)
+
+    async def patch(self, *path_and_data, **kwargs):
+        path = list(path_and_data)
+        data = path.pop(-1)
+        return await self.do('patch', path, data=data, **kwargs)
+
+    async def delete(self, *path, **kwargs):
+        data = kwargs.pop('data', None)
+        return await self.do('delete', path, data=data, **kwargs)
@@ -3,29 +3,127 @@ Some API handling code.  Predominantly this is to centralize common
 alterations we make to API calls, such as filtering by router ids.
 """
 
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import dateutil.parser
 import getpass
 import hashlib
 import html
 import html.parser
 import json
 import os
+import re
+import requests.adapters
 import shutil
 import syndicate
+import syndicate.adapters.base
 import syndicate.client
 import syndicate.data
 import textwrap
-from syndicate.adapters.sync import LoginAuth
-
+import threading
+import time
+from . import cache
+from syndicate.adapters.sync import LoginAuth, SyncAdapter
+
+try:
+    import orjson as fastjson
+except ImportError:
+    fastjson = None
+
+
+class HTMLJSONDecoder(object):
+    """ Decode JSON converting ISO date strings to datetimes and unescaping
+    HTML entities in string values.  Documents that contain neither skip the
+    conversion entirely and the conversion only does real work for strings
+    that start with a digit or contain an ampersand.  A faster `loads`
+    function, such as one from a C JSON library, can be used for the parsing
+    in place of the standard library decoder. """
+
+    date_search = re.compile(r'"\d{4}-\d{2}-\d{2}')
+    date_match = syndicate.data.NormalJSONDecoder.strict_iso_match
+    iso_match = re.compile(r'(\d{4})-(\d{2})-(\d{2})(?:T(\d{2}):(\d{2}):'
+                           r'(\d{2})(?:\.(\d{1,6}))?(Z|[+-]\d{2}:?\d{2})?)?$')
+    digits = frozenset('0123456789')
+
+    def __init__(self, loads=None):
+        self.loads = loads
+        self.hook_decoder = json.JSONDecoder(object_hook=self.parse_object)
+        self.timezones = {"Z": datetime.timezone.utc}
+
+    def decode(self, data):
+        if '&' not in data and '\\u0026' not in data and \
+           not self.date_search.search(data):
+            return (self.loads or json.loads)(data)
+        if self.loads is None:
+            return self.hook_decoder.decode(data)
+        result = self.loads(data)
+        self.convert(result)
+        return result
 
-class HTMLJSONDecoder(syndicate.data.NormalJSONDecoder):
+    def convert(self, data):
+        """ Do the work of parse_object for every object of an already parsed
+        document in one pass. """
+        digits = self.digits
+        date_match = self.date_match.match
+        stack = [data]
+        push = stack.append
+        while stack:
+            x = stack.pop()
+            if x.__class__ is list:
+                for value in x:
+                    if value.__class__ is dict or value.__class__ is list:
+                        push(value)
+                continue
+            for key, value in x.items():
+                cls = value.__class__
+                if cls is str:
+                    if value[4:5] == '-' and value[0] in digits and \
+                       date_match(value):
+                        x[key] = self.parse_datetime(value)
+                    elif '&' in value:
+                        x[key] = html.unescape(value)
+                elif cls is dict or cls is list:
+                    push(value)
 
     def parse_object(self, data):
-        data = super().parse_object(data)
         for key, value in data.items():
-            if isinstance(value, str):
-                data[key] = html.unescape(value)
+            if value.__class__ is str:
+                if value[4:5] == '-' and value[0] in self.digits and \
+                   self.date_match.match(value):
+                    data[key] = self.parse_datetime(value)
+                elif '&' in value:
+                    data[key] = html.unescape(value)
         return data
 
+    def parse_datetime(self, value):
+        """ Parse the common ISO 8601 forms directly and leave anything else
+        to dateutil. """
+        m = self.iso_match.match(value)
+        if m is None:
+            return dateutil.parser.parse(value)
+        year, month, day, hour, minute, second, fraction, tz = m.groups()
+        if hour is None:
+            return datetime.datetime(int(year), int(month), int(day))
+        return datetime.datetime(int(year), int(month), int(day), int(hour),
+                                 int(minute), int(second),
+                                 int(fraction.ljust(6, '0')) if fraction
+                                 else 0, self.timezone(tz) if tz else None)
+
+    def timezone(self, offset):
+        try:
+            return self.timezones[offset]
+        except KeyError:
+            pass
+        sign = -1 if offset[0] == '-' else 1
+        digits = offset[1:].replace(':', '')
+        delta = datetime.timedelta(hours=int(digits[:2]),
+                                   minutes=int(digits[2:]))
+        tz = datetime.timezone(sign * delta)
+        self.timezones[offset] = tz
+        return tz
+
 
 class TOSParser(html.parser.HTMLParser):
 
@@ -86,10 +184,106 @@ class TOSParser(html.parser.HTMLParser):
 syndicate.data.serializers['htmljson'] = syndicate.data.Serializer(
     'application/json',
     syndicate.data.serializers['json'].encode,
-    HTMLJSONDecoder().decode
+    HTMLJSONDecoder(loads=fastjson.loads if fastjson else None).decode
 )
 
 
+class ECMAdapter(SyncAdapter):
+    """ Sync adapter with support for a local response cache.  Fresh cache
+    entries are served without any network activity and expired entries are
+    revalidated with a conditional request when the server provided an ETag
+    or Last-Modified header for them.
+
+    Responses are always requested with gzip encoding and connections are
+    kept alive in a pool so TLS handshakes only happen once per pooled
+    connection.  The pool should be at least as large as the number of
+    concurrent requests or connections get discarded after each use.
+
+    GET requests made while `.uncached.active` is set for the current thread
+    always go to the server; their responses still refresh the cache. """
+
+    def __init__(self, *args, **kwargs):
+        self.cache = None
+        self.last_response = threading.local()
+        self.uncached = threading.local()
+        super().__init__(*args, **kwargs)
+        self.session.headers['accept-encoding'] = 'gzip'
+        self.set_pool_size(10)
+
+    def set_pool_size(self, size):
+        """ Mount connection pools that keep up to `size` connections alive
+        for each host. """
+        self.pool_size = size
+        for scheme in ('https://', 'http://'):
+            self.session.mount(scheme, requests.adapters.HTTPAdapter(
+                pool_connections=4, pool_maxsize=size))
+
+    def wire_size(self, resp):
+        """ Return the number of body bytes read from the network, which is
+        smaller than the content size when the response was compressed. """
+        try:
+            return resp.raw.tell()
+        except (AttributeError, TypeError):
+            return len(resp.content)
+
+    def request(self, method, url, data=None, query=None, callback=None,
+                timeout=None):
+        entry = None
+        headers = {}
+        info = self.last_response
+        info.cached = False
+        info.bytes = 0
+        info.wire_bytes = 0
+        if self.cache is not None:
+            if method == 'get':
+                if not getattr(self.uncached, 'active', False):
+                    entry = self.cache.lookup(url, query)
+                if entry is not None:
+                    if entry.fresh:
+                        info.cached = True
+                        return self.respond(200, {}, entry.body, None,
+                                            callback)
+                    headers = entry.validators
+            else:
+                self.cache.invalidate(url)
+        if data is not None:
+            data = self.serializer.encode(data)
+        timeout = self.request_timeout if timeout is None else timeout
+        resp = self.session.request(method, url, data=data, params=query,
+                                    timeout=timeout, headers=headers)
+        info.bytes = len(resp.content)
+        info.wire_bytes = self.wire_size(resp)
+        if resp.status_code == 304 and entry is not None:
+            info.cached = True
+            self.cache.touch(url, query, entry)
+            return self.respond(200, resp.headers, entry.body, resp,
+                                callback)
+        body = resp.content.decode() if resp.content else None
+        data = self.respond(resp.status_code, resp.headers, body, resp,
+                            callback)
+        if self.cache is not None and method == 'get' and \
+           resp.status_code == 200 and body:
+            self.cache.store(url, query, body, resp.headers)
+        return data
+
+    def respond(self, http_code, headers, body, extra, callback):
+        """ Decode the response body and run it through the ingress filter
+        the same way the standard adapter does. """
+        content = error = None
+        if body:
+            try:
+                content = self.serializer.decode(body)
+            except Exception as e:
+                error = e
+        r = syndicate.adapters.base.Response(http_code=http_code,
+                                             headers=headers, content=content,
+                                             error=error, extra=extra)
+        data = self.ingress_filter(r)
+        if callback:
+            callback(data)
+        return data
+
+
 class AuthFailure(SystemExit):
     pass
 
@@ -171,9 +365,9 @@ class Eventer(object):
         requirements. """
         event_stack = self.events[event]
         for x in event_stack:
-            if x['callback'] is callback and \
-               (single is not None and x['single'] == single) and \
-               (priority is not None and x['priority'] == priority):
+            if x['callback'] == callback and \
+               (single is None or x['single'] == single) and \
+               (priority is None or x['priority'] == priority):
                 event_stack.remove(x)
                 break
         else:
@@ -193,42 +387,189 @@ class Eventer(object):
             event_stack.remove(x)
 
 
+class FanOutResult(collections.namedtuple('FanOutResult', 'item, value, '
+                                          'error, done, total')):
+    """ The outcome of a single call made by `fanout`.  The `done` and
+    `total` values describe overall progress at the time this result was
+    produced;  The total is None when the input length is not known. """
+
+    @property
+    def progress(self):
+        total = '?' if self.total is None else self.total
+        return '%d/%s' % (self.done, total)
+
+
+def fanout(fn, items, concurrency=8, ordered=False):
+    """ Call `fn` with each of `items` using a bounded pool of worker threads
+    and generate a FanOutResult for each one as it finishes.  Failures are
+    captured in the `error` attribute of the result so a single bad router
+    does not abort the rest of the work.  Items are consumed lazily so a
+    pager can be used as the input without buffering it entirely.  When
+    `ordered` is set the results are produced in the same order as the input
+    items, otherwise they are produced in completion order. """
+    try:
+        total = len(items)
+    except TypeError:
+        total = None
+    items = iter(items)
+    backlog = concurrency * 2
+    pending = {}
+    finished = {}
+    submitted = next_index = done = 0
+    exhausted = False
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        while True:
+            while not exhausted and len(pending) < backlog:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(fn, item)] = (submitted, item)
+                submitted += 1
+            if not pending:
+                break
+            ready = concurrent.futures.wait(pending,
+                return_when=concurrent.futures.FIRST_COMPLETED)[0]
+            for f in ready:
+                index, item = pending.pop(f)
+                error = f.exception()
+                if isinstance(error, (AuthFailure, KeyboardInterrupt)):
+                    raise error
+                value = None if error else f.result()
+                finished[index] = (item, value, error)
+            while finished:
+                if not ordered:
+                    index = next(iter(finished))
+                elif next_index in finished:
+                    index = next_index
+                    next_index += 1
+                else:
+                    break
+                item, value, error = finished.pop(index)
+                done += 1
+                yield FanOutResult(item, value, error, done, total)
+    finally:
+        for f in pending:
+            f.cancel()
+        executor.shutdown(wait=False)
+
+
 class ECMService(Eventer, syndicate.Service):
 
     site = 'https://cradlepointecm.com'
     api_prefix = '/api/v1'
     session_file = os.path.expanduser('~/.ecmcli_session')
+    cache_dir = os.path.expanduser('~/.ecmcli_cache')
+    cache_ttls = {
+        "accounts": 300,
+        "firmwares": 86400,
+        "groups": 300,
+        "products": 86400,
+        "profiles": 300,
+        "routers": 60
+    }
+    # Cached resources that include data from the resource they depend on.
+    cache_dependents = {
+        "routers": ["accounts", "groups"],
+        "users": ["profiles"]
+    }
+    concurrency = 8
+    fanout_timeout = None
+    remote_batch_size = 100
+    prefetch = 4
 
     def __init__(self):
         super().__init__(uri='nope', urn=self.api_prefix,
-                         serializer='htmljson')
+                         serializer='htmljson', adapter=ECMAdapter())
+        self.auth_lock = threading.RLock()
+        self.worker_state = threading.local()
+        self.need_login = False
+        self._ident = None
         self.add_events([
             'start_request',
             'finish_request',
             'reset_auth'
         ])
 
+    @property
+    def aio(self):
+        """ An asyncio client sharing this service's session. """
+        try:
+            return self._aio
+        except AttributeError:
+            from . import aioapi
+            self._aio = aioapi.AsyncECMService(self)
+            return self._aio
+
+    def setup_pool(self):
+        """ Size the connection pool for the worst case number of concurrent
+        requests;  Each fan-out worker may be reading ahead with a pager. """
+        self.adapter.set_pool_size(max(10, self.concurrency * self.prefetch))
+
+    def setup_cache(self, enabled=True, refresh=False):
+        """ Enable the local response cache.  With refresh set every cached
+        entry is considered expired and must be fetched or revalidated. """
+        if not enabled:
+            self.adapter.cache = None
+            return
+        self.adapter.cache = cache.ResponseCache(self.cache_dir,
+            self.cache_ttls, self.api_prefix, scope=self.cache_scope,
+            refresh=refresh, dependents=self.cache_dependents)
+
+    def cache_scope(self):
+        """ Identify the login for cached data;  The same username on another
+        site is a different login. """
+        return [self.site, self.auth_sig]
+
+    @property
+    def completions(self):
+        """ The tab completion index or None if caching is disabled. """
+        if self.adapter.cache is None:
+            return None
+        return self.adapter.cache.completions
+
     def connect(self, site=None, username=None, password=None):
+        """ Load any saved session.  Logging in and fetching the user's
+        identity are deferred until something actually needs them so commands
+        that never touch the network start fast. """
         if site:
             self.site = site
         self.account = None
         self.hard_username = username
         self.hard_password = password
         self.uri = self.site
+        self._ident = None
         self.load_session(ECMLogin.gen_signature(username))
-        if not self.session_id:
-            self.reset_auth()
-        else:
-            self.ident = self.get('login')
+        self.need_login = not self.session_id
+
+    @property
+    def ident(self):
+        if self._ident is None:
+            self._ident = self.get('login')
+        return self._ident
+
+    @ident.setter
+    def ident(self, value):
+        self._ident = value
+
+    def ensure_login(self):
+        """ Log in if connect did not find a saved session. """
+        with self.auth_lock:
+            if self.need_login:
+                self.reset_auth()
 
     def reset_auth(self):
-        self.fire_event('reset_auth')
-        self.reset_session()
-        auth = ECMLogin(url='%s%s/login/' % (self.site, self.api_prefix))
-        auth.setup(self.hard_username, self.hard_password)
-        self.auth_sig = auth.signature
-        self.adapter.auth = auth
-        self.ident = self.get('login')
+        with self.auth_lock:
+            self.need_login = False
+            self.fire_event('reset_auth')
+            self.reset_session()
+            auth = ECMLogin(url='%s%s/login/' % (self.site, self.api_prefix))
+            auth.setup(self.hard_username, self.hard_password)
+            self.auth_sig = auth.signature
+            self.adapter.auth = auth
+            self.ident = self.get('login')
 
     def load_session(self, signature_lock):
         session_id = auth_sig = None
@@ -259,46 +600,201 @@ class ECMService(Eventer, syndicate.Service):
         except FileNotFoundError:
             pass
 
-    def check_session(self):
+    def check_session(self, session_id=None):
         """ ECM sometimes updates the session token. We make sure we are in
-        sync. """
-        session_id = self.adapter.session.cookies.get_dict()['sessionid']
-        if session_id != self.session_id:
-            with open(self.session_file, 'w') as f:
-                os.chmod(self.session_file, 0o600)
-                json.dump([session_id, self.auth_sig], f)
-            self.session_id = session_id
+        sync.  Clients not using our HTTP session (e.g. aioapi) provide the
+        session_id they received. """
+        if session_id is None:
+            session_id = self.adapter.session.cookies.get_dict()['sessionid']
+        elif session_id != self.session_id:
+            self.adapter.session.cookies['sessionid'] = session_id
+        if session_id == self.session_id:
+            return
+        with self.auth_lock:
+            if session_id != self.session_id:
+                with open(self.session_file, 'w') as f:
+                    os.chmod(self.session_file, 0o600)
+                    json.dump([session_id, self.auth_sig], f)
+                self.session_id = session_id
+
+    def remote_batches(self, path, query):
+        """ Return the `id__in` filter of a remote API call split into chunks
+        if it exceeds the .remote_batch_size, otherwise return None. """
+        if not path or 'id__in' not in query:
+            return None
+        if path[0].strip('/').split('/', 1)[0] != 'remote':
+            return None
+        ids = query['id__in']
+        if isinstance(ids, str):
+            ids = ids.split(',')
+        size = self.remote_batch_size
+        if len(ids) <= size:
+            return None
+        return [','.join(map(str, ids[i:i + size]))
+                for i in range(0, len(ids), size)]
+
+    def batched_results(self, fn, batches):
+        """ Generate the results of `fn` for each batch of ids in order.  The
+        batches are fetched in parallel but the first error aborts. """
+        timeout = getattr(self.worker_state, 'timeout', None)
+        for res in self.fanout(fn, batches, timeout=timeout, ordered=True):
+            if res.error:
+                raise res.error
+            yield res.value
+
+    def get_pager(self, *path, **kwargs):
+        """ A generator for all the results a resource can provide.  Pages
+        are read ahead in parallel when the total size is known.  Remote calls
+        for large numbers of routers are split into parallel batches and
+        merged back into one ordered stream. """
+        batches = self.remote_batches(path, kwargs)
+        if batches:
+
+            def fetch(ids):
+                return list(self.get_pager(*path, **dict(kwargs, id__in=ids)))
+
+            return (x for page in self.batched_results(fetch, batches)
+                    for x in page)
+        page_arg = kwargs.pop('page_size', None)
+        limit_arg = kwargs.pop('limit', None)
+        kwargs['limit'] = page_arg or limit_arg or self.default_page_size
+        return self.prefetch_pager(path, kwargs)
+
+    def prefetch_pager(self, path, kwargs):
+        """ Use the total count from the first page to compute the offsets of
+        the remaining pages and keep up to .prefetch of them in flight while
+        the consumer works.  Order is preserved.  Fall back to following the
+        next links when the total is not reported. """
+        page = self.get(*path, **kwargs)
+        yield from page
+        meta = page.meta or {}
+        if not meta.get('next'):
+            return
+        total = meta.get('total_count')
+        limit = meta.get('limit') or kwargs['limit']
+        if total is None or not limit or self.prefetch < 2:
+            while page.meta['next']:
+                page = self.get(urn=page.meta['next'])
+                yield from page
+            return
+        offsets = range(meta.get('offset', 0) + limit, total, limit)
+        fetch = lambda offset: self.get(*path, **dict(kwargs, offset=offset))
+        timeout = getattr(self.worker_state, 'timeout', None)
+        for res in fanout(self.worker(fetch, timeout), offsets,
+                          concurrency=self.prefetch, ordered=True):
+            if res.error:
+                raise res.error
+            yield from res.value
 
     def do(self, *args, **kwargs):
         """ Wrap some session and error handling around all API actions. """
-        self.fire_event('start_request', args=args, kwargs=kwargs)
+        if self.need_login:
+            self.ensure_login()
+        batches = self.remote_batches(args[1] if len(args) > 1 else None,
+                                      kwargs)
+        if batches:
+            fetch = lambda ids: self.do(*args, **dict(kwargs, id__in=ids))
+            result = syndicate.data.ListResponse()
+            for x in self.batched_results(fetch, batches):
+                result.extend(x)
+            result.meta = None
+            return result
+        request = {
+            "method": args[0],
+            "resource": self.request_resource(args[1] if len(args) > 1
+                                              else None, kwargs.get('urn')),
+            "start": time.perf_counter()
+        }
+        self.fire_event('start_request', args=args, kwargs=kwargs,
+                        request=request)
         if self.account is not None:
             kwargs['account'] = self.account
+        timeout = getattr(self.worker_state, 'timeout', None)
+        if timeout is not None:
+            kwargs.setdefault('timeout', timeout)
+        result = None
+        request['error'] = True
         try:
-            result = super().do(*args, **kwargs)
-        except syndicate.client.ResponseError as e:
-            self.handle_error(e)
-            result = super().do(*args, **kwargs)
-        except Unauthorized as e:
-            print('Auth Error:', e)
-            self.reset_auth()
-            result = super().do(*args, **kwargs)
-        self.check_session()
-        self.fire_event('finish_request', result=result)
+            try:
+                result = super().do(*args, **kwargs)
+            except syndicate.client.ResponseError as e:
+                self.handle_error(e)
+                result = super().do(*args, **kwargs)
+            except Unauthorized as e:
+                print('Auth Error:', e)
+                self.reset_auth()
+                result = super().do(*args, **kwargs)
+            self.check_session()
+            request['error'] = False
+        finally:
+            # Failed requests finish too so listeners can account for them.
+            info = self.adapter.last_response if not request['error'] \
+                else None
+            request.update({
+                "elapsed": time.perf_counter() - request['start'],
+                "bytes": getattr(info, 'bytes', 0),
+                "wire_bytes": getattr(info, 'wire_bytes', 0),
+                "cached": getattr(info, 'cached', False),
+                "paged": getattr(result, 'meta', None) is not None
+            })
+            self.fire_event('finish_request', result=result, request=request)
         return result
 
+    def request_resource(self, path, urn=None):
+        """ Return the top level resource name for a request. """
+        if path:
+            return path[0].strip('/').split('/', 1)[0]
+        elif urn:
+            return urn.split(self.api_prefix, 1)[-1].strip('/').split('/')[0]
+
+    def fanout(self, fn, items, timeout=None, ordered=False):
+        """ Run `fn` against each item concurrently using the `fanout`
+        executor.  API calls made by `fn` are subject to the per-request
+        `timeout` (or the service wide .fanout_timeout) so one unresponsive
+        router can not stall a worker indefinitely. """
+        if timeout is None:
+            timeout = self.fanout_timeout
+        return fanout(self.worker(fn, timeout), items,
+                      concurrency=self.concurrency, ordered=ordered)
+
+    def worker(self, fn, timeout=None):
+        """ Wrap `fn` for use in a worker thread where API calls should be
+        subject to a request timeout. """
+
+        def worker(item):
+            self.worker_state.timeout = timeout
+            try:
+                return fn(item)
+            finally:
+                self.worker_state.timeout = None
+
+        return worker
+
+    @contextlib.contextmanager
+    def uncached(self):
+        """ Bypass cached responses for the reads made by this thread in the
+        context, E.g. to read a resource that is about to be written back. """
+        state = self.adapter.uncached
+        active = getattr(state, 'active', False)
+        state.active = True
+        try:
+            yield
+        finally:
+            state.active = active
+
     def handle_error(self, error):
         """ Pretty print error messages and exit. """
         resp = error.response
-        if resp.get('exception') == 'precondition_failed' and \
-           resp['message'] == 'must_accept_tos':
-            if self.accept_tos():
+        with self.auth_lock:
+            if resp.get('exception') == 'precondition_failed' and \
+               resp['message'] == 'must_accept_tos':
+                if self.accept_tos():
+                    return
+                raise TOSRequired("WARNING: User did not accept terms")
+            err = resp.get('exception') or resp.get('error_code')
+            if err in ('login_failure', 'unauthorized'):
+                self.reset_auth()
                 return
-            raise TOSRequired("WARNING: User did not accept terms")
-        err = resp.get('exception') or resp.get('error_code')
-        if err in ('login_failure', 'unauthorized'):
-            self.reset_auth()
-            return
         if resp['message']:
             err += '\n%s' % resp['message'].strip()
         raise SystemExit("Error: %s" % err)
@@ -0,0 +1,199 @@
+"""
+Local on-disk caching of API responses.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+class CacheEntry(object):
+    """ A cached response body and the validators needed to revalidate it
+    with the server once it expires. """
+
+    def __init__(self, body, stored, etag=None, last_modified=None,
+                 fresh=False):
+        self.body = body
+        self.stored = stored
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    @property
+    def validators(self):
+        """ Request headers for a conditional GET of this entry. """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class CompletionIndex(object):
+    """ Tab completion values for a resource.  The values fetched for a
+    prefix are a superset of the values for any longer prefix, so once a
+    prefix is indexed all the keystrokes that follow it are answered by
+    filtering locally.  Each index is kept in memory and on disk and expires
+    after the TTL of its resource in the ttls dictionary or the default ttl
+    for resources without one. """
+
+    def __init__(self, directory, ttls=None, ttl=300, scope=None):
+        self.directory = directory
+        self.ttls = ttls or {}
+        self.ttl = ttl
+        self.scope = scope or (lambda: None)
+        self.indexes = {}
+
+    def filename(self, resource, name):
+        raw = json.dumps([self.scope(), name])
+        key = hashlib.sha256(raw.encode()).hexdigest()
+        return os.path.join(self.directory, resource, key)
+
+    def load(self, resource, name):
+        path = self.filename(resource, name)
+        try:
+            return self.indexes[path]
+        except KeyError:
+            pass
+        try:
+            with open(path) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        self.indexes[path] = index
+        return index
+
+    def lookup(self, resource, name, startswith):
+        """ Return the set of indexed values for this prefix or None if the
+        prefix is not covered by the index. """
+        index = self.load(resource, name)
+        ttl = self.ttls.get(resource, self.ttl)
+        now = time.time()
+        for prefix, (stored, values) in index.items():
+            if startswith.startswith(prefix) and now - stored < ttl:
+                return set(x for x in values
+                           if x is not None and
+                           str(x).startswith(startswith))
+        return None
+
+    def store(self, resource, name, startswith, values):
+        index = self.load(resource, name)
+        index[startswith] = (time.time(), list(values))
+        path = self.filename(resource, name)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        with open(path, 'w') as f:
+            os.chmod(path, 0o600)
+            json.dump(index, f, default=str)
+
+    def invalidate(self, resource):
+        """ Forget all the indexes for a resource. """
+        path = os.path.join(self.directory, resource)
+        for x in list(self.indexes):
+            if x.startswith(path + os.sep):
+                del self.indexes[x]
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class ResponseCache(object):
+    """ Store raw API response bodies on disk keyed by URL and query args.
+    Only resources with an entry in the ttls dictionary are cached, and each
+    resource has its own directory so all its entries can be invalidated at
+    once when a change is made to it.  The scope function should return a
+    value that identifies the user so cached entries are never shared between
+    different logins.  The dependents dictionary names the resources whose
+    responses embed state from another resource, E.g. the router counts of
+    groups, so changes to it invalidate them too. """
+
+    def __init__(self, directory, ttls, prefix, scope=None, refresh=False,
+                 dependents=None):
+        self.directory = directory
+        self.ttls = ttls
+        self.dependents = dependents or {}
+        self.prefix = prefix
+        self.scope = scope or (lambda: None)
+        self.refresh = refresh
+        self.completions = CompletionIndex(os.path.join(directory,
+                                           'completions'), ttls=ttls,
+                                           scope=self.scope)
+
+    def resource(self, url):
+        """ Return the resource name (e.g. "routers") for an API url. """
+        try:
+            path = url.split(self.prefix, 1)[1]
+        except IndexError:
+            return None
+        return path.strip('/').split('/', 1)[0].split('?', 1)[0]
+
+    def key(self, url, query):
+        query = sorted((query or {}).items())
+        raw = json.dumps([self.scope(), url, query], default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def filename(self, url, query):
+        resource = self.resource(url)
+        if resource not in self.ttls:
+            return None, None
+        path = os.path.join(self.directory, resource, self.key(url, query))
+        return resource, path
+
+    def lookup(self, url, query):
+        """ Return a CacheEntry for this request or None. """
+        resource, path = self.filename(url, query)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        age = time.time() - data['stored']
+        fresh = not self.refresh and age < self.ttls[resource]
+        return CacheEntry(data['body'], data['stored'], data.get('etag'),
+                          data.get('last_modified'), fresh=fresh)
+
+    def store(self, url, query, body, headers=None):
+        """ Save a response body along with any validators from the response
+        headers. """
+        resource, path = self.filename(url, query)
+        if path is None:
+            return
+        headers = headers or {}
+        data = {
+            "stored": time.time(),
+            "body": body,
+            "etag": headers.get('etag'),
+            "last_modified": headers.get('last-modified')
+        }
+        directory = os.path.dirname(path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def touch(self, url, query, entry):
+        """ Mark an entry as fresh again after successful revalidation. """
+        self.store(url, query, entry.body, {
+            "etag": entry.etag,
+            "last-modified": entry.last_modified
+        })
+
+    def invalidate(self, url):
+        """ Drop all the entries and completions for the resource of this
+        url and the resources that depend on it. """
+        resource = self.resource(url)
+        if not resource:
+            return
+        for x in [resource] + list(self.dependents.get(resource, ())):
+            self.completions.invalidate(x)
+            if x in self.ttls:
+                shutil.rmtree(os.path.join(self.directory, x),
+                              ignore_errors=True)
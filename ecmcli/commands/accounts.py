@@ -2,6 +2,7 @@
 Manage ECM Accounts.
 """
 
+import collections
 from . import base
 from shellish import layout
 
@@ -33,6 +34,11 @@ class Formatter(object):
         'settings_bindings.setting'
     ]
 
+    count_types = ['routers', 'user_profiles', 'subaccounts']
+    # Fewer accounts than this get their counts with one (concurrent) API
+    # call per count instead of scanning every router and user.
+    bulk_count_threshold = 50
+
     def setup_args(self, parser):
         self.add_argument('-v', '--verbose', action='store_true')
         super().setup_args(parser)
@@ -55,19 +61,50 @@ class Formatter(object):
             return default
 
     def table_render(self, accounts):
+        if self.verbose:
+            accounts = list(accounts)
+            self.fill_counts(accounts)
         self.table.print([[self.safe_get(xx[0], x, '')
                            for xx in self.table_fields]
                           for x in map(self.bundle, accounts)])
 
     def bundle(self, account):
-        if self.verbose:
-            counts = ['routers', 'user_profiles', 'subaccounts']
-            for x in counts:
-                n = self.api.get(urn=account[x], count='id')[0]['id_count']
-                account['%s_count' % x] = n
         account['groups_count'] = len(account['groups'])
         return account
 
+    def fill_counts(self, accounts, all_accounts=None):
+        """ Set the router, user and subaccount counts used in verbose mode.
+        Small sets are counted with concurrent count queries.  Large sets are
+        counted by scanning the account field of every router and user
+        profile, which takes a few large pages instead of three requests per
+        account.  Subaccounts are counted from `all_accounts` when the caller
+        already has them. """
+        if len(accounts) < self.bulk_count_threshold:
+            jobs = [(x, kind) for x in accounts for kind in self.count_types]
+            counter = lambda job: self.api.get(urn=job[0][job[1]],
+                                               count='id')[0]['id_count']
+            for res in self.api.fanout(counter, jobs):
+                if res.error:
+                    raise res.error
+                account, kind = res.item
+                account['%s_count' % kind] = res.value
+            return
+        counts = dict((x, collections.Counter()) for x in self.count_types)
+        for x in self.api.get_pager('routers', fields='account',
+                                    page_size=1000):
+            counts['routers'][x['account']] += 1
+        for x in self.api.get_pager('profiles', fields='account',
+                                    page_size=1000):
+            counts['user_profiles'][x['account']] += 1
+        if all_accounts is None:
+            all_accounts = self.api.get_pager('accounts', fields='account',
+                                              page_size=10000)
+        for x in all_accounts:
+            counts['subaccounts'][x['account']] += 1
+        for x in accounts:
+            for kind in self.count_types:
+                x['%s_count' % kind] = counts[kind][x['resource_uri']]
+
     def terse_formatter(self, account):
         return '%(name)s (id:%(id)s)' % account
 
@@ -116,10 +153,22 @@ class Tree(Formatter, base.ECMCommand):
             root_ref = root['node'].children
         else:
             root_ref = [root_ref['node']]
+        if self.verbose:
+            self.fill_counts(self.subtree(root_ref), accounts.values())
         formatter = lambda x: self.formatter(self.bundle(x.value))
         t = layout.Tree(formatter=formatter, sort_key=lambda x: x.value['id'])
         t.render(root_ref)
 
+    def subtree(self, nodes):
+        """ Return the accounts for the nodes and all their descendants. """
+        accounts = []
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            accounts.append(node.value)
+            stack.extend(node.children)
+        return accounts
+
 
 class Show(Formatter, base.ECMCommand):
     """ Show account info. """
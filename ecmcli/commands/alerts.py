@@ -2,9 +2,13 @@
 Analyze and Report ECM Alerts.
 """
 
-import collections
+import dateutil.parser
+import hashlib
 import humanize
+import json
+import os
 import sys
+import tempfile
 from . import base
 
 
@@ -14,43 +18,152 @@ def since(dt):
     return humanize.naturaltime(since)[:-4]
 
 
+class AlertStore(object):
+    """ Per-type aggregates of the alerts collected so far along with the
+    creation time of the newest one, so later runs only need to fetch alerts
+    created since.  The ids of the alerts created at exactly that time are
+    kept too;  Newer alerts can share the timestamp. """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.newest = None
+        self.boundary = set()
+        self.types = {}
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        parse = dateutil.parser.parse
+        if data['newest']:
+            self.newest = parse(data['newest'])
+        self.boundary = set(data['boundary'])
+        self.types = dict((name, {
+            "count": x['count'],
+            "newest": parse(x['newest']),
+            "oldest": parse(x['oldest'])
+        }) for name, x in data['types'].items())
+
+    def save(self):
+        if self.filename is None:
+            return
+        data = {
+            "newest": self.newest and self.newest.isoformat(),
+            "boundary": sorted(self.boundary),
+            "types": dict((name, {
+                "count": x['count'],
+                "newest": x['newest'].isoformat(),
+                "oldest": x['oldest'].isoformat()
+            }) for name, x in self.types.items())
+        }
+        directory = os.path.dirname(self.filename)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def query(self):
+        """ API filters for the alerts not yet in the store. """
+        if self.newest is None:
+            return {}
+        return {"created_ts__gte": self.newest.isoformat()}
+
+    def add(self, alert):
+        """ Add an alert to the aggregates and return True unless it was
+        already counted.  Alerts must be added in creation order. """
+        ts = alert['created_ts']
+        if ts == self.newest and alert['id'] in self.boundary:
+            return False
+        try:
+            ent = self.types[alert['alert_type']]
+        except KeyError:
+            self.types[alert['alert_type']] = {
+                "count": 1,
+                "newest": ts,
+                "oldest": ts
+            }
+        else:
+            ent['count'] += 1
+            ent['newest'] = max(ent['newest'], ts)
+            ent['oldest'] = min(ent['oldest'], ts)
+        if ts != self.newest:
+            self.newest = ts
+            self.boundary.clear()
+        self.boundary.add(alert['id'])
+        return True
+
+
 class Alerts(base.ECMCommand):
-    """ Analyze and Report ECM Alerts """
+    """ Analyze and Report ECM Alerts
+
+    Alert counts are kept locally so each run only downloads the alerts
+    created since the last one.  Alerts that ECM has since expired remain in
+    the local counts until `--rebuild` is used. """
 
     name = 'alerts'
+    save_interval = 1000
 
     def setup_args(self, parser):
         self.add_argument('-e', '--expand', action='store_true',
                           help="Expand each alert")
+        self.add_argument('--since', metavar='AGE_OR_DATE',
+                          help='Only report alerts created since a date or '
+                          'an age such as 12h, 7d or 2w.  The local counts '
+                          'are not used.')
+        self.add_argument('--rebuild', action='store_true',
+                          help='Discard the local counts and download every '
+                          'alert again.')
+
+    def store_file(self):
+        """ The alert store is specific to the site, user and account. """
+        self.api.ensure_login()
+        raw = json.dumps([self.api.site, self.api.auth_sig, self.api.account])
+        key = hashlib.sha256(raw.encode()).hexdigest()
+        return os.path.join(self.api.cache_dir, 'alerts', key)
 
     def run(self, args):
-        by_type = collections.OrderedDict()
-        alerts = self.api.get_pager('alerts', order_by='-created_ts')
+        if args.since:
+            store = AlertStore()
+            start = base.parse_since(args.since)
+            query = {"created_ts__gte": start.isoformat()}
+        else:
+            store = AlertStore(self.store_file())
+            if not args.rebuild:
+                store.load()
+            query = store.query()
+        alerts = self.api.get_pager('alerts', order_by='created_ts', **query)
         msg = "\rCollecting new alerts: %5d"
         print(msg % 0, end='')
         sys.stdout.flush()
-        for i, x in enumerate(alerts):
-            print(msg % i, end='')
-            sys.stdout.flush()
-            try:
-                ent = by_type[x['alert_type']]
-            except KeyError:
-                ent = by_type[x['alert_type']] = {
-                    "records": [x],
-                    "newest": x['created_ts'],
-                    "oldest": x['created_ts'],
-                }
-            else:
-                ent['records'].append(x),
-                ent['oldest'] = x['created_ts']
-        print()
+        added = 0
+        try:
+            for x in alerts:
+                if not store.add(x):
+                    continue
+                added += 1
+                if not added % 100:
+                    print(msg % added, end='')
+                    sys.stdout.flush()
+                if not added % self.save_interval:
+                    store.save()
+        finally:
+            store.save()
+        print(msg % added)
         data = [('Alert Type', 'Count', 'Most Recent', 'Oldest')]
         data.extend((
             name,
-            len(x['records']),
+            x['count'],
             since(x['newest']),
             since(x['oldest'])
-        ) for name, x in by_type.items())
+        ) for name, x in sorted(store.types.items(),
+                                key=lambda x: x[1]['newest'], reverse=True))
         self.tabulate(data)
 
 command_classes = [Alerts]
@@ -3,6 +3,9 @@ Foundation components for commands.
 """
 
 import collections
+import datetime
+import dateutil.parser
+import re
 import shellish
 from ecmcli import shell
 
@@ -15,21 +18,59 @@ def confirm(msg, exit=True):
     return True
 
 
+def parse_since(value, now=None):
+    """ Parse a relative age such as "30m", "12h", "7d" or "2w" or an
+    absolute date into an aware datetime. """
+    units = {"s": 'seconds', "m": 'minutes', "h": 'hours', "d": 'days',
+             "w": 'weeks'}
+    m = re.fullmatch(r'(\d+)([smhdw])', value.strip())
+    if m:
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        delta = datetime.timedelta(**{units[m.group(2)]: int(m.group(1))})
+        return now - delta
+    try:
+        dt = dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        raise SystemExit('Invalid date or age: %s' % value)
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return dt
+
+
 class ECMCommand(shellish.Command):
     """ Extensions for dealing with ECM's APIs. """
 
     Searcher = collections.namedtuple('Searcher', 'lookup, completer, help')
     Shell = shell.ECMShell
 
+    def cached_complete(self, resource, name, startswith, fetch):
+        """ Answer a completion from the completion index when possible,
+        otherwise call fetch(startswith) and add its results to the index
+        so longer prefixes can be filtered locally. """
+        index = self.api.completions
+        if index is not None:
+            values = index.lookup(resource, name, startswith)
+            if values is not None:
+                return values
+        values = fetch(startswith)
+        if index is not None:
+            index.store(resource, name, startswith, values)
+        return values
+
     def api_complete(self, resource, field, startswith):
-        options = {}
-        if '.' in field:
-            options['expand'] = field.rsplit('.', 1)[0]
-        if startswith:
-            options['%s__startswith' % field] = startswith
-        resources = self.api.get_pager(resource, fields=field, **options)
-        return set(self.res_flatten(x, {field: field})[field]
-                   for x in resources)
+
+        def fetch(startswith):
+            options = {}
+            if '.' in field:
+                options['expand'] = field.rsplit('.', 1)[0]
+            if startswith:
+                options['%s__startswith' % field] = startswith
+            resources = self.api.get_pager(resource, fields=field, **options)
+            return set(self.res_flatten(x, {field: field})[field]
+                       for x in resources)
+
+        return self.cached_complete(resource, field, startswith, fetch)
 
     def make_completer(self, resource, field):
         """ Return a function that completes for the API .resource and
@@ -103,15 +144,19 @@ class ECMCommand(shellish.Command):
                 terms = set('%s:<MATCH_CRITERIA>' % x for x in fields)
                 return terms | {'<SEARCH_CRITERIA>'}
             else:
-                expands = [x.rsplit('.', 1)[0] for x in fields.values()
-                           if '.' in x]
-                options = {"expand": ','.join(expands)} if expands else {}
-
-                results = self.api_search(resource, fields, [startswith],
-                                          match='startswith', **options)
-                return set(val for res in results
-                           for val in self.res_flatten(res, fields).values()
-                           if val and str(val).startswith(startswith))
+                name = 'search:%s' % ','.join(sorted(fields.values()))
+                return self.cached_complete(resource, name, startswith,
+                                            search_complete)
+
+        def search_complete(startswith):
+            expands = [x.rsplit('.', 1)[0] for x in fields.values()
+                       if '.' in x]
+            options = {"expand": ','.join(expands)} if expands else {}
+            results = self.api_search(resource, fields, [startswith],
+                                      match='startswith', **options)
+            return set(str(val) for res in results
+                       for val in self.res_flatten(res, fields).values()
+                       if val and str(val).startswith(startswith))
 
         help = 'Search "%s" on fields: %s' % (resource, ', '.join(fields))
         return self.Searcher(lookup, complete, help)
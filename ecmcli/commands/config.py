@@ -3,8 +3,14 @@ Get and set configs for routers and groups.
 """
 
 import argparse
+import collections
+import copy
+import hashlib
 import json
+import os
+import tempfile
 from . import base
+from .routers import Search
 
 
 def walk_config(key, config):
@@ -27,50 +33,288 @@ def walk_config(key, config):
     return offt
 
 
+def list_index(items, key):
+    """ Return the index a key refers to in a list-valued config section.  An
+    index one past the end adds a new item. """
+    if not key.isdigit() or int(key) > len(items):
+        raise ValueError('Not a list index: %s' % key)
+    if int(key) == len(items):
+        items.append({})
+    return int(key)
+
+
+def update_config(config, key, value):
+    """ Return a copy of an (updates, removals) config with `key` set to
+    `value`.  Numeric keys index into list-valued sections.  Pending
+    removals of the key or anything under it are dropped. """
+    updates, removals = copy.deepcopy(config)
+    path = key.split('.')
+    offt = updates
+    for x in path[:-1]:
+        if isinstance(offt, list):
+            offt = offt[list_index(offt, x)]
+        else:
+            offt = offt.setdefault(x, {})
+        if not isinstance(offt, (dict, list)):
+            raise ValueError('Not a config section: %s' % x)
+    if isinstance(offt, list):
+        offt[list_index(offt, path[-1])] = value
+    else:
+        offt[path[-1]] = value
+    removals = [x for x in removals if x[:len(path)] != path]
+    return [updates, removals]
+
+
+def format_share(count, total):
+    """ Percentage of total as a whole number that never rounds a partial
+    share to 0% or 100%. """
+    share = '%.0f' % (count / total * 100)
+    if share == '0' and count:
+        return '<1%'
+    if share == '100' and count < total:
+        return '>99%'
+    return share + '%'
+
+
+class ConfigCache(object):
+    """ Router configurations stored by router id along with the version
+    number of the router's configuration manager.  A cached config is only
+    used while the router's version number is unchanged. """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def filename(self, router_id):
+        return os.path.join(self.directory, '%s.json' % router_id)
+
+    def get(self, router_id, version):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.filename(router_id)) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data['version'] != version:
+            return None
+        return data['config']
+
+    def put(self, router_id, version, config):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"version": version, "config": config}, f)
+            os.replace(tmp, self.filename(router_id))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
 class Config(base.ECMCommand):
-    """ [EXPEREMENTAL] Get and set configs for routers and groups. """
+    """ [EXPEREMENTAL] Get and set configs for routers and groups.
+
+    Router configs are fetched in parallel and cached locally until the
+    router's config version changes.  `config diff KEY` groups routers by
+    their value for KEY to show which differ from the rest.
+
+    The routers used are narrowed by `--group`, `--account`, `--router` and
+    `--search`.  Setting a value with only `--group` writes it to the
+    group's config, which ECM applies to every router in the group. """
 
     name = 'config'
+    router_fields = 'id,name,configuration_manager'
 
     def setup_args(self, parser):
         self.add_argument('--group', metavar='ID_OR_NAME',
                           complete=self.make_completer('groups', 'name'))
+        self.add_argument('--account', metavar='ID_OR_NAME',
+                          complete=self.make_completer('accounts', 'name'))
+        self.add_argument('--router', metavar='ID_OR_NAME', action='append',
+                          dest='routers',
+                          complete=self.make_completer('routers', 'name'))
+        searcher = self.make_searcher('routers', Search.fields)
+        self.lookup = searcher.lookup
+        self.add_argument('--search', metavar='SEARCH_CRITERIA',
+                          action='append', help=searcher.help,
+                          complete=searcher.completer)
         self.add_argument('get_or_set', metavar='GET_OR_SET',
                           nargs=argparse.REMAINDER,
-                          help='key || key=json_value')
+                          help='key || key=json_value || diff key')
+
+    def config_cache(self):
+        """ The config cache is specific to the site and user and is
+        disabled by `--no-cache`. """
+        if self.api.adapter.cache is None:
+            return ConfigCache()
+        self.api.ensure_login()
+        raw = json.dumps([self.api.site, self.api.auth_sig])
+        key = hashlib.sha256(raw.encode()).hexdigest()
+        return ConfigCache(os.path.join(self.api.cache_dir, 'configs', key))
+
+    def select_routers(self, args, group=None):
+        """ Return a pager for the routers matching all the selection
+        options, filtered by the API. """
+        filters = {}
+        if group is not None:
+            filters['group'] = group['id']
+        if args.account:
+            account = self.api.get_by_id_or_name('accounts', args.account)
+            filters['account'] = account['id']
+        if args.routers:
+            filters['id__in'] = ','.join(
+                self.api.get_by_id_or_name('routers', x)['id']
+                for x in args.routers)
+        if args.search:
+            return self.lookup(args.search, **filters)
+        return self.api.get_pager('routers', fields=self.router_fields,
+                                  **filters)
 
     def run(self, args):
-        routers = self.api.get_pager('routers')
+        group = None
+        if args.group:
+            group = self.api.get_by_id_or_name('groups', args.group)
+        if args.get_or_set and args.get_or_set[0] == 'diff':
+            key = ' '.join(args.get_or_set[1:]) or None
+            return self.diff_value(self.select_routers(args, group), key)
         if not args.get_or_set:
-            return self.get_value(routers, None)
+            return self.get_value(self.select_routers(args, group), None)
         get_or_set = ' '.join(args.get_or_set).split('=', 1)
         key = get_or_set.pop(0)
         if get_or_set:
             value = get_or_set[0]
-            return self.set_value(routers, key, value)
+            if group is not None and not (args.account or args.routers or
+                                          args.search):
+                return self.set_group_value(group, key, value)
+            return self.set_value(self.select_routers(args, group), key,
+                                  value)
         else:
-            return self.get_value(routers, key)
+            return self.get_value(self.select_routers(args, group), key)
 
-    def set_value(self, routers, key, value):
+    def parse_value(self, value):
         try:
-            value = json.loads(value)
+            return json.loads(value)
         except ValueError as e:
             raise SystemExit('Invalid JSON Value: %s' % e)
-        for x in routers:
-            ok = self.api.put('remote', 'config', key.replace('.', '/'),
-                              value, id=x['id'])[0]
-            status = 'okay' if ok['success'] else \
-                     '%s %s' % (ok['exception'], ok.get('message', ''))
-            print('%s:' % x['name'], status)
+
+    def set_group_value(self, group, key, value):
+        """ Update the group config with one request instead of writing to
+        each of its routers.  The config is read again past the response
+        cache so changes made elsewhere are not reverted by the write. """
+        value = self.parse_value(value)
+        with self.api.uncached():
+            group = self.api.get('groups', group['id'],
+                                 expand='configuration')
+        try:
+            configuration = update_config(group['configuration'], key, value)
+        except ValueError as e:
+            raise SystemExit(e)
+        self.api.put('groups', group['id'], {"configuration": configuration})
+        print('%s:' % group['name'], 'okay')
+
+    def set_value(self, routers, key, value):
+        value = self.parse_value(value)
+
+        def setter(router):
+            return self.api.put('remote', 'config', key.replace('.', '/'),
+                                value, id=router['id'])[0]
+
+        for res in self.api.fanout(setter, routers):
+            ok = res.value
+            if res.error:
+                status = str(res.error)
+            elif ok['success']:
+                status = 'okay'
+            else:
+                status = '%s %s' % (ok['exception'], ok.get('message', ''))
+            print('[%s] %s:' % (res.progress, res.item['name']), status)
+
+    def versions(self, routers):
+        """ Return the config version of each router's configuration manager
+        keyed by manager id.  Versions are fetched in parallel batches without
+        the configs themselves. """
+        ids = [x['configuration_manager'].rsplit('/')[-2] for x in routers
+               if x['configuration_manager']]
+        size = self.api.default_page_size
+        batches = [','.join(ids[i:i + size])
+                   for i in range(0, len(ids), size)]
+
+        def getter(batch):
+            return list(self.api.get_pager('configuration_managers',
+                                           id__in=batch, page_size=size,
+                                           fields='id,version_number'))
+
+        versions = {}
+        for res in self.api.fanout(getter, batches):
+            if res.error:
+                raise SystemExit('Config version lookup failed: %s' %
+                                 res.error)
+            versions.update((str(x['id']), x['version_number'])
+                            for x in res.value)
+        return versions
+
+    def configs(self, routers):
+        """ Generate a FanOutResult with the (updates, removals) config of
+        each router, using the config cache for routers whose config version
+        is unchanged. """
+        routers = list(routers)
+        cache = self.config_cache()
+        versions = self.versions(routers)
+
+        def getter(router):
+            if not router['configuration_manager']:
+                raise ValueError('No configuration manager')
+            manager_id = router['configuration_manager'].rsplit('/')[-2]
+            config = cache.get(router['id'], versions.get(manager_id))
+            if config is None:
+                manager = self.api.get('configuration_managers', manager_id,
+                                       fields='version_number,configuration')
+                config = manager['configuration']
+                cache.put(router['id'], manager['version_number'], config)
+            return config
+
+        return self.api.fanout(getter, routers)
 
     def get_value(self, routers, key):
-        for x in routers:
-            diff = self.api.get('routers', x['id'], 'configuration_manager',
-                                'configuration')
-            updates, removals = diff
-            path = x['name']
+        for res in self.configs(routers):
+            path = res.item['name']
             if key:
                 path += '.%s' % key
+            if res.error:
+                print(path, '=', '<%s>' % res.error)
+                continue
+            updates, removals = res.value
             print(path, '=', json.dumps(walk_config(key, updates), indent=4))
 
+    def diff_value(self, routers, key):
+        """ Group routers by their value for `key`.  Every router in a group
+        is listed except for those with the most common value, if there is
+        one. """
+        groups = collections.defaultdict(list)
+        total = 0
+        for res in self.configs(routers):
+            if res.error:
+                value = '<%s>' % res.error
+            else:
+                updates, removals = res.value
+                value = json.dumps(walk_config(key, updates), indent=4,
+                                   sort_keys=True)
+            groups[value].append(res.item)
+            total += 1
+        ranked = sorted(groups.items(), key=lambda x: (-len(x[1]), x[0]))
+        sizes = [len(x[1]) for x in ranked]
+        common = len(ranked) > 1 and sizes[0] > sizes[1]
+        for i, (value, members) in enumerate(ranked, 1):
+            if i > 1:
+                print()
+            heading = 'Value %d: %d router(s) (%s)' % (i, len(members),
+                format_share(len(members), total))
+            if i > 1 or not common:
+                heading += ': %s' % ', '.join(sorted('%s (%s)' % (x['name'],
+                                              x['id']) for x in members))
+            print(heading)
+            print(value)
+
 command_classes = [Config]
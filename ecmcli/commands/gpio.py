@@ -30,9 +30,10 @@ class GPIO(base.ECMCommand):
     """ Set or get the output GPIO. """
 
     name = 'gpio'
+    gpio_path = 'config/system/connector_gpio/output'
 
     def setup_args(self, parser):
-        self.add_argument('ident', metavar='ROUTER_ID_OR_NAME',
+        self.add_argument('idents', metavar='ROUTER_ID_OR_NAME', nargs='+',
                           complete=self.make_completer('routers', 'name'))
         self.add_argument('-v', '--value', type=int, metavar="GPIO_VALUE", default=None)
 
@@ -40,25 +41,29 @@ class GPIO(base.ECMCommand):
         return 'OFF (0)' if status == 0 else 'ON (1)'
 
     def run(self, args):
-        gpio_path = 'config/system/connector_gpio/output'
-        r = self.api.get_by_id_or_name('routers', args.ident)
-
-        if args.value:
-            val = args.value
-            print('Setting GPIO on %s (%s) to: %s' % (r['name'], r['id'],
-                  self.human_status(val)))
-            g = GPIOResponse(self.api.put('remote', gpio_path, val,
-                             id=r['id']))
+        routers = [self.api.get_by_id_or_name('routers', x)
+                   for x in args.idents]
+        if args.value is not None:
+            print('Setting GPIO to: %s' % self.human_status(args.value))
+        for res in self.api.fanout(lambda r: self.gpio(r, args.value),
+                                   routers):
+            r = res.item
+            if res.error:
+                print('%s (%s): %s' % (r['name'], r['id'], res.error))
+            elif res.value.success:
+                print('GPIO on %s (%s) now has value: %s' % (r['name'],
+                      r['id'], self.human_status(res.value.status)))
+            else:
+                print('%s (%s): %s' % (r['name'], r['id'], res.value.message))
 
+    def gpio(self, router, value=None):
+        """ Optionally set and then read the GPIO value of a router. """
+        if value is not None:
+            g = GPIOResponse(self.api.put('remote', self.gpio_path, value,
+                             id=router['id']))
             if not g.success:
-                print(g.message)
-                return
-
-        g = GPIOResponse(self.api.get('remote', gpio_path, id=r['id']))
-        if g.success:
-            print('GPIO on %s (%s) now has value: %s' % (r['name'], r['id'],
-                  self.human_status(g.status)))
-        else:
-            print(g.message)
+                return g
+        return GPIOResponse(self.api.get('remote', self.gpio_path,
+                                         id=router['id']))
 
 command_classes = [GPIO]
@@ -2,7 +2,227 @@
 Download router logs from ECM.
 """
 
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import dateutil.parser
+import gzip
+import heapq
+import humanize
+import itertools
+import json
+import os
+import re
+import sys
+import time
 from . import base
+from .. import api
+
+
+class LogCursor(object):
+    """ Position in a router's logs.  Queries ask for entries at or after
+    the newest timestamp seen and the ones already seen at that timestamp
+    are skipped, so no entry is missed or repeated when new entries share
+    its timestamp. """
+
+    def __init__(self, router):
+        self.router = router
+        self.newest = None
+        self.boundary = set()
+
+    def query(self):
+        if self.newest is None:
+            return {}
+        return {"timestamp__gte": self.newest.isoformat()}
+
+    def advance(self, entries):
+        """ Return the entries that have not been seen before. """
+        fresh = []
+        for x in entries:
+            ts = x['timestamp']
+            if ts == self.newest and x['id'] in self.boundary:
+                continue
+            if self.newest is None or ts > self.newest:
+                self.newest = ts
+                self.boundary.clear()
+            self.boundary.add(x['id'])
+            fresh.append(x)
+        return fresh
+
+
+class LogStream(LogCursor):
+    """ Polling state of one router's logs in follow mode.  Routers that
+    have nothing new are polled less often, up to `max_interval`.
+
+    Entry timestamps come from the router's clock, so `skew` tracks how far
+    ahead of the local clock the router has been seen to be. """
+
+    def __init__(self, router, min_interval, max_interval):
+        super().__init__(router)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.polled = None
+        self.skew = datetime.timedelta(0)
+        self.failed = False
+
+    @property
+    def horizon(self):
+        """ The router time at which the last poll started;  Any entry that
+        has not been seen must be newer. """
+        if self.polled is None:
+            return None
+        return self.polled + self.skew
+
+    def update(self, entries, polled):
+        """ Filter out entries seen by an earlier poll and adjust the poll
+        interval.  `polled` is the local time when the poll was started. """
+        fresh = self.advance(entries)
+        if fresh:
+            self.interval = self.min_interval
+            self.skew = max(self.skew, self.newest - polled)
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self.polled = polled
+        self.failed = False
+        return fresh
+
+
+class LogExport(LogCursor):
+    """ A router's logs exported to a JSON lines file, optionally gzipped.
+    Until the download is finished the data goes to a ".part" file next to
+    a ".state" file recording how much of it is complete and the position
+    of the last entry written, so an interrupted export resumes where it
+    left off.  When compressing each chunk is a separate gzip member so the
+    complete part of the file is always valid. """
+
+    def __init__(self, router, directory, compress=False):
+        super().__init__(router)
+        ext = '.jsonl.gz' if compress else '.jsonl'
+        self.filename = os.path.join(directory, router['id'] + ext)
+        self.part_file = self.filename + '.part'
+        self.state_file = self.part_file + '.state'
+        self.compress = compress
+        self.offset = 0
+        self.entries = 0
+        self.bytes = 0
+        self.file = None
+
+    @property
+    def complete(self):
+        return os.path.exists(self.filename)
+
+    def open(self):
+        """ Open the part file, resuming from the saved state if any. """
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        else:
+            self.offset = state['offset']
+            self.newest = dateutil.parser.parse(state['newest'])
+            self.boundary = set(state['boundary'])
+        self.file = open(self.part_file, 'r+b' if self.offset else 'wb')
+        self.file.truncate(self.offset)
+        self.file.seek(self.offset)
+
+    def write(self, entries):
+        entries = self.advance(entries)
+        if not entries:
+            return
+        data = ''.join(json.dumps(x, default=lambda x: x.isoformat()) + '\n'
+                       for x in entries).encode()
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        self.file.write(data)
+        self.file.flush()
+        self.offset += len(data)
+        self.entries += len(entries)
+        self.bytes += len(data)
+        state = {
+            "offset": self.offset,
+            "newest": self.newest.isoformat(),
+            "boundary": sorted(self.boundary)
+        }
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def finish(self):
+        """ Rename the part file once the download is complete.  The state
+        goes first;  A part file without it is simply started over. """
+        self.close()
+        try:
+            os.remove(self.state_file)
+        except FileNotFoundError:
+            pass
+        os.replace(self.part_file, self.filename)
+
+
+class LogMerger(object):
+    """ Merge the entries from many log streams into timestamp order.
+    Entries are held until every healthy stream has been polled past their
+    timestamp, so an entry can not be followed by an older one.  Routers
+    with clocks far apart would hold entries for as long as the difference,
+    so entries are also released after `max_delay` seconds or when more than
+    `buffer_size` are waiting. """
+
+    def __init__(self, streams, buffer_size, max_delay=None,
+                 clock=time.monotonic):
+        self.streams = streams
+        self.buffer_size = buffer_size
+        self.max_delay = max_delay
+        self.clock = clock
+        self.heap = []
+        self.counter = itertools.count()
+        self.deadlines = collections.deque()
+
+    def add(self, stream, entries):
+        newest = None
+        for x in entries:
+            heapq.heappush(self.heap, (x['timestamp'], next(self.counter),
+                                       stream.router, x))
+            if newest is None or x['timestamp'] > newest:
+                newest = x['timestamp']
+        if newest is not None and self.max_delay is not None:
+            self.deadlines.append((self.clock() + self.max_delay, newest))
+
+    def deadline(self):
+        """ The clock time when held entries are next due for release. """
+        return self.deadlines[0][0] if self.deadlines else None
+
+    def watermark(self):
+        """ The time before which no more entries are expected. """
+        horizons = [x.horizon for x in self.streams if not x.failed]
+        if not horizons:
+            return None
+        if None in horizons:
+            watermark = datetime.datetime.min.replace(
+                tzinfo=datetime.timezone.utc)
+        else:
+            watermark = min(horizons)
+        now = self.clock()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            watermark = max(watermark, self.deadlines.popleft()[1])
+        return watermark
+
+    def pop(self, flush=False):
+        """ Generate (router, entry) for each entry that is ready. """
+        watermark = None if flush else self.watermark()
+        if flush:
+            self.deadlines.clear()
+        while self.heap and (watermark is None or
+                             self.heap[0][0] <= watermark or
+                             len(self.heap) > self.buffer_size):
+            x = heapq.heappop(self.heap)
+            yield x[2], x[3]
 
 
 class Logs(base.ECMCommand):
@@ -10,36 +230,251 @@ class Logs(base.ECMCommand):
 
     name = 'logs'
     levels = ['debug', 'info', 'warning', 'error', 'critical']
+    follow_min_interval = 1
+    follow_max_interval = 16
+    follow_buffer_size = 10000
+    follow_max_delay = 5
 
     def setup_args(self, parser):
         parser.add_argument('idents', metavar='ROUTER_ID_OR_NAME', nargs='*')
         parser.add_argument('--clear', action='store_true', help="Clear logs")
-        parser.add_argument('-l', '--level', choices=self.levels)
+        parser.add_argument('-l', '--level', choices=self.levels,
+                            help='Minimum severity of entries to show.')
+        parser.add_argument('-m', '--match', metavar='TEXT',
+                            help='Only show entries with messages containing '
+                            'TEXT, ignoring case.')
+        parser.add_argument('-r', '--regex', metavar='PATTERN',
+                            type=self.regex, help='Only show entries with '
+                            'messages matching a regular expression.')
+        parser.add_argument('--since', metavar='AGE_OR_DATE',
+                            help='Only show entries logged since a date or '
+                            'an age such as 30m, 12h or 7d.')
+        parser.add_argument('--until', metavar='AGE_OR_DATE',
+                            help='Only show entries logged before a date or '
+                            'an age.')
+        parser.add_argument('-f', '--follow', action='store_true',
+                            help='Poll for new log entries and print them '
+                            'as they arrive, merged from all the routers.')
+        parser.add_argument('-n', '--lines', type=int, default=10,
+                            help='Number of recent entries per router to '
+                            'show before following.')
+        parser.add_argument('--export', metavar='DIR',
+                            help='Download the logs of each router to a JSON '
+                            'lines file in DIR.  Interrupted exports are '
+                            'resumed when run again.')
+        parser.add_argument('-z', '--gzip', action='store_true',
+                            help='Compress exported files.')
 
     def run(self, args):
         if args.idents:
-            routers = map(self.api.get_by_id_or_name, args.idents)
+            routers = [self.api.get_by_id_or_name('routers', x)
+                       for x in args.idents]
         else:
             routers = self.api.get_pager('routers')
         if args.clear:
             self.clear(args, routers)
+        elif args.follow:
+            self.follow(args, list(routers))
+        elif args.export:
+            self.export(args, routers)
         else:
             self.view(args, routers)
 
     def clear(self, args, routers):
-        for rinfo in routers:
-            print("Clearing logs for: %s (%s)" % (rinfo['name'], rinfo['id']))
-            self.api.delete('logs', rinfo['id'])
+        clear = lambda rinfo: self.api.delete('logs', rinfo['id'])
+        for res in self.api.fanout(clear, routers):
+            rinfo = res.item
+            if res.error:
+                print("[%s] Failed to clear logs for: %s (%s): %s" % (
+                      res.progress, rinfo['name'], rinfo['id'], res.error))
+            else:
+                print("[%s] Cleared logs for: %s (%s)" % (res.progress,
+                      rinfo['name'], rinfo['id']))
 
-    def view(self, args, routers):
+    def regex(self, pattern):
+        try:
+            return re.compile(pattern)
+        except re.error as e:
+            raise argparse.ArgumentTypeError('invalid regex: %s' % e)
+
+    def filters(self, args):
+        """ API query filters for the entries selected by the arguments. """
         filters = {}
         if args.level:
-            filters['levelname'] = args.level.upper()
-        for rinfo in routers:
+            levels = self.levels[self.levels.index(args.level):]
+            filters['levelname__in'] = ','.join(x.upper() for x in levels)
+        if args.match:
+            filters['message__icontains'] = args.match
+        if args.since:
+            filters['timestamp__gte'] = \
+                base.parse_since(args.since).isoformat()
+        if args.until:
+            filters['timestamp__lt'] = \
+                base.parse_since(args.until).isoformat()
+        return filters
+
+    def matcher(self, args):
+        """ Return a predicate for the filtering the API can't do or None.
+        It is applied to entries as they are paged in. """
+        if not args.regex:
+            return None
+        search = args.regex.search
+        return lambda x: search(x['message'] or '') is not None
+
+    def print_entry(self, rinfo, entry):
+        entry['mac'] = rinfo['mac']
+        print('%(timestamp)s [%(mac)s] [%(levelname)8s] '
+              '[%(source)18s] %(message)s' % entry)
+
+    def view(self, args, routers):
+        filters = self.filters(args)
+        match = self.matcher(args)
+
+        def download(rinfo):
+            return list(filter(match, self.api.get_pager('logs', rinfo['id'],
+                                                         **filters)))
+
+        for res in self.api.fanout(download, routers):
+            rinfo = res.item
             print("Logs for: %s (%s)" % (rinfo['name'], rinfo['id']))
-            for x in self.api.get_pager('logs', rinfo['id'], **filters):
-                x['mac'] = rinfo['mac']
-                print('%(timestamp)s [%(mac)s] [%(levelname)8s] '
-                      '[%(source)18s] %(message)s' % x)
+            if res.error:
+                print("Error: %s" % res.error)
+                continue
+            for x in res.value:
+                self.print_entry(rinfo, x)
+
+    def export(self, args, routers):
+        """ Stream the logs of each router to its own file, several routers
+        at a time. """
+        filters = self.filters(args)
+        match = self.matcher(args)
+        os.makedirs(args.export, exist_ok=True)
+        chunk = self.api.default_page_size
+
+        def download(rinfo):
+            export = LogExport(rinfo, args.export, args.gzip)
+            if export.complete:
+                return None
+            export.open()
+            try:
+                query = dict(filters, **export.query())
+                entries = []
+                for x in filter(match, self.api.get_pager('logs', rinfo['id'],
+                                order_by='timestamp', **query)):
+                    entries.append(x)
+                    if len(entries) >= chunk:
+                        export.write(entries)
+                        entries = []
+                export.write(entries)
+            except BaseException:
+                export.close()
+                raise
+            export.finish()
+            return export
+
+        start = time.monotonic()
+        entries = size = exported = failed = skipped = 0
+        for res in self.api.fanout(download, routers):
+            rinfo = res.item
+            if res.error:
+                failed += 1
+                print("[%s] Failed to export logs for: %s (%s): %s" % (
+                      res.progress, rinfo['name'], rinfo['id'], res.error))
+            elif res.value is None:
+                skipped += 1
+                print("[%s] Already exported: %s (%s)" % (res.progress,
+                      rinfo['name'], rinfo['id']))
+            else:
+                exported += 1
+                entries += res.value.entries
+                size += res.value.bytes
+                print("[%s] Exported %d entries for: %s (%s)" % (
+                      res.progress, res.value.entries, rinfo['name'],
+                      rinfo['id']))
+        elapsed = max(time.monotonic() - start, 0.001)
+        print()
+        print("Exported %d entries (%s) from %d routers in %.1f seconds;  "
+              "%d entries/s, %s/s" % (entries, humanize.naturalsize(size,
+              gnu=True), exported, elapsed, entries / elapsed,
+              humanize.naturalsize(size / elapsed, gnu=True)))
+        if skipped:
+            print("Skipped %d routers already exported." % skipped)
+        if failed:
+            raise SystemExit("Failed to export %d routers." % failed)
+
+    def poll(self, stream, filters, lines):
+        """ Fetch the new entries of a stream.  The first poll gets only the
+        most recent `lines` entries. """
+        polled = datetime.datetime.now(datetime.timezone.utc)
+        rid = stream.router['id']
+        if stream.newest is None:
+            entries = self.api.get('logs', rid, order_by='-timestamp',
+                                   limit=max(lines, 1), **filters)
+            return polled, list(reversed(entries))
+        query = dict(filters, **stream.query())
+        return polled, list(self.api.get_pager('logs', rid,
+                                               order_by='timestamp', **query))
+
+    def follow(self, args, routers):
+        """ Poll every router on its own schedule and print the merged
+        entries in timestamp order until interrupted. """
+        filters = self.filters(args)
+        match = self.matcher(args)
+        streams = [LogStream(x, self.follow_min_interval,
+                             self.follow_max_interval) for x in routers]
+        merger = LogMerger(streams, self.follow_buffer_size,
+                           self.follow_max_delay)
+        schedule = [(0, i) for i in range(len(streams))]
+        pending = {}
+        poll = self.api.worker(lambda x: self.poll(x, filters, args.lines),
+                               self.follow_max_interval)
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.api.concurrency)
+        try:
+            while True:
+                now = time.monotonic()
+                while schedule and schedule[0][0] <= now:
+                    i = heapq.heappop(schedule)[1]
+                    f = executor.submit(poll, streams[i])
+                    pending[f] = i
+                wakeups = [schedule[0][0]] if schedule else []
+                if merger.deadline() is not None:
+                    wakeups.append(merger.deadline())
+                timeout = max(0, min(wakeups) - now) if wakeups else None
+                done = concurrent.futures.wait(pending, timeout=timeout,
+                    return_when=concurrent.futures.FIRST_COMPLETED)[0]
+                for f in done:
+                    i = pending.pop(f)
+                    stream = streams[i]
+                    # API errors are SystemExit;  Only give up for the
+                    # errors api.fanout would.
+                    error = f.exception()
+                    if isinstance(error, (api.AuthFailure,
+                                          KeyboardInterrupt)):
+                        raise error
+                    if error is not None:
+                        if not stream.failed:
+                            print("Error polling logs for: %s (%s): %s" % (
+                                  stream.router['name'], stream.router['id'],
+                                  error), file=sys.stderr)
+                        stream.failed = True
+                        stream.interval = stream.max_interval
+                    else:
+                        polled, entries = f.result()
+                        first = stream.newest is None
+                        entries = stream.update(entries, polled)
+                        if not first or args.lines:
+                            merger.add(stream, filter(match, entries))
+                    heapq.heappush(schedule, (time.monotonic() +
+                                              stream.interval, i))
+                for rinfo, entry in merger.pop():
+                    self.print_entry(rinfo, entry)
+        except KeyboardInterrupt:
+            for rinfo, entry in merger.pop(flush=True):
+                self.print_entry(rinfo, entry)
+        finally:
+            for f in pending:
+                f.cancel()
+            executor.shutdown(wait=False)
 
 command_classes = [Logs]
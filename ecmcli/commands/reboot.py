@@ -21,13 +21,22 @@ class Reboot(base.ECMCommand):
                        for r in args.idents]
         else:
             routers = self.api.get_pager('routers')
-        for x in routers:
-            if not args.force and \
-               not base.confirm("Reboot %s (%s)" % (x['name'], x['id']),
-                                exit=False):
-                continue
-            print("Rebooting: %s (%s)" % (x['name'], x['id']))
+        if not args.force:
+            routers = [x for x in routers
+                       if base.confirm("Reboot %s (%s)" % (x['name'], x['id']),
+                                       exit=False)]
+
+        def reboot(router):
             self.api.put('remote', '/control/system/reboot', 1, timeout=0,
-                         id=x['id'])
+                         id=router['id'])
+
+        for res in self.api.fanout(reboot, routers):
+            x = res.item
+            if res.error:
+                print("[%s] Reboot failed: %s (%s): %s" % (res.progress,
+                      x['name'], x['id'], res.error))
+            else:
+                print("[%s] Rebooting: %s (%s)" % (res.progress, x['name'],
+                      x['id']))
 
 command_classes = [Reboot]
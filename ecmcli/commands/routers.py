@@ -3,15 +3,18 @@ Manage ECM Routers.
 """
 
 import humanize
-import pickle
-import pkg_resources
+import itertools
 from . import base
+from .. import macdb
 from shellish.layout import Table
 
 
 class Printer(object):
     """ Mixin for printer commands. """
 
+    # Number of rows used to size the terse table columns before streaming.
+    stream_sample = 100
+
     terse_expands = ','.join([
         'account',
         'group'
@@ -112,10 +115,17 @@ class Printer(object):
             ("ip_address", "IP Address"),
             ("state", "Conn")
         )
-        rows = [[x[1] for x in fields]]
-        rows.extend([x[f[0]] for f in fields]
-                    for x in map(self.bundle_router, routers))
-        self.tabulate(rows)
+        table = Table(headers=[x[1] for x in fields],
+                      accessors=[x[0] for x in fields])
+        rows = map(self.bundle_router, routers)
+        sample = list(itertools.islice(rows, self.stream_sample))
+        renderer = table.render(sample)
+        if sample:
+            renderer.flush()
+        else:
+            renderer.print_header()
+        for x in rows:
+            renderer.print([x])
 
     def bundle_router(self, router):
         router['account_name'] = router['account']['name']
@@ -168,10 +178,12 @@ class Search(Printer, base.ECMCommand):
         super().setup_args(parser)
 
     def run(self, args):
-        results = list(self.lookup(args.search, expand=self.expands))
-        if not results:
+        results = iter(self.lookup(args.search, expand=self.expands))
+        try:
+            first = next(results)
+        except StopIteration:
             raise SystemExit("No results for: %s" % ' '.join(args.search))
-        self.printer(results)
+        self.printer(itertools.chain([first], results))
 
 
 class GroupAssign(base.ECMCommand):
@@ -263,13 +275,19 @@ class Delete(base.ECMCommand):
         self.add_argument('-f', '--force', action='store_true')
 
     def run(self, args):
+        routers = []
         for id_or_name in args.ident:
             router = self.api.get_by_id_or_name('routers', id_or_name)
             if not args.force and \
                not base.confirm('Delete router: %s, id:%s' % (router['name'],
                                 router['id']), exit=False):
                 continue
-            self.api.delete('routers', router['id'])
+            routers.append(router)
+        delete = lambda x: self.api.delete('routers', x['id'])
+        for res in self.api.fanout(delete, routers):
+            if res.error:
+                print('Failed to delete router: %s, id:%s: %s' % (
+                      res.item['name'], res.item['id'], res.error))
 
 
 class Clients(base.ECMCommand):
@@ -288,8 +306,7 @@ class Clients(base.ECMCommand):
         try:
             return self._mac_db
         except AttributeError:
-            mac_db = pkg_resources.resource_stream('ecmcli', 'mac.db')
-            self._mac_db = pickle.load(mac_db)
+            self._mac_db = macdb.MacDB()
             return self._mac_db
 
     def mac_lookup_short(self, info):
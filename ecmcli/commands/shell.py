@@ -2,37 +2,205 @@
 Interact with the shell of ECM clients.
 """
 
+import codecs
 import contextlib
 import fcntl
 import os
+import re
 import select
 import shutil
 import sys
 import termios
+import threading
 import time
 import tty
 from . import base
 
 
+class CSTermSession(object):
+    """ A terminal session on a router using the csterm remote API.  Each
+    request sends any pending keystrokes and returns the output the router
+    has buffered since the last one. """
+
+    prompt = re.compile(r'\[[^\[\]\n]*\][$#] ?$')
+    poll_min_interval = 0.050
+    poll_max_interval = 1
+    # Wide enough that command output is not wrapped by the router.
+    size = (250, 50)
+
+    def __init__(self, api, router, sessionid):
+        self.api = api
+        self.router = router
+        self.resource = 'remote/control/csterm/ecmcli-%s/' % sessionid
+
+    def send(self, keys='', size=None):
+        """ Send keystrokes and return any new output.  The terminal size is
+        included when given. """
+        rid = self.router['id']
+        if size is not None:
+            w, h = size
+            out = self.api.put(self.resource, {
+                "w": w,
+                "h": h,
+                "k": keys
+            }, id=rid)[0]
+            data = out['data']['k'] if out['success'] else None
+        else:
+            out = self.api.put('%sk' % self.resource, keys, id=rid)[0]
+            data = out['data'] if out['success'] else None
+        if not out['success']:
+            raise Exception('%s (%s)' % (out['exception'], out['reason']))
+        return data
+
+    def collect(self, keys, size, idle, deadline, clock=time.monotonic,
+                sleep=time.sleep):
+        """ Send keystrokes and gather output until a prompt is printed or
+        no more arrives for `idle` seconds.  Returns the output and whether
+        it ended with a prompt. """
+        buf = []
+        tail = ''
+        data = self.send(keys, size)
+        last = clock()
+        interval = self.poll_min_interval
+        while True:
+            now = clock()
+            if data:
+                buf.append(data)
+                tail = (tail + data)[-256:]
+                if self.prompt.search(tail):
+                    return ''.join(buf), True
+                last = now
+                interval = self.poll_min_interval
+            if now >= deadline:
+                raise TimeoutError(''.join(buf))
+            if now - last >= idle:
+                return ''.join(buf), False
+            sleep(max(0, min(interval, deadline - now, last + idle - now)))
+            interval = min(interval * 2, self.poll_max_interval)
+            data = self.send()
+
+    def execute(self, command, idle, timeout, clock=time.monotonic,
+                sleep=time.sleep):
+        """ Run a command line at the router's prompt and return its output
+        without the echoed command or the closing prompt.  A command still
+        running after `timeout` seconds is interrupted with ^C and its output
+        so far is the argument of the TimeoutError raised. """
+        deadline = clock() + timeout
+        try:
+            self.collect('\n', self.size, idle, deadline, clock, sleep)
+            output, done = self.collect(command + '\n', None, idle, deadline,
+                                        clock, sleep)
+        except TimeoutError as e:
+            self.send('\x03')
+            raise TimeoutError(self.clean(command, e.args[0], False))
+        return self.clean(command, output, done)
+
+    def clean(self, command, output, done):
+        lines = output.replace('\r\n', '\n').split('\n')
+        if lines[0].rstrip().endswith(command.rstrip()):
+            lines.pop(0)  # The echo, possibly after a late prompt.
+        if done:
+            lines.pop()
+        return '\n'.join(lines)
+
+
+class EscapeDetector(object):
+    """ Find the `~~` escape in a stream of keystrokes, even when the two
+    tildes are read separately.  A trailing tilde is held back until the next
+    keystrokes or until `window` seconds pass, so an escape is never sent to
+    the router. """
+
+    def __init__(self, window=0.5, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.held = None
+
+    def feed(self, keys):
+        """ Return the keystrokes to send and whether the escape was typed. """
+        if self.held is not None:
+            keys = '~' + keys
+            self.held = None
+        if '~~' in keys:
+            return keys[:keys.index('~~')], True
+        if keys.endswith('~'):
+            self.held = self.clock()
+            keys = keys[:-1]
+        return keys, False
+
+    def wait_time(self):
+        """ Seconds until a held tilde expires or None if there isn't one. """
+        if self.held is None:
+            return None
+        return max(0, self.held + self.window - self.clock())
+
+    def expire(self):
+        """ Release a held tilde once it is too old to start an escape. """
+        if self.held is not None and not self.wait_time():
+            self.held = None
+            return '~'
+        return ''
+
+
 class Shell(base.ECMCommand):
-    """ Emulate an interactive shell to a remote router. """
+    """ Emulate an interactive shell to a remote router.
+
+    Keystrokes and output are handled by separate threads;  Keystrokes are
+    sent as soon as they are typed while output is polled for, less often
+    the longer the session is idle.  Only one request to the session is in
+    flight at a time so output is written in the order the router produced
+    it.
+
+    With `--command` the command is run on each router instead, up to
+    `--concurrency` at a time, and the output of each is printed or saved
+    to `--output-dir` once its prompt returns. """
 
     name = 'shell'
-    poll_max_retry = 300  # Max secs for polling when no activity is detected.
-    # How long we wait for additional keystrokes after one or more keystrokes
-    # have been detected.
-    key_idle_timeout = 0.150
-    raw_in = sys.stdin.buffer.raw
-    raw_out = sys.stdout.buffer.raw
+    poll_min_interval = 0.050
+    poll_max_interval = 2  # Max secs between polls when the session is idle.
+    input_buffer_size = 65536
+    idle_timeout = 5
+    router_timeout = 60
+    # With unbuffered stdio (python -u) the buffer is already the raw file.
+    raw_in = getattr(sys.stdin.buffer, 'raw', sys.stdin.buffer)
+    raw_out = getattr(sys.stdout.buffer, 'raw', sys.stdout.buffer)
 
     def setup_args(self, parser):
-        self.add_argument('ident', metavar='ROUTER_ID_OR_NAME',
-                          complete=self.routers_complete)
+        self.add_argument('idents', metavar='ROUTER_ID_OR_NAME', nargs='*',
+                          complete=self.make_completer('routers', 'name'))
         self.add_argument('-n', '--new', action='store_true',
                           help='Start a new session')
+        self.add_argument('-a', '--all', action='store_true',
+                          help='Run the command on all online routers.')
+        self.add_argument('-c', '--command', help='Run a command line on '
+                          'each router instead of an interactive session.')
+        self.add_argument('-o', '--output-dir', metavar='DIR',
+                          help='Save the output of each router to '
+                          'DIR/ROUTER_ID.txt instead of printing it.')
+        self.add_argument('--idle', metavar='SECONDS', type=float,
+                          default=self.idle_timeout, help='Consider a '
+                          'command finished when it prints nothing for this '
+                          'long without returning to the prompt.')
+        self.add_argument('--router-timeout', metavar='SECONDS', type=float,
+                          default=self.router_timeout, help='Interrupt the '
+                          'command on routers taking longer than this.')
 
     def run(self, args):
-        router = self.api.get_by_id_or_name('routers', args.ident)
+        if args.command is not None:
+            if args.all:
+                routers = (x for x in self.api.get_pager('routers')
+                           if x['state'] == 'online')
+            elif args.idents:
+                routers = [self.api.get_by_id_or_name('routers', x)
+                           for x in args.idents]
+            else:
+                raise SystemExit("Routers or --all required")
+            self.broadcast(args, routers)
+            return
+        if not args.idents and not args.all:
+            raise SystemExit("Router required")
+        if args.all or len(args.idents) > 1:
+            raise SystemExit("A --command is required for multiple routers")
+        router = self.api.get_by_id_or_name('routers', args.idents[0])
         print("Connecting to: %s (%s)" % (router['name'], router['id']))
         print("Type ~~ rapidly to close session")
         sessionid = int(time.time() * 10000) if args.new else \
@@ -40,13 +208,6 @@ class Shell(base.ECMCommand):
         with self.setup_tty():
             self.session(router, sessionid)
 
-    def routers_complete(self, startswith):
-        filters = {}
-        if startswith:
-            filters['name__startswith'] = startswith
-        routers = self.api.get_pager('routers', fields='name', **filters)
-        return [x['name'] for x in routers]
-
     @contextlib.contextmanager
     def setup_tty(self):
         stdin = sys.stdin.fileno()
@@ -64,58 +225,176 @@ class Shell(base.ECMCommand):
         finally:
             termios.tcsetattr(stdin, termios.TCSADRAIN, ttysave)
 
-    def buffered_read(self, idle_timeout=key_idle_timeout, max_timeout=None):
-        buf = []
-        timeout = max_timeout
+    def buffered_read(self, interrupt_fd=None):
+        """ Wait for input and return all of it that is available without
+        waiting any longer.  Returns nothing if `interrupt_fd` becomes
+        readable first and raises EOFError when stdin is closed. """
+        fds = [self.raw_in.fileno()]
+        if interrupt_fd is not None:
+            fds.append(interrupt_fd)
         while True:
-            if select.select([self.raw_in.fileno()], [], [], timeout)[0]:
-                buf.append(self.raw_in.read())
-                timeout = self.key_idle_timeout
+            ready = select.select(fds, [], [], self.escape.wait_time())[0]
+            if interrupt_fd in ready:
+                return ''
+            if not ready:
+                keys = self.escape.expire()
             else:
+                size = self.fill_input()
+                if not size:
+                    raise EOFError()
+                keys, escaped = self.escape.feed(self.decoder.decode(
+                                                 self.input_view[:size]))
+                if escaped:
+                    sys.exit('Session Closed')
+            if keys:
+                return keys
+
+    def fill_input(self):
+        """ Read into the input buffer until it is full or nothing more is
+        available.  Returns the number of bytes read. """
+        size = 0
+        while size < len(self.input_view):
+            count = self.raw_in.readinto(self.input_view[size:])
+            if not count:  # None when it would block, 0 at EOF.
                 break
-        sbuf = b''.join(buf).decode()
-        if '~~' in sbuf:
-            sys.exit('Session Closed')
-        return sbuf
+            size += count
+        return size
 
     def full_write(self, dstfile, srcdata):
         """ Write into dstfile until it's done, accounting for short write()
-        calls. """
+        calls.  The file is only waited on when a write would block. """
         srcview = memoryview(srcdata)
-        size = len(srcview)
-        written = 0
-        while written < size:
-            select.select([], [dstfile.fileno()], [])  # block until writable
-            written += dstfile.write(srcview[written:])
+        while srcview:
+            written = dstfile.write(srcview)
+            if written is None:
+                select.select([], [dstfile.fileno()], [])
+            else:
+                srcview = srcview[written:]
+
+    def exchange(self, term, keys='', size=None):
+        """ Make a request and write its output.  The router hands out its
+        buffered output in the order it handles requests, which is only the
+        order they were made if they don't overlap;  Requests from the two
+        pipelines are made one at a time. """
+        with self.request_lock:
+            data = term.send(keys, size)
+            if data:
+                self.full_write(self.raw_out, data.encode())
+        return data
+
+    def input_pipeline(self, term):
+        """ Send keystrokes as soon as they are read.  Keys typed while a
+        request is in flight go together in the next one. """
+        while not self.closed.is_set():
+            try:
+                keys = self.buffered_read(self.interrupt[0])
+            except EOFError:
+                break
+            if keys:
+                self.exchange(term, keys)
+                self.wakeup.set()  # Output may follow soon.
+
+    def output_pipeline(self, term):
+        """ Poll for output, backing off exponentially while there is none.
+        Typing restarts the wait at the shortest interval;  The echo comes
+        back with the keystrokes so polling right away would only hold up
+        the next ones. """
+        keys = '\n'
+        size = None
+        interval = self.poll_min_interval
+        while not self.closed.is_set():
+            new_size = shutil.get_terminal_size()
+            data = self.exchange(term, keys, new_size
+                                 if new_size != size else None)
+            keys = ''
+            size = new_size
+            if data:
+                interval = self.poll_min_interval
+            else:
+                interval = min(interval * 2, self.poll_max_interval)
+            while self.wakeup.wait(interval) and not self.closed.is_set():
+                self.wakeup.clear()
+                interval = self.poll_min_interval
+
+    def pipeline(self, fn, *args):
+        try:
+            fn(*args)
+        except BaseException as e:
+            if not self.closed.is_set():
+                self.error = e
+        finally:
+            self.close()
+
+    def close(self):
+        """ Stop both pipelines without waiting for their next cycle. """
+        if not self.closed.is_set():
+            self.closed.set()
+            self.wakeup.set()
+            os.write(self.interrupt[1], b'\0')
 
     def session(self, router, sessionid):
-        rid = router['id']
-        w_save, h_save = None, None
-        res = 'remote/control/csterm/ecmcli-%s/' % sessionid
-        in_data = '\n'
-        poll_timeout = self.key_idle_timeout  # somewhat arbitrary
-        while True:
-            w, h = shutil.get_terminal_size()
-            if (w, h) != (w_save, h_save):
-                out = self.api.put(res, {
-                    "w": w,
-                    "h": h,
-                    "k": in_data
-                }, id=rid)[0]
-                w_save, h_save = w, h
-                data = out['data']['k'] if out['success'] else None
+        term = CSTermSession(self.api, router, sessionid)
+        self.request_lock = threading.Lock()
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.escape = EscapeDetector()
+        self.input_view = memoryview(bytearray(self.input_buffer_size))
+        self.closed = threading.Event()
+        self.wakeup = threading.Event()
+        self.interrupt = os.pipe()
+        self.error = None
+        threads = [threading.Thread(target=self.pipeline, args=(fn, term),
+                                    daemon=True)
+                   for fn in (self.input_pipeline, self.output_pipeline)]
+        try:
+            for t in threads:
+                t.start()
+            self.closed.wait()
+        finally:
+            self.close()
+            for t in threads:
+                t.join()
+            for fd in self.interrupt:
+                os.close(fd)
+        if self.error is not None:
+            raise self.error
+
+    def broadcast(self, args, routers):
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        sessionid = int(time.time() * 10000)
+
+        def execute(router):
+            term = CSTermSession(self.api, router, sessionid)
+            return term.execute(args.command, args.idle, args.router_timeout)
+
+        failed = 0
+        for res in self.api.fanout(execute, routers):
+            x = res.item
+            ident = '%s (%s)' % (x['name'], x['id'])
+            if isinstance(res.error, TimeoutError):
+                print("[%s] %s: Timeout after %g seconds" % (res.progress,
+                      ident, args.router_timeout), file=sys.stderr)
+                output = res.error.args[0]
+                failed += 1
+                if not output:
+                    continue
+            elif res.error:
+                print("[%s] %s: %s" % (res.progress, ident, res.error),
+                      file=sys.stderr)
+                failed += 1
+                continue
             else:
-                out = self.api.put('%sk' % res, in_data, id=rid)[0]
-                data = out['data'] if out['success'] else None
-            if out['success']:
-                if data:
-                    self.full_write(self.raw_out, data.encode())
-                    poll_timeout = 0  # Quickly look for more data
-                else:
-                    poll_timeout += 0.050
+                output = res.value
+            if args.output_dir:
+                filename = os.path.join(args.output_dir, '%s.txt' % x['id'])
+                with open(filename, 'w') as f:
+                    print(output, file=f)
+                if not res.error:
+                    print("[%s] %s: %s" % (res.progress, ident, filename))
             else:
-                raise Exception('%s (%s)' % (out['exception'], out['reason']))
-            poll_timeout = min(self.poll_max_retry, poll_timeout)
-            in_data = self.buffered_read(max_timeout=poll_timeout)
+                print("[%s] %s:" % (res.progress, ident))
+                print(output)
+        if failed:
+            raise SystemExit("Command failed on %d router(s)" % failed)
 
 command_classes = [Shell]
@@ -1,49 +1,179 @@
 """
-Collect two samples of wan usage to calculate the bit/sec rate.
+Sample the cumulative WAN byte counters of routers to calculate bit/sec rates.
 """
 
+import argparse
 import humanize
+import math
+import shutil
 import time
 from . import base
+from .. import wanlog
+
+
+def fixed_rate(interval, clock=time.monotonic, sleep=time.sleep):
+    """ Generate the scheduled time of each sample, sleeping until it is due.
+    The schedule is anchored to the first tick so API latency does not make
+    the interval drift;  Ticks missed by a slow poll are skipped rather than
+    fired back to back. """
+    start = clock()
+    tick = 0
+    while True:
+        due = start + tick * interval
+        delay = due - clock()
+        if delay > 0:
+            sleep(delay)
+        yield due
+        now = clock()
+        tick = max(tick + 1, math.ceil((now - start) / interval))
+
+
+def format_bps(bps):
+    if bps > 1024:
+        value = humanize.naturalsize(bps, gnu=True, format='%.1f ')
+    else:
+        value = '%d ' % bps
+    return (value + 'bps').lower()
 
 
 class WanRate(base.ECMCommand):
-    """ Show the current WAN bitrate of connected routers. """
+    """ Show the current WAN bitrate of connected routers.
+
+    The rate is calculated from the change in each router's WAN byte counters
+    between samples so its resolution matches the sample time.  Routers are
+    split into groups that are polled in parallel.  With `--record` the
+    counters are also appended to a file that `--report` summarizes later.
+    Report percentiles are estimates with about 2% relative error. """
 
     name = 'wanrate'
     sample_delay = 1
+    percentiles = [50, 95, 99]
+    # Narrowest router column before switching to a row per router.
+    min_column_width = 12
+    # Cell value for routers whose poll failed, E.g. timed out.
+    error_marker = 'ERR'
 
     def setup_args(self, parser):
-        self.add_argument('idents', metavar='ROUTER_ID_OR_NAME', nargs='+',
+        self.add_argument('idents', metavar='ROUTER_ID_OR_NAME', nargs='*',
                           complete=self.make_completer('routers', 'name'))
         self.add_argument('-s', '--sampletime',
                           help='How long to wait between sample captures '
-                          'in seconds', type=float,
+                          'in seconds', type=self.seconds,
                           default=self.sample_delay)
+        self.add_argument('--pollers', type=int, help='Number of parallel '
+                          'pollers;  By default there is one for every '
+                          '--remote-batch-size routers.')
+        self.add_argument('--record', metavar='FILE',
+                          help='Append samples to a WAN recording.')
+        self.add_argument('--report', metavar='FILE', help='Summarize a '
+                          'recording made with --record instead.')
+
+    def seconds(self, value):
+        try:
+            value = float(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid number: %s' % value)
+        if not value > 0:
+            raise argparse.ArgumentTypeError('must be greater than 0')
+        return value
+
+    def poller_groups(self, ids, pollers=None):
+        """ Split router ids into a list of comma separated groups. """
+        if pollers is None:
+            pollers = math.ceil(len(ids) / self.api.remote_batch_size)
+        pollers = max(1, min(pollers, len(ids)))
+        size = math.ceil(len(ids) / pollers)
+        return [','.join(ids[i:i + size]) for i in range(0, len(ids), size)]
+
+    def poll(self, ids):
+        """ Fetch WAN stats for a group of routers.  The sample time is the
+        middle of the request so latency is split evenly. """
+        start = time.monotonic()
+        size = ids.count(',') + 1
+        data = list(self.api.get_pager('remote', '/status/wan/stats',
+                                       id__in=ids, page_size=size))
+        return (start + time.monotonic()) / 2, data
 
     def run(self, args):
-        routers = [self.api.get_by_id_or_name('routers', x)
-                   for x in args.idents]
+        if args.report:
+            return self.report(args.report)
+        recorder = None
+        if args.record:
+            try:
+                recorder = wanlog.Writer(args.record)
+            except (OSError, ValueError) as e:
+                raise SystemExit(e)
+        try:
+            if args.idents:
+                routers = [self.api.get_by_id_or_name('routers', x)
+                           for x in args.idents]
+            else:
+                routers = [x for x in self.api.get_pager('routers')
+                           if x['state'] == 'online']
+                if not routers:
+                    raise SystemExit("No online routers found")
+            self.monitor(args, routers, recorder)
+        finally:
+            if recorder is not None:
+                recorder.close()
+
+    def monitor(self, args, routers, recorder):
         routers_by_id = dict((x['id'], x) for x in routers)
-        headers = ['%s (%s)' % (x['name'], x['id']) for x in routers]
+        counters = dict((x, wanlog.CounterRate()) for x in routers_by_id)
+        groups = self.poller_groups(list(routers_by_id), args.pollers)
+        width = shutil.get_terminal_size()[0]
+        wide = len(routers) * self.min_column_width > width
+        if wide:
+            headers = ['Router', 'Rate']
+        else:
+            headers = ['%s (%s)' % (x['name'], x['id']) for x in routers]
         table = self.tabulate([headers], flex=False)
-        while True:
-            start = time.time()
-            # XXX: We should calculate our own bps instead of using 'bps' to
-            # ensure the resolution of our rate correlates with our sampletime.
-            data = self.api.get('remote', '/status/wan/stats/bps',
-                                id__in=','.join(routers_by_id))
-            time.sleep(max(0, args.sampletime - (time.time() - start)))
-            for x in data:
-                if x['success']:
-                    if x['data'] > 1024:
-                        value = humanize.naturalsize(x['data'], gnu=True, format='%.1f ') + 'bps'
-                    else:
-                        value = x['data'] + ' bps'
-                    value = value.lower()
-                else:
-                    value = '[%s]' % x['reason']
-                routers_by_id[str(x['id'])]['bps'] = value
-            table.print_row([x['bps'] for x in routers])
+        wall_offset = time.time() - time.monotonic()
+        for _ in fixed_rate(args.sampletime):
+            for res in self.api.fanout(self.poll, groups):
+                if res.error:
+                    for x in res.item.split(','):
+                        routers_by_id[x]['bps'] = self.error_marker
+                    continue
+                timestamp, data = res.value
+                samples = []
+                for x in data:
+                    router = routers_by_id[str(x['id'])]
+                    if not x['success']:
+                        router['bps'] = '[%s]' % x['reason']
+                        counters[router['id']].last = None
+                        continue
+                    rx, tx = x['data']['in'], x['data']['out']
+                    samples.append((int(router['id']), rx, tx))
+                    rate = counters[router['id']].update(timestamp, rx, tx)
+                    router['bps'] = '...' if rate is None else \
+                        format_bps(sum(rate))
+                if recorder is not None:
+                    recorder.write(timestamp + wall_offset, samples)
+            if wide:
+                for x in routers:
+                    table.print_row(['%s (%s)' % (x['name'], x['id']),
+                                     x['bps']])
+            else:
+                table.print_row([x['bps'] for x in routers])
+
+    def report(self, filename):
+        """ Summarize a recording, reading it as a stream so it can be larger
+        than memory. """
+        try:
+            summaries = wanlog.summarize(wanlog.read(filename))
+        except (OSError, ValueError) as e:
+            raise SystemExit(e)
+        fmt = lambda x: '' if x is None else format_bps(x)
+        headers = ['Router', 'Direction', 'Samples', 'Min', 'Avg', 'Max']
+        headers.extend('P%d' % x for x in self.percentiles)
+        rows = []
+        for router, pair in sorted(summaries.items()):
+            for direction, x in zip(('rx', 'tx'), pair):
+                row = [router, direction, x.count, fmt(x.min), fmt(x.avg),
+                       fmt(x.max)]
+                row.extend(fmt(x.percentile(p)) for p in self.percentiles)
+                rows.append(row)
+        self.tabulate([headers] + rows)
 
 command_classes = [WanRate]
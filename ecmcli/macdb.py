@@ -0,0 +1,116 @@
+"""
+MAC address vendor (OUI) database.
+
+The database file is a header, a table of fixed-width records sorted by OUI
+and a heap of vendor name strings.  It is memory-mapped and searched in
+place so there is no load time beyond opening the file.  Regenerate it from
+the IEEE registry CSV (http://standards-oui.ieee.org/oui/oui.csv) with:
+
+    python -m ecmcli.macdb oui.csv [ecmcli/mac.db]
+"""
+
+import csv
+import mmap
+import os
+import re
+import struct
+import sys
+
+default_path = os.path.join(os.path.dirname(__file__), 'mac.db')
+magic = b'ECMMAC1\0'
+header = struct.Struct('>8sI')  # magic, record count
+record = struct.Struct('>III')  # oui, short name offset, long name offset
+
+
+class MacDB(object):
+    """ Read-only OUI lookups by binary search of the mmapped table. """
+
+    def __init__(self, filename=default_path):
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, self.count = header.unpack_from(self.map)
+        if file_magic != magic:
+            raise ValueError('Invalid MAC database: %s' % filename)
+        self.heap = header.size + self.count * record.size
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, oui):
+        return self.find(oui) is not None
+
+    def find(self, oui):
+        """ Return the record for an OUI or None. """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            rec = record.unpack_from(self.map, header.size + mid *
+                                     record.size)
+            if rec[0] < oui:
+                lo = mid + 1
+            elif rec[0] > oui:
+                hi = mid
+            else:
+                return rec
+        return None
+
+    def string(self, offset):
+        offset += self.heap
+        size = self.map[offset]
+        return self.map[offset + 1:offset + 1 + size].decode()
+
+    def get(self, oui, default=None):
+        """ Return the (short, long) vendor names for an OUI. """
+        rec = self.find(oui)
+        if rec is None:
+            return default
+        return self.string(rec[1]), self.string(rec[2])
+
+
+def write(entries, filename):
+    """ Write a database from an iterable of (oui, short, long) tuples. """
+    entries = sorted(dict((x[0], x[1:]) for x in entries).items())
+    heap = bytearray()
+    offsets = {}
+
+    def intern(value):
+        if value not in offsets:
+            data = value.encode()[:255].decode(errors='ignore').encode()
+            offsets[value] = len(heap)
+            heap.append(len(data))
+            heap.extend(data)
+        return offsets[value]
+
+    with open(filename, 'wb') as f:
+        f.write(header.pack(magic, len(entries)))
+        for oui, (short, long) in entries:
+            f.write(record.pack(oui, intern(short), intern(long)))
+        f.write(heap)
+
+
+def short_name(name):
+    """ Abbreviate a vendor name in the style of Wireshark's manuf file,
+    E.g. "XEROX CORPORATION" -> "XeroxCor". """
+    words = re.sub(r'[^\w\s]', '', name).split()
+    return ''.join(x.capitalize() for x in words)[:8]
+
+
+def read_ieee_csv(filename):
+    """ Generate (oui, short, long) tuples from an IEEE OUI registry CSV. """
+    with open(filename, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            name = row['Organization Name'].strip()
+            yield int(row['Assignment'], 16), short_name(name), name
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if not args or len(args) > 2:
+        raise SystemExit('Usage: python -m ecmcli.macdb OUI_CSV [OUTPUT]')
+    output = args[1] if len(args) > 1 else default_path
+    write(read_ieee_csv(args[0]), output)
+    print('Wrote %d entries to %s' % (len(MacDB(output)), output))
+
+
+if __name__ == '__main__':
+    main()
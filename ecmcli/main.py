@@ -3,12 +3,12 @@ Bootstrap the shell and commands and then run either one.
 """
 
 import importlib
-import pkg_resources
 import shellish
 import sys
-from . import api
+from . import __version__, api, stats
 from .commands import base
 
+# Each command module provides the command of the same name.
 command_modules = [
     'accounts',
     'alerts',
@@ -37,29 +37,72 @@ class ECMRoot(base.ECMCommand):
     name = 'ecm'
 
     def setup_args(self, parser):
-        distro = pkg_resources.get_distribution('ecmcli')
         self.add_argument('--api_username')
         self.add_argument('--api_password')
         self.add_argument('--api_site',
                           help='E.g. https://cradlepointecm.com')
+        self.add_argument('--concurrency', metavar='N', type=int,
+                          default=api.ECMService.concurrency,
+                          help='Maximum number of concurrent router requests')
+        self.add_argument('--timeout', metavar='SECONDS', type=float,
+                          help='Timeout for each concurrent router request')
+        self.add_argument('--remote-batch-size', metavar='N', type=int,
+                          default=api.ECMService.remote_batch_size,
+                          help='Maximum routers per remote API request')
+        self.add_argument('--no-cache', action='store_true',
+                          help='Do not use the local API response cache')
+        self.add_argument('--refresh', action='store_true',
+                          help='Revalidate all cached API responses')
+        self.add_argument('--profile', action='store_true',
+                          help='Print API request stats on exit')
         self.add_argument('--version', action='version',
-                          version=distro.version)
+                          version=__version__)
 
     def run(self, args):
         self.interact()
 
 
+def selected_modules(root, argv):
+    """ Return the command modules needed to handle argv.  Only the module
+    for the selected command is needed to run it or complete its arguments;
+    Everything else (the interactive shell, help, command name completion)
+    needs all of them. """
+    argv = [x for x in argv if x not in ('-h', '--help')]
+    extras = root.argparser.parse_known_args(argv)[1]
+    words = [x for x in extras if not x.startswith('-')]
+    if words and words[0] == shellish.SystemCompletionSetup.name:
+        words = words[2:]  # Skip "completion" and the seed's PROG word.
+        if len(words) < 2:
+            return command_modules  # Completing the command name itself.
+    if words and words[0] in command_modules:
+        return [words[0]]
+    return command_modules
+
+
 def main():
     root = ECMRoot(api=api.ECMService())
-    root.add_subcommand(shellish.SystemCompletionSetup)
-    for modname in command_modules:
+    for modname in selected_modules(root, sys.argv[1:]):
         module = importlib.import_module('.%s' % modname, 'ecmcli.commands')
         for Command in module.command_classes:
             root.add_subcommand(Command)
+    root.add_subcommand(shellish.SystemCompletionSetup)
     args = root.argparser.parse_args()
+    root.api.concurrency = max(1, args.concurrency)
+    root.api.fanout_timeout = args.timeout
+    root.api.remote_batch_size = max(1, args.remote_batch_size)
+    root.api.setup_pool()
+    root.api.setup_cache(enabled=not args.no_cache, refresh=args.refresh)
+    if args.profile:
+        profile = stats.RequestStats(root.api)
+        profile.attach()
+    # Connecting is deferred until the first API call.
+    root.api.connect(args.api_site, username=args.api_username,
+                     password=args.api_password)
     try:
-        root.api.connect(args.api_site, username=args.api_username,
-                         password=args.api_password)
         root(args)
     except KeyboardInterrupt:
         sys.exit(1)
+    finally:
+        if args.profile:
+            print()
+            profile.report(root.tabulate)
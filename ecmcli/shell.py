@@ -4,8 +4,8 @@ Interactive shell for ECM.
 
 import code
 import shellish
-import time
-from . import api
+import threading
+from . import api, stats
 
 
 class ECMShell(shellish.Shell):
@@ -29,6 +29,22 @@ class ECMShell(shellish.Shell):
         super().__init__(root_command)
         self.api = root_command.api
         self.cwd = [self.api.ident['account']]
+        self.session_stats = stats.RequestStats(self.api)
+        self.command_stats = stats.RequestStats(self.api)
+        self.session_stats.attach()
+        self.command_stats.attach()
+
+    def precmd(self, line):
+        """ Track request stats for each command separately so the stats
+        command can report on the command that was just run. """
+        if line.split(' ', 1)[0] != 'stats':
+            self.command_stats.reset()
+        return super().precmd(line)
+
+    def postcmd(self, stop, line):
+        if line.split(' ', 1)[0] != 'stats':
+            self.command_wall_time = self.command_stats.elapsed()
+        return super().postcmd(stop, line)
 
     def do_ls(self, arg):
         if arg:
@@ -60,13 +76,27 @@ class ECMShell(shellish.Shell):
         self.api.add_listener('start_request', self.on_request_start)
         self.api.add_listener('finish_request', self.on_request_finish)
 
-    def on_request_start(self, args=None, kwargs=None):
-        self.last_request_start = time.perf_counter()
-        print('START REQUEST', args, kwargs)
+    def do_stats(self, arg):
+        """ Show API request stats for the last command.  Use "stats all" to
+        see the stats for the entire session. """
+        if arg.strip() == 'all':
+            self.session_stats.report(self.tabulate)
+        else:
+            self.command_stats.report(self.tabulate,
+                                      getattr(self, 'command_wall_time', 0))
+
+    def on_request_start(self, args=None, kwargs=None, request=None):
+        print('START REQUEST [%s]' % threading.current_thread().name, args,
+              kwargs)
 
-    def on_request_finish(self, result=None):
-        time_taken = time.perf_counter() - self.last_request_start
-        print('FINISHED REQUEST (%g seconds):' % time_taken, result)
+    def on_request_finish(self, result=None, request=None):
+        if request.get('error'):
+            print('FAILED REQUEST [%s] (%g seconds)' % (
+                  threading.current_thread().name, request['elapsed']))
+            return
+        print('FINISHED REQUEST [%s] (%g seconds, %d bytes, %d on wire):' % (
+              threading.current_thread().name, request['elapsed'],
+              request['bytes'], request['wire_bytes']), result)
 
     def do_cd(self, arg):
         cwd = self.cwd[:]
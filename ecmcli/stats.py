@@ -0,0 +1,171 @@
+"""
+Request timing and profiling built on the API request events.
+"""
+
+import collections
+import humanize
+import math
+import threading
+import time
+
+
+class Histogram(object):
+    """ Log scaled histogram of positive values.  Memory use is bounded by
+    the number of buckets instead of the number of samples;  Percentiles are
+    accurate to within the bucket precision (2% by default). """
+
+    def __init__(self, precision=0.02):
+        self.scale = math.log(1 + precision)
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value > 0:
+            self.buckets[math.floor(math.log(value) / self.scale)] += 1
+        else:
+            self.buckets[None] += 1
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        for x in (other.min, other.max):
+            if x is not None:
+                self.min = x if self.min is None else min(self.min, x)
+                self.max = x if self.max is None else max(self.max, x)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, pct):
+        """ Return the approximate value at percentile `pct` (0-100). """
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        if rank >= self.count:
+            return self.max
+        seen = self.buckets[None]
+        if seen >= rank:
+            return min(0, self.min)
+        for bucket in sorted(x for x in self.buckets if x is not None):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                value = math.exp((bucket + 0.5) * self.scale)
+                return max(self.min, min(self.max, value))
+        return self.max
+
+
+class ResourceStats(object):
+    """ Aggregate metrics for all the requests made to one resource. """
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.pages = 0
+        self.cached = 0
+        self.errors = 0
+
+    @property
+    def requests(self):
+        return self.latency.count
+
+    def add(self, request):
+        self.latency.add(request['elapsed'])
+        self.bytes += request['bytes']
+        self.wire_bytes += request['wire_bytes']
+        self.pages += request['paged']
+        self.cached += request['cached']
+        self.errors += request.get('error', False)
+
+
+class RequestStats(object):
+    """ Record every finished API request by resource.  Call attach() to
+    start listening to an ECMService instance. """
+
+    def __init__(self, api):
+        self.api = api
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.resources = collections.defaultdict(ResourceStats)
+            self.started = time.perf_counter()
+            self.active = 0
+            self.active_since = None
+            self.busy_time = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def attach(self):
+        self.api.add_listener('start_request', self.on_request_start)
+        self.api.add_listener('finish_request', self.on_request_finish)
+
+    def detach(self):
+        self.api.remove_listener('start_request', self.on_request_start)
+        self.api.remove_listener('finish_request', self.on_request_finish)
+
+    def on_request_start(self, args=None, kwargs=None, request=None):
+        with self.lock:
+            if not self.active:
+                self.active_since = request['start']
+            self.active += 1
+
+    def on_request_finish(self, result=None, request=None):
+        with self.lock:
+            self.resources[request['resource']].add(request)
+            self.active = max(0, self.active - 1)
+            if not self.active and self.active_since is not None:
+                self.busy_time += time.perf_counter() - self.active_since
+                self.active_since = None
+
+    def report(self, tabulate, wall_time=None):
+        """ Print per resource latency percentiles and a breakdown of the
+        wall time using the provided tabulate function. """
+        if wall_time is None:
+            wall_time = self.elapsed()
+        with self.lock:
+            resources = sorted(self.resources.items(),
+                               key=lambda x: -x[1].latency.total)
+            busy_time = self.busy_time
+            if self.active_since is not None:
+                busy_time += time.perf_counter() - self.active_since
+        api_time = sum(x.latency.total for _, x in resources)
+        ms = lambda x: '%.0f' % (x * 1000) if x is not None else ''
+        size = lambda x: humanize.naturalsize(x, gnu=True)
+        rows = [('Resource', 'Requests', 'Pages', 'Cached', 'Bytes', 'Wire',
+                 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Total (s)', 'Share')]
+        for name, x in resources:
+            share = x.latency.total / api_time if api_time else 0
+            rows.append((
+                name,
+                x.requests,
+                x.pages,
+                x.cached,
+                size(x.bytes),
+                size(x.wire_bytes),
+                ms(x.latency.percentile(50)),
+                ms(x.latency.percentile(95)),
+                ms(x.latency.percentile(99)),
+                '%.3f' % x.latency.total,
+                '%.0f%%' % (share * 100)
+            ))
+        tabulate(rows)
+        print('Wall time: %.3fs, Waiting on API: %.3fs, Local: %.3fs, '
+              'Total request time: %.3fs' % (wall_time, busy_time,
+              max(0, wall_time - busy_time), api_time))
+        errors = sum(x.errors for _, x in resources)
+        if errors:
+            print('Failed requests: %d' % errors)
@@ -0,0 +1,165 @@
+"""
+WAN usage recordings.
+
+A recording is a magic header followed by blocks of samples.  Each block is
+one poll of a group of routers;  The wall clock time of the poll and the
+number of samples, then a fixed-width record of router id and the cumulative
+received and transmitted byte counters for each router.  Files are only
+ever appended to and are read back as a stream, so recordings can grow
+without bound.
+"""
+
+import struct
+import time
+from . import stats
+
+magic = b'ECMWAN1\0'
+block = struct.Struct('>dI')  # timestamp, sample count
+sample = struct.Struct('>IQQ')  # router id, rx bytes, tx bytes
+
+
+class Writer(object):
+    """ Append samples to a recording.  Writes are buffered up to
+    `buffer_size` bytes or `flush_interval` seconds, whichever comes first,
+    so a long recording uses constant memory and an interrupted one loses
+    little. """
+
+    buffer_size = 65536
+    flush_interval = 5
+
+    def __init__(self, filename, clock=time.monotonic):
+        self.clock = clock
+        self.buffer = bytearray()
+        self.last_flush = clock()
+        self.file = open(filename, 'ab')
+        if self.file.tell():
+            with open(filename, 'rb') as f:
+                if f.read(len(magic)) != magic:
+                    self.file.close()
+                    raise ValueError('Invalid WAN recording: %s' % filename)
+        else:
+            self.file.write(magic)
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, timestamp, samples):
+        """ Add a block for the (router_id, rx, tx) `samples` taken at the
+        wall clock `timestamp`. """
+        samples = list(samples)
+        if not samples:
+            return
+        self.buffer.extend(block.pack(timestamp, len(samples)))
+        for x in samples:
+            self.buffer.extend(sample.pack(*x))
+        if len(self.buffer) >= self.buffer_size or \
+           self.clock() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+        self.last_flush = self.clock()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def read(filename):
+    """ Generate (timestamp, router_id, rx, tx) tuples from a recording.
+    A partially written block at the end of the file is ignored. """
+    with open(filename, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError('Invalid WAN recording: %s' % filename)
+        while True:
+            head = f.read(block.size)
+            if len(head) < block.size:
+                break
+            timestamp, count = block.unpack(head)
+            data = f.read(count * sample.size)
+            if len(data) < count * sample.size:
+                break
+            for x in sample.iter_unpack(data):
+                yield (timestamp,) + x
+
+
+class CounterRate(object):
+    """ Rate of change of a router's cumulative WAN byte counters. """
+
+    def __init__(self):
+        self.last = None
+
+    def update(self, timestamp, rx, tx):
+        """ Add a sample and return the (rx, tx) bits/sec since the previous
+        sample or None if there is no usable previous sample. """
+        last = self.last
+        self.last = timestamp, rx, tx
+        if last is None:
+            return None
+        elapsed = timestamp - last[0]
+        rx_bytes = rx - last[1]
+        tx_bytes = tx - last[2]
+        if elapsed <= 0 or rx_bytes < 0 or tx_bytes < 0:
+            # Counters reset, E.g. a reboot or WAN failover.
+            return None
+        return rx_bytes * 8 / elapsed, tx_bytes * 8 / elapsed
+
+
+class RateSummary(object):
+    """ Streaming statistics for a series of bit rates.  The average is
+    weighted by time and percentiles are estimated from a stats.Histogram,
+    so memory use does not depend on the number of samples. """
+
+    def __init__(self):
+        self.histogram = stats.Histogram()
+        self.bits = 0
+        self.elapsed = 0
+
+    def add(self, bps, elapsed):
+        self.histogram.add(bps)
+        self.bits += bps * elapsed
+        self.elapsed += elapsed
+
+    @property
+    def count(self):
+        return self.histogram.count
+
+    @property
+    def min(self):
+        return self.histogram.min
+
+    @property
+    def max(self):
+        return self.histogram.max
+
+    @property
+    def avg(self):
+        return self.bits / self.elapsed if self.elapsed else None
+
+    def percentile(self, pct):
+        return self.histogram.percentile(pct)
+
+
+def summarize(samples):
+    """ Return {router_id: (rx, tx)} RateSummary pairs for a stream of
+    samples such as those produced by `read`. """
+    rates = {}
+    summaries = {}
+    for timestamp, router, rx, tx in samples:
+        if router not in rates:
+            rates[router] = CounterRate()
+            summaries[router] = RateSummary(), RateSummary()
+        last = rates[router].last
+        rate = rates[router].update(timestamp, rx, tx)
+        if rate is not None:
+            elapsed = timestamp - last[0]
+            for summary, bps in zip(summaries[router], rate):
+                summary.add(bps, elapsed)
+    return summaries
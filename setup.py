@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 
+import re
 from setuptools import setup, find_packages
 
 README = 'README.md'
+VERSION_FILE = 'ecmcli/__init__.py'
 
 
 def long_desc():
@@ -14,9 +16,14 @@ def long_desc():
     else:
         return pypandoc.convert(README, 'rst')
 
+
+def version():
+    with open(VERSION_FILE) as f:
+        return re.search(r"__version__ = '(.*)'", f.read()).group(1)
+
 setup(
     name='ecmcli',
-    version='2.4.0',
+    version=version(),
     description='Command Line Interface for Cradlepoint ECM',
     author='Justin Mayfield',
     author_email='tooker@gmail.com',
@@ -28,7 +35,8 @@ setup(
     install_requires=[
         'syndicate==1.2.0',
         'shellish>=0.8.0',
-        'humanize'
+        'humanize',
+        'python-dateutil'
     ],
     entry_points = {
         'console_scripts': ['ecm=ecmcli.main:main'],
@@ -0,0 +1,187 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import urllib.parse
+from ecmcli import api, aioapi
+from tornado import httpclient, httputil
+
+
+class FakeClient(object):
+    """ Stand-in for tornado's AsyncHTTPClient that answers with a handler
+    function and tracks how many requests are in flight. """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+
+    async def fetch(self, request, raise_error=True):
+        self.requests.append(request)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.001)
+            url = urllib.parse.urlsplit(request.url)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            code, body, headers = self.handler(url.path, query)
+        finally:
+            self.active -= 1
+        return httpclient.HTTPResponse(request, code,
+            headers=httputil.HTTPHeaders(headers or {}),
+            buffer=io.BytesIO(json.dumps(body).encode()))
+
+
+def page(data, **meta):
+    return {"success": True, "data": data, "meta": meta or None}
+
+
+class AsyncService(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.api = api.ECMService()
+        self.api.session_file = os.path.join(tmp, 'session')
+        self.api.uri = 'http://ecm'
+        self.api.account = None
+        self.api.session_id = 'one'
+        self.api.auth_sig = None
+        self.aio = aioapi.AsyncECMService(self.api)
+
+    def serve(self, handler):
+        self.aio.client = FakeClient(handler)
+        return self.aio.client
+
+    def test_pager_prefetch_order(self):
+        items = list(range(95))
+
+        def handler(path, query):
+            limit, offset = int(query['limit']), int(query.get('offset', 0))
+            nxt = offset + limit < len(items) and '/next' or None
+            return 200, page(items[offset:offset + limit], limit=limit,
+                             offset=offset, total_count=len(items),
+                             next=nxt), None
+
+        client = self.serve(handler)
+
+        async def collect():
+            return [x async for x in self.aio.get_pager('routers',
+                                                         page_size=10)]
+
+        self.assertEqual(aioapi.run(collect()), items)
+        self.assertEqual(len(client.requests), 10)
+        self.assertLessEqual(client.peak, self.api.prefetch)
+
+    def test_pager_follows_next(self):
+
+        def handler(path, query):
+            if path.endswith('/second/'):
+                return 200, page([3, 4], next=None), None
+            return 200, page([1, 2], next='/api/v1/second/'), None
+
+        self.serve(handler)
+
+        async def collect():
+            return [x async for x in self.aio.get_pager('routers')]
+
+        self.assertEqual(aioapi.run(collect()), [1, 2, 3, 4])
+
+    def test_concurrency_bound(self):
+        self.aio.concurrency = 5
+        client = self.serve(lambda path, query: (200, page([query['id']]),
+                                                 None))
+
+        async def run():
+            fn = lambda x: self.aio.get('remote', 'status', id=x)
+            return [x async for x in self.aio.fanout(fn, map(str,
+                                                               range(50)))]
+
+        results = aioapi.run(run())
+        self.assertEqual(len(results), 50)
+        self.assertEqual(sorted(x.value[0] for x in results),
+                         sorted(map(str, range(50))))
+        self.assertEqual(client.peak, 5)
+        self.assertEqual(results[-1].progress, '50/50')
+
+    def test_session_update(self):
+        client = self.serve(lambda path, query: (200, page([]), {
+            "Set-Cookie": 'sessionid=two; Path=/'}))
+        aioapi.run(self.aio.get('routers'))
+        self.assertEqual(client.requests[0].headers['cookie'],
+                         'sessionid=one')
+        self.assertEqual(self.api.session_id, 'two')
+        with open(self.api.session_file) as f:
+            self.assertEqual(json.load(f)[0], 'two')
+
+    def test_auth_error_retry(self):
+        responses = [
+            (401, {"success": False, "exception": 'unauthorized',
+                   "message": None}, None),
+            (200, page(['ok']), None)
+        ]
+        self.serve(lambda path, query: responses.pop(0))
+        self.api.handle_error = unittest.mock.Mock()
+        self.assertEqual(aioapi.run(self.aio.get('routers')), ['ok'])
+        self.assertEqual(self.api.handle_error.call_count, 1)
+
+    def test_fanout_errors(self):
+        self.serve(lambda path, query: (200, page([]), None))
+
+        async def fn(x):
+            if x == 2:
+                raise ValueError(x)
+            return await self.aio.get('routers', x)
+
+        async def run():
+            return [x async for x in self.aio.fanout(fn, [1, 2, 3])]
+
+        results = dict((x.item, x) for x in aioapi.run(run()))
+        self.assertIsInstance(results[2].error, ValueError)
+        self.assertIsNone(results[1].error)
+
+    def test_fanout_system_exit(self):
+        self.serve(lambda path, query: (200, page([]), None))
+
+        async def fn(x):
+            if x == 2:
+                raise SystemExit('Error: router offline')
+            return await self.aio.get('routers', x)
+
+        async def run():
+            return [x async for x in self.aio.fanout(fn, [1, 2, 3])]
+
+        results = dict((x.item, x) for x in aioapi.run(run()))
+        self.assertEqual(len(results), 3)
+        self.assertIsInstance(results[2].error, SystemExit)
+        self.assertIsNone(results[3].error)
+
+    def test_api_error(self):
+        finished = []
+        self.api.add_listener('finish_request', lambda result=None,
+                              request=None: finished.append(request))
+        self.serve(lambda path, query: (404, {
+            "success": False, "exception": 'not_found',
+            "message": 'router gone'}, None))
+
+        async def run():
+            return [x async for x in self.aio.fanout(
+                lambda x: self.aio.get('routers', x), [1])]
+
+        results = aioapi.run(run())
+        self.assertIsInstance(results[0].error, aioapi.APIError)
+        self.assertIn('not_found', str(results[0].error))
+        self.assertEqual([x['error'] for x in finished], [True])
+
+    def test_run_twice(self):
+        self.serve(lambda path, query: (200, page(['ok']), None))
+        for i in range(2):
+            self.assertEqual(aioapi.run(self.aio.get('routers')), ['ok'])
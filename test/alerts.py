@@ -0,0 +1,99 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+from ecmcli.commands import alerts
+
+utc = datetime.timezone.utc
+
+
+def alert(ident, minute, alert_type='config_change'):
+    return {
+        "id": str(ident),
+        "alert_type": alert_type,
+        "created_ts": datetime.datetime(2016, 1, 1, 0, minute, tzinfo=utc)
+    }
+
+
+class Store(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.filename = os.path.join(tmp, 'alerts', 'store')
+
+    def test_aggregates(self):
+        store = alerts.AlertStore()
+        for x in (alert(1, 1), alert(2, 2, 'wan'), alert(3, 3)):
+            self.assertTrue(store.add(x))
+        self.assertEqual(store.types['config_change']['count'], 2)
+        self.assertEqual(store.types['config_change']['oldest'].minute, 1)
+        self.assertEqual(store.types['config_change']['newest'].minute, 3)
+        self.assertEqual(store.types['wan']['count'], 1)
+
+    def test_persist(self):
+        store = alerts.AlertStore(self.filename)
+        self.assertEqual(store.query(), {})
+        store.add(alert(1, 1))
+        store.add(alert(2, 5))
+        store.add(alert(3, 5))
+        store.save()
+        store = alerts.AlertStore(self.filename)
+        store.load()
+        self.assertEqual(store.query(), {
+            "created_ts__gte": '2016-01-01T00:05:00+00:00'})
+        self.assertEqual(store.types['config_change']['count'], 3)
+        # The boundary alerts come back from a gte query.
+        self.assertFalse(store.add(alert(2, 5)))
+        self.assertFalse(store.add(alert(3, 5)))
+        self.assertTrue(store.add(alert(4, 5)))
+        self.assertTrue(store.add(alert(5, 6)))
+        self.assertEqual(store.types['config_change']['count'], 5)
+        self.assertEqual(store.boundary, {'5'})
+
+
+class Command(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        api = unittest.mock.Mock()
+        api.site = 'https://ecm'
+        api.auth_sig = 'sig'
+        api.account = None
+        api.cache_dir = tmp
+        self.cmd = alerts.Alerts(api=api)
+        self.cmd.tabulate = unittest.mock.Mock()
+
+    def runcmd(self, args):
+        args = self.cmd.argparser.parse_args(args.split())
+        with unittest.mock.patch('sys.stdout'):
+            self.cmd.run(args)
+        return self.cmd.tabulate.call_args[0][0]
+
+    def test_incremental(self):
+        api = self.cmd.api
+        api.get_pager.return_value = [alert(1, 1), alert(2, 2)]
+        table = self.runcmd('')
+        api.get_pager.assert_called_with('alerts', order_by='created_ts')
+        self.assertEqual(table[1][1], 2)
+        api.get_pager.return_value = [alert(2, 2), alert(3, 3)]
+        table = self.runcmd('')
+        api.get_pager.assert_called_with('alerts', order_by='created_ts',
+            created_ts__gte='2016-01-01T00:02:00+00:00')
+        self.assertEqual(table[1][1], 3)
+        api.get_pager.return_value = [alert(1, 1)]
+        table = self.runcmd('--rebuild')
+        api.get_pager.assert_called_with('alerts', order_by='created_ts')
+        self.assertEqual(table[1][1], 1)
+
+    def test_since(self):
+        api = self.cmd.api
+        api.get_pager.return_value = [alert(1, 1)]
+        self.runcmd('--since 2016-01-01T00:00:00Z')
+        api.get_pager.assert_called_with('alerts', order_by='created_ts',
+            created_ts__gte='2016-01-01T00:00:00+00:00')
+        self.assertFalse(os.path.exists(os.path.join(api.cache_dir,
+                                                     'alerts')))
@@ -0,0 +1,250 @@
+import dateutil.parser
+import json
+import syndicate.data
+import threading
+import time
+import unittest
+import unittest.mock
+from ecmcli import api, stats
+
+
+class FanOut(unittest.TestCase):
+
+    def test_all_items_processed(self):
+        items = (x for x in range(20))
+        results = list(api.fanout(lambda x: x * 2, items, concurrency=4))
+        self.assertEqual(sorted(x.value for x in results),
+                         [x * 2 for x in range(20)])
+        self.assertEqual(results[-1].done, 20)
+        self.assertEqual(results[-1].total, None)
+
+    def test_ordered(self):
+        delay = lambda x: time.sleep((10 - x) * 0.002) or x
+        results = api.fanout(delay, list(range(10)), concurrency=5,
+                             ordered=True)
+        self.assertEqual([x.value for x in results], list(range(10)))
+
+    def test_errors_captured(self):
+        def fn(x):
+            if x == 3:
+                raise SystemExit('bad router')
+            return x
+        results = list(api.fanout(fn, [1, 2, 3, 4]))
+        errors = [x for x in results if x.error]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].item, 3)
+        self.assertEqual(errors[0].progress.split('/')[1], '4')
+
+    def test_concurrency_bound(self):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def fn(x):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.005)
+            with lock:
+                active[0] -= 1
+        list(api.fanout(fn, range(30), concurrency=3))
+        self.assertLessEqual(active[1], 3)
+
+    def test_auth_failure_aborts(self):
+        def fn(x):
+            raise api.Unauthorized('nope')
+        with self.assertRaises(api.Unauthorized):
+            list(api.fanout(fn, [1, 2]))
+
+
+class RemoteBatching(unittest.TestCase):
+
+    def setUp(self):
+        self.api = api.ECMService()
+        self.api.account = None
+        self.api.remote_batch_size = 10
+        self.api.check_session = lambda: None
+        self.calls = []
+        patch = unittest.mock.patch('syndicate.Service.do', self.fake_do)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def fake_do(self, method, path, urn=None, **query):
+        self.calls.append(query)
+        ids = query.get('id__in', '').split(',')
+        result = syndicate.data.ListResponse({"id": x} for x in ids)
+        result.meta = {"next": None}
+        return result
+
+    def test_small_filter_unchanged(self):
+        ids = ','.join(map(str, range(10)))
+        self.api.get('remote', '/status', id__in=ids)
+        self.assertEqual(self.calls, [{"id__in": ids}])
+
+    def test_large_filter_split(self):
+        ids = [str(x) for x in range(35)]
+        result = self.api.get('remote', '/status', id__in=','.join(ids))
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual([x['id'] for x in result], ids)
+
+    def test_pager_split(self):
+        ids = [str(x) for x in range(25)]
+        pager = self.api.get_pager('remote', '/status', id__in=','.join(ids))
+        self.assertEqual([x['id'] for x in pager], ids)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_non_remote_unchanged(self):
+        ids = ','.join(map(str, range(35)))
+        self.api.get('routers', id__in=ids)
+        self.assertEqual(len(self.calls), 1)
+
+
+class RequestEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.api = api.ECMService()
+        self.api.account = None
+        self.api.check_session = lambda: None
+        self.finished = []
+        self.api.add_listener('finish_request',
+            lambda result=None, request=None: self.finished.append(request))
+
+    def test_failed_request(self):
+        error = syndicate.client.ResponseError({
+            "exception": 'not_found', "message": 'router gone'})
+        with unittest.mock.patch('syndicate.Service.do', side_effect=error):
+            self.assertRaises(SystemExit, self.api.get, 'routers', '1')
+        with unittest.mock.patch('syndicate.Service.do',
+                                 side_effect=OSError('reset')):
+            self.assertRaises(OSError, self.api.get, 'routers', '1')
+        self.assertEqual([x['error'] for x in self.finished], [True, True])
+        self.assertEqual(self.finished[0]['resource'], 'routers')
+        self.assertGreaterEqual(self.finished[0]['elapsed'], 0)
+
+    def test_stats_settle(self):
+        rs = stats.RequestStats(self.api)
+        rs.attach()
+        with unittest.mock.patch('syndicate.Service.do',
+                                 side_effect=OSError('reset')):
+            self.assertRaises(OSError, self.api.get, 'routers', '1')
+        self.assertEqual(rs.active, 0)
+        self.assertEqual(rs.resources['routers'].requests, 1)
+        self.assertEqual(rs.resources['routers'].errors, 1)
+
+
+class PrefetchPager(unittest.TestCase):
+
+    total = 250
+
+    def setUp(self):
+        self.api = api.ECMService()
+        self.api.account = None
+        self.api.check_session = lambda: None
+        self.calls = []
+        patch = unittest.mock.patch('syndicate.Service.do', self.fake_do)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def fake_do(self, method, path, urn=None, **query):
+        if urn:
+            query = dict(x.split('=') for x in urn.split('?')[1].split('&'))
+        self.calls.append(query)
+        offset = int(query.get('offset', 0))
+        limit = int(query['limit'])
+        result = syndicate.data.ListResponse(range(offset, min(offset + limit,
+                                                               self.total)))
+        more = offset + limit < self.total
+        result.meta = {
+            "limit": limit,
+            "offset": offset,
+            "total_count": self.total if self.report_total else None,
+            "next": '/next?limit=%d&offset=%d' % (limit, offset + limit)
+                    if more else None
+        }
+        return result
+
+    def test_read_ahead(self):
+        self.report_total = True
+        results = list(self.api.get_pager('alerts', page_size=100))
+        self.assertEqual(results, list(range(self.total)))
+        self.assertEqual(sorted(int(x.get('offset', 0)) for x in self.calls),
+                         [0, 100, 200])
+
+    def test_without_total(self):
+        self.report_total = False
+        results = list(self.api.get_pager('alerts', limit=100))
+        self.assertEqual(results, list(range(self.total)))
+        self.assertEqual(len(self.calls), 3)
+
+
+class Connections(unittest.TestCase):
+
+    def setUp(self):
+        self.api = api.ECMService()
+
+    def pool_size(self, scheme):
+        return self.api.adapter.session.get_adapter(scheme)._pool_maxsize
+
+    def test_gzip_requested(self):
+        headers = self.api.adapter.session.headers
+        self.assertEqual(headers['accept-encoding'], 'gzip')
+
+    def test_pool_sized_for_concurrency(self):
+        self.api.concurrency = 16
+        self.api.prefetch = 4
+        self.api.setup_pool()
+        self.assertEqual(self.pool_size('https://'), 64)
+        self.assertEqual(self.pool_size('http://'), 64)
+
+    def test_wire_size(self):
+        resp = unittest.mock.Mock(content=b'x' * 100)
+        resp.raw.tell.return_value = 20
+        self.assertEqual(self.api.adapter.wire_size(resp), 20)
+        resp.raw = None
+        self.assertEqual(self.api.adapter.wire_size(resp), 100)
+
+
+class Decoder(unittest.TestCase):
+
+    dates = [
+        '2015-10-01',
+        '2015-10-01T12:30:45',
+        '2015-10-01T12:30:45Z',
+        '2015-10-01T12:30:45+00:00',
+        '2015-10-01T12:30:45.5-05:30',
+        '2015-10-01T12:30:45.123456+0200',
+        '2015-10-01T12:30:45.123456789Z',
+    ]
+
+    def decoders(self):
+        return [api.HTMLJSONDecoder(), api.HTMLJSONDecoder(loads=json.loads)]
+
+    def test_dates(self):
+        doc = json.dumps([{"ts": x} for x in self.dates])
+        for decoder in self.decoders():
+            for date, x in zip(self.dates, decoder.decode(doc)):
+                self.assertEqual(x['ts'], dateutil.parser.parse(date))
+                self.assertEqual(x['ts'].utcoffset(),
+                                 dateutil.parser.parse(date).utcoffset())
+
+    def test_unescape(self):
+        doc = json.dumps({"a": {"name": 'A &amp; B', "n": [{"v": '&lt;'}]},
+                          "plain": 'x & y', "list": ['&amp;']})
+        for decoder in self.decoders():
+            data = decoder.decode(doc)
+            self.assertEqual(data['a']['name'], 'A & B')
+            self.assertEqual(data['a']['n'][0]['v'], '<')
+            self.assertEqual(data['plain'], 'x & y')
+            self.assertEqual(data['list'], ['&amp;'])
+
+    def test_escaped_ampersand(self):
+        doc = json.dumps({"name": 'A &amp; B'}, ensure_ascii=False)
+        doc = doc.replace('&', '\\u0026')
+        self.assertNotIn('&', doc)
+        for decoder in self.decoders():
+            self.assertEqual(decoder.decode(doc), {"name": 'A & B'})
+
+    def test_not_dates(self):
+        doc = json.dumps({"ip": '10.0.0.1', "id": '1234', "serial":
+                          '2015-10-01 extra', "empty": '', "num": 2015})
+        for decoder in self.decoders():
+            self.assertEqual(decoder.decode(doc), json.loads(doc))
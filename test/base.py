@@ -0,0 +1,23 @@
+import datetime
+import unittest
+from ecmcli.commands import base
+
+utc = datetime.timezone.utc
+
+
+class ParseSince(unittest.TestCase):
+
+    def test_relative(self):
+        now = datetime.datetime(2016, 1, 10, tzinfo=utc)
+        self.assertEqual(base.parse_since('2d', now=now),
+                         datetime.datetime(2016, 1, 8, tzinfo=utc))
+        self.assertEqual(base.parse_since('90m', now=now),
+                         datetime.datetime(2016, 1, 9, 22, 30, tzinfo=utc))
+
+    def test_absolute(self):
+        self.assertEqual(base.parse_since('2016-01-02T03:04:05Z'),
+                         datetime.datetime(2016, 1, 2, 3, 4, 5, tzinfo=utc))
+        self.assertIsNotNone(base.parse_since('2016-01-02').tzinfo)
+
+    def test_invalid(self):
+        self.assertRaises(SystemExit, base.parse_since, 'yesterday-ish')
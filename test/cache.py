@@ -0,0 +1,176 @@
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+from ecmcli import api, cache
+
+URL = 'https://ecm.test/api/v1/routers/'
+
+
+class ResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.cache = cache.ResponseCache(self.dir, {"routers": 60},
+                                         '/api/v1')
+
+    def test_store_lookup(self):
+        self.cache.store(URL, {"limit": 10}, '{}', {"etag": 'abc'})
+        entry = self.cache.lookup(URL, {"limit": 10})
+        self.assertTrue(entry.fresh)
+        self.assertEqual(entry.validators, {"If-None-Match": 'abc'})
+        self.assertIsNone(self.cache.lookup(URL, {"limit": 20}))
+
+    def test_uncached_resource(self):
+        url = 'https://ecm.test/api/v1/alerts/'
+        self.cache.store(url, {}, '{}')
+        self.assertIsNone(self.cache.lookup(url, {}))
+
+    def test_expired(self):
+        self.cache.store(URL, {}, '{}')
+        with unittest.mock.patch('time.time', return_value=10 ** 11):
+            self.assertFalse(self.cache.lookup(URL, {}).fresh)
+        self.cache.refresh = True
+        self.assertFalse(self.cache.lookup(URL, {}).fresh)
+
+    def test_invalidate(self):
+        self.cache.store(URL, {}, '{}')
+        self.cache.invalidate(URL + '1/')
+        self.assertIsNone(self.cache.lookup(URL, {}))
+
+    def test_invalidate_dependents(self):
+        self.cache.ttls = {"routers": 60, "groups": 60, "profiles": 60}
+        self.cache.dependents = {"routers": ["groups"]}
+        groups = URL.replace('routers', 'groups')
+        profiles = URL.replace('routers', 'profiles')
+        self.cache.store(groups, {}, '{}')
+        self.cache.store(profiles, {}, '{}')
+        self.cache.invalidate(URL + '1/')
+        self.assertIsNone(self.cache.lookup(groups, {}))
+        self.assertIsNotNone(self.cache.lookup(profiles, {}))
+        self.cache.invalidate(groups)
+        self.assertIsNotNone(self.cache.lookup(profiles, {}))
+
+    def test_scope(self):
+        user = ['a']
+        self.cache.scope = lambda: user[0]
+        self.cache.store(URL, {}, '{}')
+        user[0] = 'b'
+        self.assertIsNone(self.cache.lookup(URL, {}))
+
+
+class CompletionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.index = cache.CompletionIndex(self.dir)
+
+    def test_prefix_narrowing(self):
+        self.assertIsNone(self.index.lookup('routers', 'name', 'a'))
+        self.index.store('routers', 'name', 'a', ['abc', 'abd', 'axe'])
+        self.assertEqual(self.index.lookup('routers', 'name', 'ab'),
+                         {'abc', 'abd'})
+        self.assertIsNone(self.index.lookup('routers', 'name', 'b'))
+
+    def test_persistent(self):
+        self.index.store('routers', 'name', '', ['abc', None])
+        index = cache.CompletionIndex(self.dir)
+        self.assertEqual(index.lookup('routers', 'name', 'a'), {'abc'})
+
+    def test_resource_ttl(self):
+        index = cache.CompletionIndex(self.dir, ttls={"routers": 60})
+        index.store('routers', 'name', '', ['abc'])
+        index.store('users', 'username', '', ['abc'])
+        with unittest.mock.patch('time.time',
+                                 return_value=time.time() + 100):
+            self.assertIsNone(index.lookup('routers', 'name', 'a'))
+            self.assertEqual(index.lookup('users', 'username', 'a'),
+                             {'abc'})
+
+    def test_site_scope(self):
+        service = api.ECMService()
+        service.auth_sig = 'user'
+        service.cache_dir = self.dir
+        service.setup_cache()
+        service.site = 'https://a.test'
+        service.completions.store('routers', 'name', '', ['abc'])
+        service.site = 'https://b.test'
+        self.assertIsNone(service.completions.lookup('routers', 'name', 'a'))
+
+    def test_invalidate(self):
+        self.index.store('routers', 'name', '', ['abc'])
+        self.index.store('groups', 'name', '', ['abc'])
+        self.index.invalidate('routers')
+        self.assertIsNone(self.index.lookup('routers', 'name', 'a'))
+        self.assertEqual(self.index.lookup('groups', 'name', 'a'), {'abc'})
+
+
+class CachingAdapter(unittest.TestCase):
+
+    body = '{"success": true, "data": [{"id": "1"}], "meta": {"next": null}}'
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        service = api.ECMService()
+        service.auth_sig = None
+        service.cache_dir = self.dir
+        service.setup_cache()
+        self.adapter = service.adapter
+        self.adapter.session.request = unittest.mock.Mock()
+
+    def respond(self, status, body=None, headers=None):
+        resp = unittest.mock.Mock(status_code=status, headers=headers or {})
+        resp.content = body.encode() if body else b''
+        self.adapter.session.request.return_value = resp
+
+    def test_fresh_hit(self):
+        self.respond(200, self.body)
+        self.adapter.request('get', URL, query={})
+        result = self.adapter.request('get', URL, query={})
+        self.assertEqual(self.adapter.session.request.call_count, 1)
+        self.assertEqual(result[0]['id'], '1')
+
+    def test_revalidate(self):
+        self.respond(200, self.body, {"etag": 'v1'})
+        self.adapter.request('get', URL, query={})
+        self.adapter.cache.refresh = True
+        self.respond(304)
+        result = self.adapter.request('get', URL, query={})
+        headers = self.adapter.session.request.call_args[1]['headers']
+        self.assertEqual(headers, {"If-None-Match": 'v1'})
+        self.assertEqual(result[0]['id'], '1')
+
+    def test_mutation_invalidates(self):
+        self.respond(200, self.body)
+        self.adapter.request('get', URL, query={})
+        self.adapter.request('put', URL + '1/', data={}, query={})
+        self.adapter.request('get', URL, query={})
+        self.assertEqual(self.adapter.session.request.call_count, 3)
+
+    def test_uncached(self):
+        service = api.ECMService()
+        service.adapter = self.adapter
+        self.respond(200, self.body)
+        self.adapter.request('get', URL, query={})
+        with service.uncached():
+            self.adapter.request('get', URL, query={})
+        self.adapter.request('get', URL, query={})
+        self.assertEqual(self.adapter.session.request.call_count, 2)
+        headers = self.adapter.session.request.call_args[1]['headers']
+        self.assertEqual(headers, {})
+
+    def test_mutation_invalidates_dependents(self):
+        self.respond(200, self.body)
+        for x in ('groups', 'accounts', 'profiles'):
+            self.adapter.request('get', URL.replace('routers', x), query={})
+        self.adapter.request('put', URL + '1/', data={}, query={})
+        self.adapter.request('post', URL.replace('routers', 'users'),
+                             data={}, query={})
+        self.adapter.session.request.reset_mock()
+        for x in ('groups', 'accounts', 'profiles'):
+            self.adapter.request('get', URL.replace('routers', x), query={})
+        self.assertEqual(self.adapter.session.request.call_count, 3)
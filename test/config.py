@@ -0,0 +1,185 @@
+import io
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+from ecmcli.commands import config
+
+
+def router(ident):
+    return {"id": str(ident), "name": 'r%d' % ident,
+            "configuration_manager": '/api/v1/configuration_managers/%d/' %
+                                     (ident + 100)}
+
+
+class UpdateConfig(unittest.TestCase):
+
+    def test_merge(self):
+        cfg = [{"system": {"desc": 'a', "system_id": 'r1'}},
+               [['system', 'desc'], ['wan']]]
+        updated = config.update_config(cfg, 'system.desc', 'b')
+        self.assertEqual(updated, [{"system": {"desc": 'b',
+                                               "system_id": 'r1'}}, [['wan']]])
+        self.assertEqual(cfg[0]['system']['desc'], 'a')
+
+    def test_new_section(self):
+        updated = config.update_config([{}, []], 'lan.0.ip', '1.2')
+        self.assertEqual(updated, [{"lan": {"0": {"ip": '1.2'}}}, []])
+
+    def test_list_section(self):
+        cfg = [{"wan": {"rules2": [{"priority": 1}, {"priority": 2}]}}, []]
+        updated = config.update_config(cfg, 'wan.rules2.1.priority', 5)
+        self.assertEqual(updated[0]['wan']['rules2'],
+                         [{"priority": 1}, {"priority": 5}])
+        updated = config.update_config(cfg, 'wan.rules2.2', {"priority": 3})
+        self.assertEqual(updated[0]['wan']['rules2'][2], {"priority": 3})
+        self.assertRaises(ValueError, config.update_config, cfg,
+                          'wan.rules2.4.priority', 1)
+        self.assertRaises(ValueError, config.update_config, cfg,
+                          'wan.rules2.x', 1)
+
+    def test_format_share(self):
+        self.assertEqual(config.format_share(1, 4), '25%')
+        self.assertEqual(config.format_share(1, 200), '<1%')
+        self.assertEqual(config.format_share(199, 200), '>99%')
+        self.assertEqual(config.format_share(200, 200), '100%')
+
+    def test_not_section(self):
+        self.assertRaises(ValueError, config.update_config,
+                          [{"system": 'x'}, []], 'system.desc', 'b')
+
+
+class Targeting(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = config.Config(api=unittest.mock.MagicMock())
+        self.cmd.api.get_by_id_or_name.side_effect = lambda res, x, **kw: {
+            "id": x.split('-')[-1], "name": x, "configuration": [{}, []]}
+
+    def parse(self, args):
+        return self.cmd.argparser.parse_args(args.split())
+
+    def test_filters(self):
+        args = self.parse('--account a-2 --router r-5 --router 7 x')
+        self.cmd.select_routers(args, {"id": '3'})
+        self.cmd.api.get_pager.assert_called_once_with(
+            'routers', fields='id,name,configuration_manager', group='3',
+            account='2', id__in='5,7')
+
+    def test_search(self):
+        args = self.parse('--account a-2 --search state:online x')
+        self.cmd.select_routers(args)
+        self.cmd.api.get_pager.assert_called_once_with(
+            'routers', account='2', state__icontains='online')
+
+    def test_group_write(self):
+        self.cmd.api.get.return_value = {"id": '3', "name": 'g-3',
+                                         "configuration": [{}, []]}
+        with unittest.mock.patch('builtins.print'):
+            self.cmd.run(self.parse('--group g-3 system.desc="hi"'))
+        self.cmd.api.put.assert_called_once_with('groups', '3', {
+            "configuration": [{"system": {"desc": 'hi'}}, []]})
+        self.cmd.api.get_pager.assert_not_called()
+
+    def test_group_write_fresh(self):
+        """ The written config is based on an uncached read so changes made
+        since the group was cached are kept. """
+        api = self.cmd.api
+        api.get.return_value = {"id": '3', "name": 'g-3', "configuration": [
+            {"system": {"b": 2}}, []]}
+        with unittest.mock.patch('builtins.print'):
+            self.cmd.run(self.parse('--group g-3 system.c=3'))
+        api.put.assert_called_once_with('groups', '3', {
+            "configuration": [{"system": {"b": 2, "c": 3}}, []]})
+        calls = [x[0] for x in api.mock_calls]
+        self.assertEqual(calls[calls.index('uncached'):][:4], [
+            'uncached', 'uncached().__enter__', 'get',
+            'uncached().__exit__'])
+        api.get.assert_called_once_with('groups', '3',
+                                        expand='configuration')
+
+    def test_group_subset_write(self):
+        self.cmd.api.get_pager.return_value = [{"id": '5', "name": 'r-5'}]
+        self.cmd.api.fanout.return_value = []
+        self.cmd.run(self.parse('--group g-3 --router r-5 system.desc="hi"'))
+        self.cmd.api.put.assert_not_called()
+        self.assertEqual(self.cmd.api.get_pager.call_args[1]['group'], '3')
+        self.cmd.api.get_by_id_or_name.assert_any_call('groups', 'g-3')
+
+
+class Cache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_version(self):
+        cache = config.ConfigCache(self.tmp)
+        self.assertIsNone(cache.get('1', 3))
+        cache.put('1', 3, [{"a": 1}, []])
+        self.assertEqual(cache.get('1', 3), [{"a": 1}, []])
+        self.assertIsNone(cache.get('1', 4))
+        self.assertIsNone(cache.get('2', 3))
+
+    def test_disabled(self):
+        cache = config.ConfigCache()
+        cache.put('1', 3, [{}, []])
+        self.assertIsNone(cache.get('1', 3))
+
+
+class Fetch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache = config.ConfigCache(self.tmp)
+        api = unittest.mock.Mock()
+        api.default_page_size = 2
+        api.fanout.side_effect = lambda fn, items, **kw: [
+            self.result(fn, x) for x in items]
+        api.get_pager.side_effect = lambda res, id__in, **kw: [
+            {"id": int(x), "version_number": 1} for x in id__in.split(',')]
+        api.get.side_effect = lambda res, ident, **kw: {
+            "version_number": 1,
+            "configuration": [{"system": {"system_id": ident}}, []]}
+        self.cmd = config.Config(api=api)
+        self.cmd.config_cache = lambda: self.cache
+
+    def result(self, fn, item):
+        try:
+            return unittest.mock.Mock(item=item, value=fn(item), error=None)
+        except Exception as e:
+            return unittest.mock.Mock(item=item, value=None, error=e)
+
+    def test_batches(self):
+        configs = list(self.cmd.configs([router(i) for i in range(5)]))
+        self.assertEqual(self.cmd.api.get_pager.call_count, 3)
+        self.assertEqual(configs[4].value[0]['system']['system_id'], '104')
+
+    def test_cached(self):
+        self.cache.put('1', 1, [{"cached": True}, []])
+        self.cache.put('2', 0, [{"cached": True}, []])
+        configs = list(self.cmd.configs([router(1), router(2)]))
+        self.assertEqual(configs[0].value, [{"cached": True}, []])
+        self.assertNotIn('cached', configs[1].value[0])
+        self.cmd.api.get.assert_called_once_with(
+            'configuration_managers', '102',
+            fields='version_number,configuration')
+        self.assertEqual(self.cache.get('2', 1), configs[1].value)
+
+    def test_no_manager(self):
+        routers = [router(1), dict(router(2), configuration_manager=None)]
+        configs = list(self.cmd.configs(routers))
+        self.assertIsInstance(configs[1].error, ValueError)
+
+    def test_diff(self):
+        for i in range(1, 5):
+            value = 'odd' if i == 3 else 'same'
+            self.cache.put(str(i), 1, [{"system": {"system_id": value}}, []])
+        with unittest.mock.patch('sys.stdout', new=io.StringIO()) as out:
+            self.cmd.diff_value([router(i) for i in range(1, 5)],
+                                'system.system_id')
+        self.assertEqual(out.getvalue(), 'Value 1: 3 router(s) (75%)\n'
+                         '"same"\n\n'
+                         'Value 2: 1 router(s) (25%): r3 (3)\n'
+                         '"odd"\n')
@@ -0,0 +1,240 @@
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+from ecmcli import api
+from ecmcli.commands import logs
+
+utc = datetime.timezone.utc
+
+
+def ts(second):
+    return datetime.datetime(2016, 1, 1, 0, 0, second, tzinfo=utc)
+
+
+def entry(ident, second):
+    return {"id": str(ident), "timestamp": ts(second)}
+
+
+class Filters(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = logs.Logs(api=unittest.mock.Mock())
+
+    def parse(self, args):
+        return self.cmd.argparser.parse_args(args.split())
+
+    def test_level(self):
+        filters = self.cmd.filters(self.parse('-l warning'))
+        self.assertEqual(filters, {
+            "levelname__in": 'WARNING,ERROR,CRITICAL'})
+        filters = self.cmd.filters(self.parse('-l debug'))
+        self.assertEqual(filters['levelname__in'].count(','), 4)
+
+    def test_pushdown(self):
+        args = self.parse('-m timeout --since 2016-01-01T00:00:00Z '
+                          '--until 2016-01-02T00:00:00Z')
+        self.assertEqual(self.cmd.filters(args), {
+            "message__icontains": 'timeout',
+            "timestamp__gte": '2016-01-01T00:00:00+00:00',
+            "timestamp__lt": '2016-01-02T00:00:00+00:00'
+        })
+        self.assertIsNone(self.cmd.matcher(args))
+
+    def test_regex(self):
+        args = self.parse(r'-r WAN\d')
+        self.assertEqual(self.cmd.filters(args), {})
+        match = self.cmd.matcher(args)
+        self.assertTrue(match({"message": 'WAN2 up'}))
+        self.assertFalse(match({"message": 'wan2 up'}))
+        self.assertFalse(match({"message": None}))
+
+    def test_bad_regex(self):
+        with unittest.mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, self.parse, '-r (')
+
+    def test_view_streams_filter(self):
+        self.cmd.api.get_pager.return_value = iter([
+            {"message": 'WAN1 down'}, {"message": 'LAN up'}])
+        self.cmd.api.fanout.side_effect = lambda fn, items, **kw: [
+            unittest.mock.Mock(item=x, value=fn(x), error=None)
+            for x in items]
+        args = self.parse('-r WAN')
+        with unittest.mock.patch.object(self.cmd, 'print_entry') as pe, \
+             unittest.mock.patch('builtins.print'):
+            self.cmd.view(args, [{"id": '1', "name": 'r1'}])
+        self.assertEqual(pe.call_count, 1)
+
+
+class Follow(unittest.TestCase):
+
+    def test_router_error(self):
+        cmd = logs.Logs(api=unittest.mock.Mock())
+        cmd.api.concurrency = 2
+        cmd.api.worker.side_effect = lambda fn, timeout: fn
+        cmd.follow_min_interval = cmd.follow_max_interval = 0.01
+        routers = [{"id": '1', "name": 'ok'}, {"id": '2', "name": 'gone'}]
+        polls = []
+
+        def poll(stream, filters, lines):
+            polls.append(stream.router['id'])
+            if stream.router['id'] == '2':
+                raise SystemExit('Error: not_found\nrouter gone')
+            n = polls.count('1')
+            return ts(n + 1), [entry(n, n)]
+
+        printed = []
+
+        def print_entry(rinfo, entry):
+            printed.append(entry['id'])
+            if len(printed) == 3:
+                raise KeyboardInterrupt()
+
+        cmd.poll = poll
+        cmd.print_entry = print_entry
+        args = cmd.argparser.parse_args(['-f'])
+        with unittest.mock.patch('sys.stderr') as stderr:
+            cmd.follow(args, routers)
+        self.assertEqual(printed[:3], ['1', '2', '3'])
+        self.assertGreater(polls.count('2'), 1)
+        self.assertIn('router gone', ''.join(x[1][0] for x in
+                                             stderr.write.mock_calls))
+
+    def test_auth_failure(self):
+        cmd = logs.Logs(api=unittest.mock.Mock())
+        cmd.api.concurrency = 1
+        cmd.api.worker.side_effect = lambda fn, timeout: fn
+
+        def poll(stream, filters, lines):
+            raise api.AuthFailure('expired')
+
+        cmd.poll = poll
+        args = cmd.argparser.parse_args(['-f'])
+        self.assertRaises(api.AuthFailure, cmd.follow, args,
+                          [{"id": '1', "name": 'r1'}])
+
+
+class Stream(unittest.TestCase):
+
+    def test_dedupe(self):
+        stream = logs.LogStream({"id": '1'}, 1, 8)
+        self.assertEqual(stream.query(), {})
+        fresh = stream.update([entry(1, 1), entry(2, 2)], ts(3))
+        self.assertEqual(len(fresh), 2)
+        self.assertEqual(stream.query(), {
+            "timestamp__gte": '2016-01-01T00:00:02+00:00'})
+        fresh = stream.update([entry(2, 2), entry(3, 2), entry(4, 4)], ts(5))
+        self.assertEqual([x['id'] for x in fresh], ['3', '4'])
+        self.assertEqual(stream.polled, ts(5))
+
+    def test_skew(self):
+        stream = logs.LogStream({"id": '1'}, 1, 8)
+        self.assertIsNone(stream.horizon)
+        ahead = datetime.timedelta(hours=1)
+        stream.update([entry(1, 9)], ts(10))
+        self.assertEqual(stream.horizon, ts(10))
+        stream.update([{"id": '2', "timestamp": ts(10) + ahead}], ts(11))
+        self.assertEqual(stream.horizon, ts(10) + ahead)
+        stream.update([], ts(12))
+        self.assertEqual(stream.horizon, ts(11) + ahead)
+
+    def test_backoff(self):
+        stream = logs.LogStream({"id": '1'}, 1, 8)
+        intervals = []
+        for i in range(5):
+            stream.update([], ts(i))
+            intervals.append(stream.interval)
+        self.assertEqual(intervals, [2, 4, 8, 8, 8])
+        stream.update([entry(1, 1)], ts(6))
+        self.assertEqual(stream.interval, 1)
+
+
+class Merger(unittest.TestCase):
+
+    def setUp(self):
+        self.a = logs.LogStream('a', 1, 8)
+        self.b = logs.LogStream('b', 1, 8)
+
+    def test_order(self):
+        merger = logs.LogMerger([self.a, self.b], 100)
+        merger.add(self.a, self.a.update([entry(1, 1), entry(2, 5)], ts(6)))
+        self.assertEqual(list(merger.pop()), [])  # b not polled yet
+        merger.add(self.b, self.b.update([entry(1, 3)], ts(4)))
+        self.assertEqual([(r, x['timestamp'].second)
+                          for r, x in merger.pop()], [('a', 1), ('b', 3)])
+        merger.add(self.b, self.b.update([entry(2, 4)], ts(7)))
+        self.assertEqual([(r, x['timestamp'].second)
+                          for r, x in merger.pop()], [('b', 4), ('a', 5)])
+
+    def test_failed_stream(self):
+        merger = logs.LogMerger([self.a, self.b], 100)
+        merger.add(self.a, self.a.update([entry(1, 1)], ts(2)))
+        self.b.failed = True
+        self.assertEqual(len(list(merger.pop())), 1)
+
+    def test_max_delay(self):
+        clock = unittest.mock.Mock(return_value=100)
+        merger = logs.LogMerger([self.a, self.b], 100, 5, clock=clock)
+        ahead = datetime.timedelta(hours=1)
+        merger.add(self.a, self.a.update([
+            {"id": '1', "timestamp": ts(1) + ahead}], ts(2)))
+        merger.add(self.b, self.b.update([entry(1, 1)], ts(2)))
+        self.assertEqual([r for r, x in merger.pop()], ['b'])
+        self.assertEqual(merger.deadline(), 105)
+        clock.return_value = 104
+        self.assertEqual(list(merger.pop()), [])
+        clock.return_value = 105
+        self.assertEqual([r for r, x in merger.pop()], ['a'])
+        self.assertIsNone(merger.deadline())
+
+    def test_bounded(self):
+        merger = logs.LogMerger([self.a, self.b], 3)
+        merger.add(self.a, self.a.update([entry(i, i) for i in range(5)],
+                                         ts(6)))
+        popped = [x['timestamp'].second for r, x in merger.pop()]
+        self.assertEqual(popped, [0, 1])
+        self.assertEqual(len(list(merger.pop(flush=True))), 3)
+
+
+class Export(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def read(self, export):
+        opener = gzip.open if export.compress else open
+        with opener(export.filename, 'rb') as f:
+            return [json.loads(x.decode()) for x in f]
+
+    def check_resume(self, compress):
+        router = {"id": '7'}
+        export = logs.LogExport(router, self.tmp, compress)
+        export.open()
+        export.write([entry(1, 1), entry(2, 2)])
+        export.file.write(b'torn write')
+        export.close()
+        self.assertFalse(export.complete)
+        export = logs.LogExport(router, self.tmp, compress)
+        export.open()
+        self.assertEqual(export.query(), {
+            "timestamp__gte": '2016-01-01T00:00:02+00:00'})
+        export.write([entry(2, 2), entry(3, 2), entry(4, 3)])
+        export.finish()
+        self.assertTrue(export.complete)
+        self.assertEqual(export.entries, 2)
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         [os.path.basename(export.filename)])
+        data = self.read(export)
+        self.assertEqual([x['id'] for x in data], ['1', '2', '3', '4'])
+        self.assertEqual(data[0]['timestamp'], '2016-01-01T00:00:01+00:00')
+
+    def test_resume(self):
+        self.check_resume(False)
+
+    def test_resume_gzip(self):
+        self.check_resume(True)
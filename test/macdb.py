@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ecmcli import macdb
+
+
+class MacDB(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.filename = os.path.join(self.dir, 'mac.db')
+
+    def test_lookup(self):
+        entries = [(x, 'S%d' % x, 'Long %d' % x) for x in range(0, 5000, 7)]
+        macdb.write(reversed(entries), self.filename)
+        db = macdb.MacDB(self.filename)
+        self.assertEqual(len(db), len(entries))
+        for oui, short, long in entries:
+            self.assertEqual(db.get(oui), (short, long))
+        self.assertNotIn(1, db)
+        self.assertIsNone(db.get(5000))
+        self.assertEqual(db.get(-1, 'x'), 'x')
+
+    def test_ieee_csv(self):
+        csvfile = os.path.join(self.dir, 'oui.csv')
+        with open(csvfile, 'w') as f:
+            f.write('Registry,Assignment,Organization Name,'
+                    'Organization Address\n')
+            f.write('MA-L,00000B,"Cradlepoint, Inc",Boise\n')
+        macdb.write(macdb.read_ieee_csv(csvfile), self.filename)
+        db = macdb.MacDB(self.filename)
+        self.assertEqual(db.get(0xb), ('Cradlepo', 'Cradlepoint, Inc'))
+
+    def test_packaged_db(self):
+        db = macdb.MacDB()
+        self.assertEqual(db.get(1), ('XeroxCor', 'XEROX CORPORATION'))
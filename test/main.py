@@ -0,0 +1,52 @@
+import unittest.mock
+from ecmcli import main
+
+
+class SelectedModules(unittest.TestCase):
+
+    def setUp(self):
+        self.root = main.ECMRoot(api=unittest.mock.Mock())
+
+    def selected(self, args):
+        return main.selected_modules(self.root, args.split())
+
+    def test_command(self):
+        self.assertEqual(self.selected('routers show foo'), ['routers'])
+
+    def test_command_after_root_options(self):
+        self.assertEqual(self.selected('--api_site foo --concurrency 4 logs'),
+                         ['logs'])
+
+    def test_command_help(self):
+        self.assertEqual(self.selected('groups --help'), ['groups'])
+
+    def test_no_command(self):
+        self.assertEqual(self.selected(''), main.command_modules)
+        self.assertEqual(self.selected('--help'), main.command_modules)
+
+    def test_unknown_command(self):
+        self.assertEqual(self.selected('nope'), main.command_modules)
+
+    def test_completion_of_command_args(self):
+        args = ['completion', '--seed', 'ecm', 'routers', '']
+        self.assertEqual(main.selected_modules(self.root, args), ['routers'])
+
+    def test_completion_of_command_name(self):
+        args = ['completion', '--seed', 'ecm', 'rou']
+        self.assertEqual(main.selected_modules(self.root, args),
+                         main.command_modules)
+
+
+class LazyConnect(unittest.TestCase):
+
+    def setUp(self):
+        self.api = main.api.ECMService()
+        self.api.session_file = '/nonexistent/ecmcli_session'
+        self.api.reset_auth = unittest.mock.Mock()
+
+    def test_connect_is_offline(self):
+        with unittest.mock.patch('syndicate.Service.do') as do:
+            self.api.connect('https://example.com', 'user', 'pass')
+            self.assertFalse(do.called)
+        self.assertFalse(self.api.reset_auth.called)
+        self.assertTrue(self.api.need_login)
@@ -1,4 +1,5 @@
 import unittest.mock
+from ecmcli import api as ecmapi
 from ecmcli.commands import reboot
 
 class ArgSanity(unittest.TestCase):
@@ -8,6 +9,8 @@ class ArgSanity(unittest.TestCase):
         fake = dict(name='foo', id='1')
         api.get_by_id_or_name.return_value = fake
         api.get_pager.return_value = [fake]
+        api.fanout.side_effect = lambda fn, items, **kwargs: \
+            ecmapi.fanout(fn, items)
         self.cmd = reboot.Reboot(api=api)
 
     def runcmd(self, args):
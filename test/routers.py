@@ -0,0 +1,35 @@
+import functools
+import io
+import unittest
+import unittest.mock
+from ecmcli.commands import routers
+
+
+class TersePrinter(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = routers.Show(api=unittest.mock.Mock())
+        self.cmd.group_name = lambda group: group and group['name']
+
+    def render(self, rows):
+        out = io.StringIO()
+        table = functools.partial(routers.Table, file=out)
+        with unittest.mock.patch.object(routers, 'Table', table):
+            self.cmd.terse_printer(rows)
+        return out.getvalue().splitlines()
+
+    def test_empty(self):
+        lines = self.render([])
+        self.assertEqual(len(lines), 1)
+        for x in ('Name', 'ID', 'Account', 'Group', 'IP Address', 'Conn'):
+            self.assertIn(x, lines[0])
+
+    def test_rows(self):
+        self.cmd.stream_sample = 1
+        lines = self.render({
+            "id": str(i), "name": 'r%d' % i, "account": {"name": 'acct'},
+            "group": None, "ip_address": '10.0.0.%d' % i, "state": 'online'
+        } for i in range(3))
+        self.assertEqual(len(lines), 4)
+        self.assertIn('Name', lines[0])
+        self.assertIn('r2', lines[3])
@@ -0,0 +1,220 @@
+import codecs
+import fcntl
+import os
+import threading
+import time
+import unittest
+import unittest.mock
+from ecmcli.commands import shell
+
+
+class Exchange(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = shell.Shell(api=unittest.mock.Mock())
+        self.cmd.request_lock = threading.Lock()
+        self.written = []
+        self.cmd.full_write = lambda f, data: self.written.append(data)
+
+    def test_one_request_at_a_time(self):
+        active = []
+        handled = []
+
+        def send(keys, size=None):
+            active.append(keys)
+            self.assertEqual(len(active), 1)
+            time.sleep(0.001)
+            handled.append(keys)
+            active.remove(keys)
+            return keys
+
+        term = unittest.mock.Mock()
+        term.send.side_effect = send
+        threads = [threading.Thread(target=lambda x: [
+                   self.cmd.exchange(term, '%s%d' % (x, i)) for i in range(20)],
+                   args=(x,)) for x in 'ab']
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(handled), 40)
+        self.assertEqual(self.written, [x.encode() for x in handled])
+
+    def test_failed_request(self):
+        term = unittest.mock.Mock()
+        term.send.side_effect = [Exception('offline'), 'ok']
+        self.assertRaises(Exception, self.cmd.exchange, term, 'a')
+        self.assertEqual(self.cmd.exchange(term, 'b'), 'ok')
+        self.assertEqual(self.written, [b'ok'])
+
+
+class Escape(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.escape = shell.EscapeDetector(0.5, lambda: self.now)
+
+    def test_one_chunk(self):
+        self.assertEqual(self.escape.feed('ls~~x'), ('ls', True))
+
+    def test_split(self):
+        self.assertEqual(self.escape.feed('ls~'), ('ls', False))
+        self.assertEqual(self.escape.wait_time(), 0.5)
+        self.now = 0.2
+        self.assertEqual(self.escape.feed('~'), ('', True))
+
+    def test_expired(self):
+        self.escape.feed('~')
+        self.now = 0.3
+        self.assertEqual(self.escape.expire(), '')
+        self.now = 0.5
+        self.assertEqual(self.escape.expire(), '~')
+        self.assertIsNone(self.escape.wait_time())
+        self.assertEqual(self.escape.feed('~'), ('', False))
+
+    def test_released(self):
+        self.escape.feed('~')
+        self.assertEqual(self.escape.feed('/'), ('~/', False))
+
+
+class TermIO(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = shell.Shell(api=unittest.mock.Mock())
+        self.cmd.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.cmd.escape = shell.EscapeDetector(0.05)
+        self.cmd.input_view = memoryview(bytearray(4))
+        rfd, self.wfd = os.pipe()
+        fcntl.fcntl(rfd, fcntl.F_SETFL, os.O_NONBLOCK)
+        self.cmd.raw_in = open(rfd, 'rb', buffering=0)
+        self.addCleanup(self.cmd.raw_in.close)
+        self.addCleanup(self.close_writer)
+
+    def close_writer(self):
+        if self.wfd is not None:
+            os.close(self.wfd)
+            self.wfd = None
+
+    def test_split_utf8(self):
+        data = 'h\u00e9llo \u2603'.encode()
+        os.write(self.wfd, data[:2])
+        self.assertEqual(self.cmd.buffered_read(), 'h')
+        os.write(self.wfd, data[2:])
+        keys = ''
+        while len(keys) < 6:  # Several reads of the small buffer.
+            keys += self.cmd.buffered_read()
+        self.assertEqual(keys, '\u00e9llo \u2603')
+
+    def test_held_tilde(self):
+        os.write(self.wfd, b'cd ~')
+        self.assertEqual(self.cmd.buffered_read(), 'cd ')
+        self.assertEqual(self.cmd.buffered_read(), '~')
+
+    def test_escape(self):
+        os.write(self.wfd, b'~')
+        timer = threading.Timer(0.01, os.write, (self.wfd, b'~'))
+        timer.start()
+        self.assertRaises(SystemExit, self.cmd.buffered_read)
+        timer.join()
+
+    def test_eof(self):
+        os.write(self.wfd, b'ls')
+        self.close_writer()
+        self.assertEqual(self.cmd.buffered_read(), 'ls')
+        self.assertRaises(EOFError, self.cmd.buffered_read)
+
+    def test_eof_ends_input(self):
+        self.close_writer()
+        self.cmd.closed = threading.Event()
+        self.cmd.interrupt = os.pipe()
+        for fd in self.cmd.interrupt:
+            self.addCleanup(os.close, fd)
+        self.cmd.input_pipeline(unittest.mock.Mock())
+
+    def test_full_write(self):
+        rfd, wfd = os.pipe()
+        fcntl.fcntl(wfd, fcntl.F_SETFL, os.O_NONBLOCK)
+        data = os.urandom(1 << 20)
+        received = []
+
+        def drain():
+            with open(rfd, 'rb') as f:
+                received.append(f.read())
+
+        reader = threading.Thread(target=drain)
+        reader.start()
+        with open(wfd, 'wb', buffering=0) as f:
+            self.cmd.full_write(f, data)
+        reader.join()
+        self.assertEqual(received, [data])
+
+
+class CSTerm(unittest.TestCase):
+
+    def setUp(self):
+        self.api = unittest.mock.Mock()
+        self.term = shell.CSTermSession(self.api, {"id": '7'}, 123)
+
+    def test_keys(self):
+        self.api.put.return_value = [{"success": True, "data": 'out'}]
+        self.assertEqual(self.term.send('ls'), 'out')
+        self.api.put.assert_called_with(
+            'remote/control/csterm/ecmcli-123/k', 'ls', id='7')
+
+    def test_size(self):
+        self.api.put.return_value = [{"success": True, "data": {
+            "w": 80, "h": 24, "k": 'out'}}]
+        self.assertEqual(self.term.send('', (80, 24)), 'out')
+        self.api.put.assert_called_with('remote/control/csterm/ecmcli-123/',
+            {"w": 80, "h": 24, "k": ''}, id='7')
+
+    def test_failure(self):
+        self.api.put.return_value = [{"success": False,
+                                      "exception": 'offline',
+                                      "reason": 'Router is not connected'}]
+        self.assertRaises(Exception, self.term.send, 'ls')
+
+
+class Execute(unittest.TestCase):
+
+    prompt = '[admin@r1: /]$ '
+
+    def setUp(self):
+        self.now = 0
+        self.term = shell.CSTermSession(unittest.mock.Mock(), {"id": '1'}, 1)
+        self.term.send = unittest.mock.Mock()
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+    def execute(self, responses, idle=5, timeout=60):
+        self.term.send.side_effect = lambda *args: responses.pop(0) \
+            if responses else ''
+        return self.term.execute('seq 2', idle, timeout, self.clock,
+                                 self.sleep)
+
+    def test_prompt(self):
+        output = self.execute(['\r\n' + self.prompt, 'seq 2\r\n', '',
+                               '1\r\n2\r\n' + self.prompt])
+        self.assertEqual(output, '1\n2')
+        self.assertEqual(self.term.send.call_args_list[:2], [
+            unittest.mock.call('\n', self.term.size),
+            unittest.mock.call('seq 2\n', None)])
+        self.assertLess(self.now, 1)
+
+    def test_idle(self):
+        output = self.execute(['\r\n' + self.prompt, 'seq 2\r\n1\r\n'],
+                              idle=3)
+        self.assertEqual(output, '1\n')
+        self.assertAlmostEqual(self.now, 3)
+
+    def test_timeout(self):
+        responses = ['\r\n' + self.prompt, 'seq 2\r\n'] + ['1\r\n'] * 1000
+        with self.assertRaises(TimeoutError) as cm:
+            self.execute(responses, timeout=10)
+        self.assertAlmostEqual(self.now, 10)
+        self.assertTrue(cm.exception.args[0].startswith('1\n1\n'))
+        self.term.send.assert_called_with('\x03')
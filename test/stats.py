@@ -0,0 +1,48 @@
+import unittest
+from ecmcli import api, stats
+
+
+class Histogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        h = stats.Histogram()
+        for x in range(1, 1001):
+            h.add(x)
+        self.assertEqual(h.count, 1000)
+        self.assertEqual(h.min, 1)
+        self.assertEqual(h.max, 1000)
+        for pct in (50, 95, 99):
+            self.assertAlmostEqual(h.percentile(pct), pct * 10,
+                                   delta=pct * 10 * 0.02)
+        self.assertEqual(h.percentile(100), 1000)
+
+    def test_empty(self):
+        self.assertIsNone(stats.Histogram().percentile(50))
+
+    def test_merge(self):
+        a, b = stats.Histogram(), stats.Histogram()
+        a.add(1)
+        b.add(3)
+        a.merge(b)
+        self.assertEqual((a.count, a.min, a.max, a.mean), (2, 1, 3, 2))
+
+
+class RequestStats(unittest.TestCase):
+
+    def test_events(self):
+        service = api.Eventer()
+        service.add_events(['start_request', 'finish_request'])
+        rs = stats.RequestStats(service)
+        rs.attach()
+        for resource in ('routers', 'routers', 'groups'):
+            request = {"resource": resource, "start": 0, "elapsed": 0.1,
+                       "bytes": 100, "wire_bytes": 20, "cached": False,
+                       "paged": True}
+            service.fire_event('start_request', request=request)
+            service.fire_event('finish_request', request=request)
+        self.assertEqual(rs.resources['routers'].requests, 2)
+        self.assertEqual(rs.resources['routers'].bytes, 200)
+        self.assertEqual(rs.resources['routers'].wire_bytes, 40)
+        self.assertEqual(rs.resources['groups'].pages, 1)
+        rs.detach()
+        self.assertFalse(service.events['finish_request'])
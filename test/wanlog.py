@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ecmcli import wanlog
+
+
+class CounterRate(unittest.TestCase):
+
+    def test_rate(self):
+        rate = wanlog.CounterRate()
+        self.assertIsNone(rate.update(10, 1000, 500))
+        self.assertEqual(rate.update(12, 3000, 1500), (8000, 4000))
+
+    def test_reset(self):
+        rate = wanlog.CounterRate()
+        rate.update(10, 1000, 500)
+        self.assertIsNone(rate.update(11, 10, 10))
+        self.assertEqual(rate.update(12, 20, 20), (80, 80))
+
+
+class Recording(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.filename = os.path.join(tmp, 'wan.rec')
+
+    def test_roundtrip(self):
+        with wanlog.Writer(self.filename) as w:
+            w.write(1000.5, [(1, 10, 20), (2, 30, 40)])
+            w.write(1001.5, [(1, 11, 21)])
+            w.write(1002.5, [])
+        self.assertEqual(list(wanlog.read(self.filename)), [
+            (1000.5, 1, 10, 20),
+            (1000.5, 2, 30, 40),
+            (1001.5, 1, 11, 21)
+        ])
+
+    def test_append(self):
+        with wanlog.Writer(self.filename) as w:
+            w.write(1, [(1, 10, 20)])
+        with wanlog.Writer(self.filename) as w:
+            w.write(2, [(1, 11, 21)])
+        self.assertEqual(len(list(wanlog.read(self.filename))), 2)
+
+    def test_invalid(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'not a recording')
+        self.assertRaises(ValueError, wanlog.Writer, self.filename)
+        self.assertRaises(ValueError, list, wanlog.read(self.filename))
+
+    def test_truncated(self):
+        with wanlog.Writer(self.filename) as w:
+            w.write(1, [(1, 10, 20)])
+            w.write(2, [(1, 11, 21), (2, 11, 21)])
+        with open(self.filename, 'r+b') as f:
+            f.truncate(os.path.getsize(self.filename) - 1)
+        self.assertEqual(list(wanlog.read(self.filename)), [(1, 1, 10, 20)])
+
+    def test_bounded_buffer(self):
+        now = [0]
+        w = wanlog.Writer(self.filename, clock=lambda: now[0])
+        self.addCleanup(w.close)
+        w.buffer_size = wanlog.block.size + wanlog.sample.size * 10
+        w.write(1, [(1, 10, 20)])
+        self.assertTrue(w.buffer)
+        w.write(2, [(1, 10, 20)] * 10)
+        self.assertFalse(w.buffer)
+        w.write(3, [(1, 10, 20)])
+        now[0] += w.flush_interval
+        w.write(4, [(1, 10, 20)])
+        self.assertFalse(w.buffer)
+        self.assertEqual(len(list(wanlog.read(self.filename))), 13)
+
+
+class Summary(unittest.TestCase):
+
+    def test_stats(self):
+        s = wanlog.RateSummary()
+        for bps in range(1, 101):
+            s.add(bps * 1000, 1)
+        s.add(0, 1)
+        self.assertEqual(s.count, 101)
+        self.assertEqual(s.min, 0)
+        self.assertEqual(s.max, 100000)
+        self.assertAlmostEqual(s.avg, 5050000 / 101)
+        for pct, expect in ((50, 50000), (95, 95000), (99, 99000)):
+            self.assertLess(abs(s.percentile(pct) / expect - 1), 0.02)
+        self.assertEqual(s.percentile(0), 0)
+        self.assertEqual(s.percentile(100), 100000)
+
+    def test_time_weighted(self):
+        s = wanlog.RateSummary()
+        s.add(1000, 3)
+        s.add(5000, 1)
+        self.assertEqual(s.avg, 2000)
+
+    def test_summarize(self):
+        samples = [
+            (0, 1, 0, 0),
+            (0, 2, 0, 0),
+            (1, 1, 100, 50),
+            (2, 1, 300, 50),
+            (2, 2, 10, 10),
+            (3, 2, 5, 5),  # Counter reset
+        ]
+        summaries = wanlog.summarize(iter(samples))
+        rx, tx = summaries[1]
+        self.assertEqual((rx.min, rx.max, rx.avg), (800, 1600, 1200))
+        self.assertEqual((tx.min, tx.max, tx.avg), (0, 400, 200))
+        self.assertEqual(summaries[2][0].count, 1)
+        self.assertEqual(summaries[2][0].avg, 40)
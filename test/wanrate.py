@@ -0,0 +1,93 @@
+import unittest
+import unittest.mock
+from ecmcli.commands import wanrate
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class FixedRate(unittest.TestCase):
+
+    def test_latency_compensation(self):
+        clock = FakeClock()
+        ticks = wanrate.fixed_rate(1, clock=clock, sleep=clock.sleep)
+        self.assertEqual(next(ticks), 100)
+        clock.now += 0.3  # Poll latency
+        self.assertEqual(next(ticks), 101)
+        self.assertAlmostEqual(clock.sleeps[-1], 0.7)
+        clock.now += 0.9
+        self.assertEqual(next(ticks), 102)
+        self.assertAlmostEqual(clock.sleeps[-1], 0.1)
+
+    def test_skip_missed(self):
+        clock = FakeClock()
+        ticks = wanrate.fixed_rate(1, clock=clock, sleep=clock.sleep)
+        next(ticks)
+        clock.now += 2.5
+        self.assertEqual(next(ticks), 103)
+        self.assertAlmostEqual(clock.sleeps[-1], 0.5)
+
+
+class PollerGroups(unittest.TestCase):
+
+    def setUp(self):
+        api = unittest.mock.Mock()
+        api.remote_batch_size = 100
+        self.cmd = wanrate.WanRate(api=api)
+
+    def test_default(self):
+        ids = list(map(str, range(250)))
+        groups = self.cmd.poller_groups(ids)
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(','.join(groups).split(','), ids)
+
+    def test_pollers(self):
+        ids = list(map(str, range(10)))
+        self.assertEqual(len(self.cmd.poller_groups(ids, 4)), 4)
+        self.assertEqual(len(self.cmd.poller_groups(ids, 40)), 10)
+
+
+class Args(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = wanrate.WanRate(api=unittest.mock.Mock())
+
+    def test_sampletime(self):
+        args = self.cmd.argparser.parse_args(['-s', '0.5'])
+        self.assertEqual(args.sampletime, 0.5)
+        for bad in ('0', '-1', 'nan', 'x'):
+            with unittest.mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, self.cmd.argparser.parse_args,
+                                  ['-s', bad])
+
+
+class Monitor(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = wanrate.WanRate(api=unittest.mock.Mock())
+        self.cmd.api.remote_batch_size = 100
+        self.cmd.tabulate = unittest.mock.Mock()
+        self.routers = [{"id": '1', "name": 'r1'}, {"id": '2', "name": 'r2'}]
+
+    def test_poll_error(self):
+        error = Exception('Read timed out. (read timeout=2)')
+        self.cmd.api.fanout.return_value = [
+            unittest.mock.Mock(error=error, item='1,2')]
+        args = self.cmd.argparser.parse_args([])
+        with unittest.mock.patch.object(wanrate, 'fixed_rate',
+                                        return_value=[0]):
+            self.cmd.monitor(args, self.routers, None)
+        self.cmd.api.fanout.assert_called_once_with(self.cmd.poll, ['1,2'])
+        table = self.cmd.tabulate.return_value
+        table.print_row.assert_called_once_with(['ERR', 'ERR'])